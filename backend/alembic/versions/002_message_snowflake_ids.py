@@ -0,0 +1,43 @@
+"""use application-assigned 64-bit ids for messages
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # sqlite integer primary keys are already 64-bit, nothing to change there
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    
+    # ids now come from app.core.ids, drop the sequence default
+    op.alter_column(
+        'messages', 'id',
+        existing_type=sa.Integer(),
+        type_=sa.BigInteger(),
+        server_default=None,
+        existing_nullable=False
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    
+    op.alter_column(
+        'messages', 'id',
+        existing_type=sa.BigInteger(),
+        type_=sa.Integer(),
+        existing_nullable=False
+    )
@@ -0,0 +1,23 @@
+"""add (room_id, id) index on messages for keyset pagination
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_messages_room_id_id', 'messages', ['room_id', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_room_id_id', table_name='messages')
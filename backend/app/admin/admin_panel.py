@@ -9,8 +9,14 @@ from starlette.responses import RedirectResponse
 from app.models.user import User
 from app.models.chat import ChatRoom, Message
 from app.models.password_reset import PasswordResetToken
-from app.core.security import verify_password, verify_token
+from app.core.security import verify_token
+from app.core.passwords import password_hasher
 from app.database.database import SessionLocal
+from app.chat.membership import membership_cache
+from app.auth.principal import principal_cache
+from app.chat.recent import recent_messages
+from app.chat.message_log import message_log
+from app.chat.presence import presence
 
 
 class UserAdmin(ModelView, model=User):
@@ -32,12 +38,24 @@ class UserAdmin(ModelView, model=User):
         User.last_seen
     ]
     
-    # fields that can be edited (exclude password)
-    form_columns = [User.username, User.email, User.is_admin, User.is_online]
+    # online status lives in the presence set, the column is not kept up to date
+    column_formatters = {User.is_online: lambda model, attribute: presence.is_online(model.id)}
+    column_formatters_detail = column_formatters
+    
+    # fields that can be edited (exclude password and online status)
+    form_columns = [User.username, User.email, User.is_admin]
     
     name = "User"
     name_plural = "Users"
     icon = "fa-solid fa-user"
+    
+    # cached principals carry username and is_admin
+    async def after_model_change(self, data: dict, model, is_created: bool, request: Request) -> None:
+        principal_cache.invalidate(model.id)
+    
+    async def after_model_delete(self, model, request: Request) -> None:
+        await membership_cache.invalidate_user_async(model.id)
+        principal_cache.invalidate(model.id)
 
 
 class ChatRoomAdmin(ModelView, model=ChatRoom):
@@ -71,6 +89,15 @@ class ChatRoomAdmin(ModelView, model=ChatRoom):
     name = "Chat Room"
     name_plural = "Chat Rooms"
     icon = "fa-solid fa-comments"
+    
+    # keep cached membership answers in line with admin edits
+    async def after_model_change(self, data: dict, model, is_created: bool, request: Request) -> None:
+        await membership_cache.invalidate_room_async(model.id)
+    
+    async def after_model_delete(self, model, request: Request) -> None:
+        await membership_cache.invalidate_room_async(model.id)
+        recent_messages.invalidate(model.id)
+        await message_log.invalidate(model.id)
 
 
 class MessageAdmin(ModelView, model=Message):
@@ -114,6 +141,15 @@ class MessageAdmin(ModelView, model=Message):
     name = "Message"
     name_plural = "Messages"
     icon = "fa-solid fa-message"
+    
+    # cached room tails and replay streams must not keep edited or deleted messages
+    async def after_model_change(self, data: dict, model, is_created: bool, request: Request) -> None:
+        recent_messages.invalidate(model.room_id)
+        await message_log.invalidate(model.room_id)
+    
+    async def after_model_delete(self, model, request: Request) -> None:
+        recent_messages.invalidate(model.room_id)
+        await message_log.invalidate(model.room_id)
 
 
 class PasswordResetTokenAdmin(ModelView, model=PasswordResetToken):
@@ -168,7 +204,10 @@ class AdminAuth(AuthenticationBackend):
         try:
             user = db.query(User).filter(User.username == username).first()
             
-            if user and verify_password(password, user.hashed_password) and user.is_admin:
+            if (
+                user and user.is_admin
+                and await password_hasher.verify_async(password, user.hashed_password)
+            ):
                 # store user_id in session
                 request.session.update({"user_id": user.id})
                 return True
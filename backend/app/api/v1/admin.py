@@ -3,9 +3,9 @@ Admin routes using class-based views for managing users, chat rooms, and message
 These routes are protected and require admin access
 """
 from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from app.database.database import get_db
+from app.database.database import get_async_db
 from app.api.v1.admin_views import AdminViews, UserAdmin, ChatRoomAdmin, MessageAdmin
 from app.auth.dependencies import get_current_admin_user
 from app.models.user import User
@@ -18,22 +18,22 @@ router = APIRouter(dependencies=[Depends(get_current_admin_user)])
 async def list_users(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """List all users with pagination"""
-    return AdminViews.list_users(skip, limit, db)
+    return await AdminViews.list_users(skip, limit, db)
 
 
 @router.get("/users/{user_id}", response_model=UserAdmin)
-async def get_user(user_id: int, db: Session = Depends(get_db)):
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get a specific user by ID"""
-    return AdminViews.get_user(user_id, db)
+    return await AdminViews.get_user(user_id, db)
 
 
 @router.delete("/users/{user_id}")
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Delete a user by ID"""
-    return AdminViews.delete_user(user_id, db)
+    return await AdminViews.delete_user(user_id, db)
 
 
 # chatroom management routes
@@ -41,22 +41,22 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
 async def list_chat_rooms(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """List all chat rooms with pagination"""
-    return AdminViews.list_chat_rooms(skip, limit, db)
+    return await AdminViews.list_chat_rooms(skip, limit, db)
 
 
 @router.get("/chat-rooms/{room_id}", response_model=ChatRoomAdmin)
-async def get_chat_room(room_id: int, db: Session = Depends(get_db)):
+async def get_chat_room(room_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get a specific chat room by ID"""
-    return AdminViews.get_chat_room(room_id, db)
+    return await AdminViews.get_chat_room(room_id, db)
 
 
 @router.delete("/chat-rooms/{room_id}")
-async def delete_chat_room(room_id: int, db: Session = Depends(get_db)):
+async def delete_chat_room(room_id: int, db: AsyncSession = Depends(get_async_db)):
     """Delete a chat room by ID"""
-    return AdminViews.delete_chat_room(room_id, db)
+    return await AdminViews.delete_chat_room(room_id, db)
 
 
 # message management routes
@@ -65,26 +65,47 @@ async def list_messages(
     room_id: Optional[int] = None,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """List all messages with optional room filter and pagination"""
-    return AdminViews.list_messages(room_id, skip, limit, db)
+    return await AdminViews.list_messages(room_id, skip, limit, db)
 
 
 @router.get("/messages/{message_id}", response_model=MessageAdmin)
-async def get_message(message_id: int, db: Session = Depends(get_db)):
+async def get_message(message_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get a specific message by ID"""
-    return AdminViews.get_message(message_id, db)
+    return await AdminViews.get_message(message_id, db)
 
 
 @router.delete("/messages/{message_id}")
-async def delete_message(message_id: int, db: Session = Depends(get_db)):
+async def delete_message(message_id: int, db: AsyncSession = Depends(get_async_db)):
     """Delete a message by ID"""
-    return AdminViews.delete_message(message_id, db)
+    return await AdminViews.delete_message(message_id, db)
 
 
 # database statistics route
 @router.get("/stats")
-async def get_database_stats(db: Session = Depends(get_db)):
+async def get_database_stats(db: AsyncSession = Depends(get_async_db)):
     """Get database statistics"""
-    return AdminViews.get_database_stats(db)
+    return await AdminViews.get_database_stats(db)
+
+
+# websocket statistics route
+@router.get("/websocket-stats")
+async def get_websocket_stats():
+    """Get websocket connection and send queue statistics"""
+    return AdminViews.get_websocket_stats()
+
+
+# cache statistics route
+@router.get("/cache-stats")
+async def get_cache_stats():
+    """Get principal, room membership and recent messages cache statistics"""
+    return AdminViews.get_cache_stats()
+
+
+# service statistics route
+@router.get("/service-stats")
+async def get_service_stats():
+    """Get token revocation, rate limiter, password hasher, email queue, message writer, message log and client message id statistics"""
+    return AdminViews.get_service_stats()
@@ -2,11 +2,27 @@
 Class-based views for admin operations
 """
 from fastapi import Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from app.database.database import get_db
+from app.database.database import get_async_db
+from app.models.chat import room_memberships
 from app.models.user import User
 from app.models.chat import ChatRoom, Message
+from app.chat.websocket import manager
+from app.chat.membership import membership_cache
+from app.auth.principal import principal_cache
+from app.core.tokens import token_verifier
+from app.auth.revocation import token_revocation
+from app.core.rate_limit import rate_limiter
+from app.core.email_queue import email_queue
+from app.core.passwords import password_hasher
+from app.chat.recent import recent_messages
+from app.chat.message_log import message_log
+from app.chat.persistence import message_writer
+from app.chat.idempotency import client_message_ids
+from app.chat.presence import presence
+from app.chat.typing_indicators import typing_indicators
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -50,15 +66,36 @@ class MessageAdmin(BaseModel):
         from_attributes = True
 
 
+def user_admin(user: User) -> UserAdmin:
+    """Admin view of a user, online status from the presence cache"""
+    view = UserAdmin.model_validate(user)
+    view.is_online = presence.is_online(user.id)
+    return view
+
+
+def member_count():
+    """Correlated count of a room's members"""
+    return select(func.count()).where(
+        room_memberships.c.room_id == ChatRoom.id
+    ).correlate(ChatRoom).scalar_subquery()
+
+
+def message_count():
+    """Correlated count of a room's messages, on the (room_id, id) index"""
+    return select(func.count(Message.id)).where(
+        Message.room_id == ChatRoom.id
+    ).correlate(ChatRoom).scalar_subquery()
+
+
 class AdminViews:
     """Class-based views for admin operations"""
     
     # user management
     @staticmethod
-    def list_users(
+    async def list_users(
         skip: int = Query(0, ge=0),
         limit: int = Query(100, ge=1, le=1000),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
     ) -> List[UserAdmin]:
         """
         List all users with pagination
@@ -66,13 +103,13 @@ class AdminViews:
         Time Complexity: O(n) where n is limit
         Space Complexity: O(n)
         """
-        users = db.query(User).offset(skip).limit(limit).all()
-        return users
+        users = await db.scalars(select(User).offset(skip).limit(limit))
+        return [user_admin(user) for user in users.all()]
     
     @staticmethod
-    def get_user(
+    async def get_user(
         user_id: int,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
     ) -> UserAdmin:
         """
         Get a specific user by ID
@@ -80,15 +117,15 @@ class AdminViews:
         Time Complexity: O(1) with index
         Space Complexity: O(1)
         """
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        return user
+        return user_admin(user)
     
     @staticmethod
-    def delete_user(
+    async def delete_user(
         user_id: int,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
     ) -> dict:
         """
         Delete a user by ID
@@ -96,72 +133,79 @@ class AdminViews:
         Time Complexity: O(1) with index
         Space Complexity: O(1)
         """
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        db.delete(user)
-        db.commit()
+        await db.delete(user)
+        await db.commit()
+        await membership_cache.invalidate_user_async(user_id)
+        principal_cache.invalidate(user_id)
         return {"message": f"User {user_id} deleted successfully"}
     
     # chatroom management
     @staticmethod
-    def list_chat_rooms(
+    async def list_chat_rooms(
         skip: int = Query(0, ge=0),
         limit: int = Query(100, ge=1, le=1000),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
     ) -> List[ChatRoomAdmin]:
         """
         List all chat rooms with pagination
         
-        Time Complexity: O(n * m) where n is limit, m is avg members per room
+        Time Complexity: O(n log m) where n is limit, m is messages per room
         Space Complexity: O(n)
         """
-        rooms = db.query(ChatRoom).offset(skip).limit(limit).all()
+        rows = await db.execute(
+            select(ChatRoom, member_count(), message_count()).offset(skip).limit(limit)
+        )
         
         result = []
-        for room in rooms:
+        for room, members, messages in rows:
             result.append(ChatRoomAdmin(
                 id=room.id,
                 name=room.name,
                 room_type=room.room_type.value,
                 created_by=room.created_by,
                 created_at=room.created_at,
-                member_count=len(room.members),
-                message_count=len(room.messages)
+                member_count=members,
+                message_count=messages
             ))
         
         return result
     
     @staticmethod
-    def get_chat_room(
+    async def get_chat_room(
         room_id: int,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
     ) -> ChatRoomAdmin:
         """
         Get a specific chat room by ID
         
-        Time Complexity: O(m) where m is number of members
+        Time Complexity: O(log m) where m is number of messages in the room
         Space Complexity: O(1)
         """
-        room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
-        if not room:
+        row = (await db.execute(
+            select(ChatRoom, member_count(), message_count()).where(ChatRoom.id == room_id)
+        )).first()
+        if not row:
             raise HTTPException(status_code=404, detail="Chat room not found")
         
+        room, members, messages = row
         return ChatRoomAdmin(
             id=room.id,
             name=room.name,
             room_type=room.room_type.value,
             created_by=room.created_by,
             created_at=room.created_at,
-            member_count=len(room.members),
-            message_count=len(room.messages)
+            member_count=members,
+            message_count=messages
         )
     
     @staticmethod
-    def delete_chat_room(
+    async def delete_chat_room(
         room_id: int,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
     ) -> dict:
         """
         Delete a chat room by ID
@@ -169,21 +213,24 @@ class AdminViews:
         Time Complexity: O(1) with index
         Space Complexity: O(1)
         """
-        room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+        room = await db.get(ChatRoom, room_id)
         if not room:
             raise HTTPException(status_code=404, detail="Chat room not found")
         
-        db.delete(room)
-        db.commit()
+        await db.delete(room)
+        await db.commit()
+        await membership_cache.invalidate_room_async(room_id)
+        recent_messages.invalidate(room_id)
+        await message_log.invalidate(room_id)
         return {"message": f"Chat room {room_id} deleted successfully"}
     
     # message management
     @staticmethod
-    def list_messages(
+    async def list_messages(
         room_id: Optional[int] = None,
         skip: int = Query(0, ge=0),
         limit: int = Query(100, ge=1, le=1000),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
     ) -> List[MessageAdmin]:
         """
         List all messages with optional room filter and pagination
@@ -191,18 +238,18 @@ class AdminViews:
         Time Complexity: O(n log n) where n is limit (for ordering)
         Space Complexity: O(n)
         """
-        query = db.query(Message)
+        query = select(Message)
         
         if room_id:
-            query = query.filter(Message.room_id == room_id)
+            query = query.where(Message.room_id == room_id)
         
-        messages = query.order_by(Message.timestamp.desc()).offset(skip).limit(limit).all()
-        return messages
+        messages = await db.scalars(query.order_by(Message.timestamp.desc()).offset(skip).limit(limit))
+        return messages.all()
     
     @staticmethod
-    def get_message(
+    async def get_message(
         message_id: int,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
     ) -> MessageAdmin:
         """
         Get a specific message by ID
@@ -210,15 +257,15 @@ class AdminViews:
         Time Complexity: O(1) with index
         Space Complexity: O(1)
         """
-        message = db.query(Message).filter(Message.id == message_id).first()
+        message = await db.get(Message, message_id)
         if not message:
             raise HTTPException(status_code=404, detail="Message not found")
         return message
     
     @staticmethod
-    def delete_message(
+    async def delete_message(
         message_id: int,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
     ) -> dict:
         """
         Delete a message by ID
@@ -226,29 +273,82 @@ class AdminViews:
         Time Complexity: O(1) with index
         Space Complexity: O(1)
         """
-        message = db.query(Message).filter(Message.id == message_id).first()
+        message = await db.get(Message, message_id)
         if not message:
             raise HTTPException(status_code=404, detail="Message not found")
         
-        db.delete(message)
-        db.commit()
+        room_id = message.room_id
+        await db.delete(message)
+        await db.commit()
+        recent_messages.invalidate(room_id)
+        await message_log.invalidate(room_id)
         return {"message": f"Message {message_id} deleted successfully"}
     
     # database statistics
     @staticmethod
-    def get_database_stats(db: Session = Depends(get_db)) -> dict:
+    async def get_database_stats(db: AsyncSession = Depends(get_async_db)) -> dict:
         """
         Get database statistics
         
         Time Complexity: O(1) - count operations with indexes
         Space Complexity: O(1)
         """
-        user_count = db.query(User).count()
-        room_count = db.query(ChatRoom).count()
-        message_count = db.query(Message).count()
+        user_count = await db.scalar(select(func.count(User.id)))
+        room_count = await db.scalar(select(func.count(ChatRoom.id)))
+        message_count = await db.scalar(select(func.count(Message.id)))
         
         return {
             "users": user_count,
             "chat_rooms": room_count,
             "messages": message_count
         }
+    
+    # websocket statistics
+    @staticmethod
+    def get_websocket_stats() -> dict:
+        """
+        Get websocket connection, outbound queue, presence and typing statistics for this node
+        
+        Time Complexity: O(c) where c is the number of local connections
+        Space Complexity: O(c)
+        """
+        metrics = manager.get_metrics()
+        metrics["presence"] = presence.get_stats()
+        metrics["typing"] = typing_indicators.get_stats()
+        return metrics
+    
+    # cache statistics
+    @staticmethod
+    def get_cache_stats() -> dict:
+        """
+        Get hit/miss counters of the in-process caches on this node
+        
+        Time Complexity: O(1)
+        Space Complexity: O(1)
+        """
+        return {
+            "principals": principal_cache.get_stats(),
+            "token_claims": token_verifier.get_stats(),
+            "room_memberships": membership_cache.get_stats(),
+            "recent_messages": recent_messages.get_stats()
+        }
+    
+    # service statistics
+    @staticmethod
+    def get_service_stats() -> dict:
+        """
+        Get counters of the token revocation, rate limiting, password hashing, email delivery,
+        message persistence, replay log and client message ids on this node
+        
+        Time Complexity: O(1)
+        Space Complexity: O(1)
+        """
+        return {
+            "token_revocation": token_revocation.get_stats(),
+            "rate_limits": rate_limiter.get_stats(),
+            "password_hasher": password_hasher.get_stats(),
+            "email_queue": email_queue.get_stats(),
+            "message_writer": message_writer.get_stats(),
+            "message_log": message_log.get_stats(),
+            "client_message_ids": client_message_ids.get_stats()
+        }
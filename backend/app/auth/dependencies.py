@@ -1,51 +1,103 @@
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database.database import get_db
-from app.core.security import verify_token
+from app.database.database import get_db, get_async_db
+from app.core.security import verify_token, verify_token_async
 from app.models.user import User
+from app.auth.principal import Principal, principal_cache
 
 security = HTTPBearer()
 
+
+def _access_user_id(payload: Optional[dict]) -> Optional[int]:
+    # refresh tokens are only good for /auth/refresh
+    if payload is None or payload.get("typ") == "refresh":
+        return None
+    
+    try:
+        return int(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+
+
+def user_id_from_token(token: str):
+    """
+    user id from the sub claim of a valid jwt token, None if invalid
+    """
+    return _access_user_id(verify_token(token))
+
+
+async def user_id_from_token_async(token: str):
+    """
+    user_id_from_token for the event loop, never blocks it on redis
+    """
+    return _access_user_id(await verify_token_async(token))
+
+
+def _require_user_id(user_id: Optional[int]) -> int:
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user_id
+
+
+def _get_user_id(credentials: HTTPAuthorizationCredentials) -> int:
+    return _require_user_id(user_id_from_token(credentials.credentials))
+
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> User:
     """
     dependency to get the current authenticated user from jwt token
+    
+    Loads the full User row, use get_current_principal when only the
+    id, username or admin flag are needed
     """
-    token = credentials.credentials
-    payload = verify_token(token)
+    user_id = _get_user_id(credentials)
     
-    if payload is None:
+    user = db.query(User).filter(User.id == user_id).first()
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
+            detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user_id: int = payload.get("sub")
-    if user_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    return user
+
+
+async def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    """
+    dependency to get a cached snapshot of the current authenticated user
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
+    Served from the principal cache, the database is only hit on a miss
+    """
+    user_id = _require_user_id(await user_id_from_token_async(credentials.credentials))
+    
+    principal = await principal_cache.load_async(db, user_id)
+    if principal is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return user
+    return principal
 
 
 def get_current_admin_user(
-    current_user: User = Depends(get_current_user)
-) -> User:
+    current_user: Principal = Depends(get_current_principal)
+) -> Principal:
     """
     dependency to verify the current user is an admin
     """
@@ -62,7 +62,7 @@ class PasswordResetService:
         
         self.db.commit()
         
-        # send email with reset link
+        # queue email with reset link, delivered in the background (app.core.email_queue)
         if send_email:
             try:
                 email_service.send_password_reset_email(email, token)
@@ -0,0 +1,128 @@
+"""
+Cached snapshots of authenticated users
+
+Most endpoints only need to know who is calling and whether they are an
+admin. A Principal is a small immutable snapshot of those fields, kept in an
+LRU cache with a TTL so authorizing a request does not need a users query.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.user import User
+import threading
+import time
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Immutable view of the authenticated user"""
+    id: int
+    username: str
+    is_admin: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, username=user.username, is_admin=bool(user.is_admin))
+
+
+class PrincipalCache:
+    """
+    LRU cache of principals by user id, entries expire after ttl seconds
+
+    The app loads principals on the event loop (load_async), the lock is for
+    load(), which takes a sync Session and may run on worker threads.
+    """
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries or settings.PRINCIPAL_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.PRINCIPAL_CACHE_TTL_SECONDS
+        # user id -> (principal, expires_at), least recently used first
+        self._entries: "OrderedDict[int, Tuple[Principal, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        """
+        Cached principal, or None when unknown or expired
+
+        Time Complexity: O(1)
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return principal
+
+    def put(self, principal: Principal):
+        with self._lock:
+            self._entries[principal.id] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """
+        Forget a user after it was changed or deleted
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self, db: Session, user_id: int) -> Optional[Principal]:
+        """
+        Principal for a user id, queried from the database on a miss
+
+        Returns None when the user does not exist, missing users are not cached.
+        """
+        principal = self.get(user_id)
+        if principal is not None:
+            self.hits += 1
+            return principal
+        return self._load_missing(db, user_id)
+
+    async def load_async(self, db: AsyncSession, user_id: int) -> Optional[Principal]:
+        """
+        load() for async sessions
+        """
+        principal = self.get(user_id)
+        if principal is not None:
+            self.hits += 1
+            return principal
+        return await db.run_sync(self._load_missing, user_id)
+
+    def _load_missing(self, db: Session, user_id: int) -> Optional[Principal]:
+        self.misses += 1
+        row = db.query(User.id, User.username, User.is_admin).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        principal = Principal(id=row.id, username=row.username, is_admin=bool(row.is_admin))
+        self.put(principal)
+        return principal
+
+    def get_stats(self) -> dict:
+        """
+        Hit/miss counters for monitoring
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# global principal cache instance
+principal_cache = PrincipalCache()
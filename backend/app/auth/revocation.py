@@ -0,0 +1,384 @@
+"""
+Revocation of JWTs before they expire
+
+Every token carries a jti (its own id) and a fam (the id of the login it
+descends from, shared by all tokens refreshed from it). Revoking a jti or a
+whole family puts it on a denylist until the last token it covers expires:
+
+redis:  revoked:{id} keys with the remaining lifetime as TTL, plus the
+        revoked_tokens sorted set (scored by expiry) the nodes sync from
+memory: a dict in this process, for single-node setups and tests
+
+Checking the denylist on every request would add a Redis round-trip to
+each of them, so a bloom filter of the revoked ids sits in front: a token
+that is not revoked (nearly every token) is answered from memory, and only
+a filter hit is confirmed with the store. Each node rebuilds its filter
+from the sorted set every REVOCATION_SYNC_SECONDS, so a revocation made on
+another node applies there within that interval (immediately on the node
+that made it). Rebuilding also drops expired ids.
+
+A revocation the store could not take (Redis down) is kept in this process
+and enforced here, and pushed to the store again on every sync until it
+gets there.
+
+Refresh tokens are single use. Refreshing marks the old jti used atomically;
+a refresh token that was already used means it was copied, and the whole
+family is revoked, logging out both the thief and the victim.
+"""
+from typing import Dict, Iterable, List, Optional
+from app.core.config import settings
+from app.database.redis_client import get_redis
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REVOKED_SET_KEY = "revoked_tokens"
+
+
+def jti_key(jti: str) -> str:
+    return f"jti:{jti}"
+
+
+def family_key(family: str) -> str:
+    return f"fam:{family}"
+
+
+def used_key(jti: str) -> str:
+    # spent refresh tokens, kept apart from revoked ones so a replay still
+    # reaches reuse detection instead of failing as merely revoked; these
+    # are only looked up on refresh, so they stay out of the bloom filter
+    return f"used:{jti}"
+
+
+class BloomFilter:
+    """
+    Fixed-size bloom filter of strings, sized for a capacity and error rate
+    """
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # double hashing, two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class MemoryDenylist:
+    """
+    Revoked ids in this process, expiring at their expiry time
+    """
+    def __init__(self):
+        # id -> expiry (unix time)
+        self._entries: Dict[str, float] = {}
+        # spent refresh token marker -> expiry
+        self._used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: str, expires_at: float) -> bool:
+        with self._lock:
+            self._entries[key] = expires_at
+            return True
+
+    def contains(self, key: str) -> bool:
+        expires_at = self._entries.get(key)
+        return expires_at is not None and expires_at > time.time()
+
+    def mark_used(self, key: str, expires_at: float) -> bool:
+        now = time.time()
+        with self._lock:
+            current = self._used.get(key)
+            if current is not None and current > now:
+                return False
+            if len(self._used) > 10000:
+                self._used = {k: exp for k, exp in self._used.items() if exp > now}
+            self._used[key] = expires_at
+            return True
+
+    def active(self) -> List[str]:
+        now = time.time()
+        with self._lock:
+            self._entries = {k: exp for k, exp in self._entries.items() if exp > now}
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._used.clear()
+
+
+class RedisDenylist:
+    """
+    Revoked ids shared by all nodes through Redis
+    """
+    def __init__(self, redis_client=None):
+        self._redis = redis_client
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def add(self, key: str, expires_at: float) -> bool:
+        """
+        Deny an id until expires_at
+
+        One round-trip: SET with the remaining lifetime as TTL, ZADD to the
+        set the nodes sync from, and a trim of its expired members.
+        """
+        now = time.time()
+        ttl = max(1, math.ceil(expires_at - now))
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(f"revoked:{key}", 1, ex=ttl)
+        pipe.zadd(REVOKED_SET_KEY, {key: expires_at})
+        pipe.zremrangebyscore(REVOKED_SET_KEY, "-inf", now)
+        added, _, _ = pipe.execute()
+        return bool(added)
+
+    def contains(self, key: str) -> bool:
+        return bool(self.redis.exists(f"revoked:{key}"))
+
+    def mark_used(self, key: str, expires_at: float) -> bool:
+        """
+        SET NX with the remaining lifetime as TTL, False if it was already set
+        """
+        ttl = max(1, math.ceil(expires_at - time.time()))
+        return bool(self.redis.set(key, 1, ex=ttl, nx=True))
+
+    def active(self) -> List[str]:
+        members = self.redis.zrangebyscore(REVOKED_SET_KEY, time.time(), "+inf")
+        return [m.decode("utf-8") if isinstance(m, bytes) else m for m in members]
+
+    def clear(self):
+        pass
+
+
+class TokenRevocation:
+    """
+    Denylist of token ids and families, with a bloom filter in front
+    """
+    def __init__(
+        self,
+        store=None,
+        capacity: Optional[int] = None,
+        error_rate: Optional[float] = None,
+        sync_interval: Optional[float] = None
+    ):
+        if store is None:
+            store = MemoryDenylist() if settings.REVOCATION_BACKEND == "memory" else RedisDenylist()
+        self.store = store
+        self.capacity = capacity or settings.REVOCATION_BLOOM_CAPACITY
+        self.error_rate = error_rate or settings.REVOCATION_BLOOM_ERROR_RATE
+        self.sync_interval = sync_interval or settings.REVOCATION_SYNC_SECONDS
+        self.bloom = BloomFilter(self.capacity, self.error_rate)
+        # ids revoked here while a rebuild is running, re-added to the new filter
+        self._pending: List[str] = []
+        # id -> expiry of revocations the store failed to take, enforced here
+        self._unsynced: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+        # counters for monitoring
+        self.checks = 0
+        self.bloom_hits = 0
+        self.false_positives = 0
+        self.reuse_detected = 0
+
+    def _deny(self, key: str, expires_at: float):
+        try:
+            self.store.add(key, expires_at)
+        except Exception as e:
+            # enforced on this node until sync() gets it into the store
+            print(f"Redis revocation error (non-critical): {e}")
+            with self._lock:
+                self._unsynced[key] = expires_at
+        with self._lock:
+            self.bloom.add(key)
+            self._pending.append(key)
+
+    def revoke(self, claims: dict):
+        """
+        Revoke a single token until it expires
+        """
+        jti = claims.get("jti")
+        if jti:
+            self._deny(jti_key(jti), float(claims.get("exp") or time.time()))
+
+    def revoke_family(self, family: str):
+        """
+        Revoke every token of a login, until its last refresh token expires
+        """
+        lifetime = settings.REFRESH_TOKEN_EXPIRE_DAYS * 86400
+        self._deny(family_key(family), time.time() + lifetime)
+
+    def _bloom_hits(self, claims: dict) -> List[str]:
+        """
+        Keys of the token that may be revoked, to be confirmed with the store
+        """
+        self.checks += 1
+        keys = [
+            key for key in (
+                jti_key(claims["jti"]) if claims.get("jti") else None,
+                family_key(claims["fam"]) if claims.get("fam") else None,
+            )
+            if key is not None and key in self.bloom
+        ]
+        if keys:
+            self.bloom_hits += 1
+        return keys
+
+    def is_revoked(self, claims: dict) -> bool:
+        """
+        Whether the token or its family is revoked, for sync callers
+
+        Time Complexity: O(k) bloom probes; a store lookup only on a filter hit
+        """
+        keys = self._bloom_hits(claims)
+        return bool(keys) and self._confirm(keys)
+
+    async def is_revoked_async(self, claims: dict) -> bool:
+        """
+        is_revoked for the event loop, the store lookup runs in a thread
+        """
+        keys = self._bloom_hits(claims)
+        return bool(keys) and await asyncio.to_thread(self._confirm, keys)
+
+    def _confirm(self, keys: List[str]) -> bool:
+        now = time.time()
+        if any(self._unsynced.get(key, 0) > now for key in keys):
+            return True
+        try:
+            revoked = any(self.store.contains(key) for key in keys)
+        except Exception as e:
+            # only tokens hitting the filter get here, fail closed for them
+            print(f"Redis revocation check error: {e}")
+            return True
+        if not revoked:
+            self.false_positives += 1
+        return revoked
+
+    def use_refresh_token(self, claims: dict) -> bool:
+        """
+        Mark a refresh token used, False (and its family revoked) if it already was
+
+        Time Complexity: O(1), one SET NX
+        """
+        jti = claims.get("jti")
+        if not jti:
+            return True
+        try:
+            first_use = self.store.mark_used(used_key(jti), float(claims.get("exp") or time.time()))
+        except Exception as e:
+            # reuse detection is lost while redis is down, refreshing keeps working
+            print(f"Redis revocation error (non-critical): {e}")
+            first_use = True
+        if first_use:
+            return True
+        self.reuse_detected += 1
+        if claims.get("fam"):
+            self.revoke_family(claims["fam"])
+        logger.warning(f"Refresh token reuse detected for user {claims.get('sub')}, family revoked")
+        return False
+
+    def sync(self):
+        """
+        Rebuild the bloom filter from the store, picking up other nodes'
+        revocations and dropping expired ones
+        """
+        self._push_unsynced()
+        with self._lock:
+            self._pending = []
+        active = self.store.active()
+        bloom = BloomFilter(max(self.capacity, 2 * len(active)), self.error_rate)
+        for key in active:
+            bloom.add(key)
+        with self._lock:
+            for key in self._pending:
+                bloom.add(key)
+            for key in self._unsynced:
+                bloom.add(key)
+            self._pending = []
+            self.bloom = bloom
+
+    def _push_unsynced(self):
+        """
+        Retry the revocations the store failed to take, dropping expired ones
+        """
+        now = time.time()
+        with self._lock:
+            unsynced = list(self._unsynced.items())
+        for key, expires_at in unsynced:
+            if expires_at > now:
+                try:
+                    self.store.add(key, expires_at)
+                except Exception as e:
+                    # still down, kept for the next sync
+                    print(f"Redis revocation error (non-critical): {e}")
+                    return
+            with self._lock:
+                self._unsynced.pop(key, None)
+
+    def start(self):
+        """
+        Start the periodic filter rebuild
+        """
+        if self.task is not None and not self.task.done():
+            return
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sync)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis revocation sync error (non-critical): {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    def clear(self):
+        self.store.clear()
+        with self._lock:
+            self.bloom = BloomFilter(self.capacity, self.error_rate)
+            self._pending = []
+            self._unsynced.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "checks": self.checks,
+            "bloom_hits": self.bloom_hits,
+            "false_positives": self.false_positives,
+            "reuse_detected": self.reuse_detected,
+            "unsynced": len(self._unsynced),
+        }
+
+
+# global token revocation instance
+token_revocation = TokenRevocation()
@@ -2,16 +2,20 @@
 Authentication routes using class-based views
 """
 from fastapi import APIRouter, status, Depends
+from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from app.database.database import get_db
 from app.database.redis_client import get_redis
-from app.auth.dependencies import get_current_user
+from app.auth.dependencies import get_current_user, security
 from app.models.user import User
 from app.auth.schemas import (
     UserCreate, UserLogin, UserResponse, Token, TokenRefresh,
     PasswordResetRequest, PasswordResetConfirm
 )
 from app.auth.views import AuthViews
+from app.core.rate_limit import (
+    LOGIN_PER_IP, PASSWORD_RESET_CONFIRM_PER_IP, PASSWORD_RESET_PER_IP, REFRESH_PER_IP, limit_by_ip
+)
 
 router = APIRouter()
 
@@ -23,7 +27,7 @@ def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
 
 
 # login endpoint
-@router.post("/login", response_model=Token)
+@router.post("/login", response_model=Token, dependencies=[Depends(limit_by_ip(LOGIN_PER_IP))])
 def login_user(user_credentials: UserLogin, db: Session = Depends(get_db)):
     """Authenticate user and return JWT tokens"""
     return AuthViews.login(user_credentials, db)
@@ -31,13 +35,17 @@ def login_user(user_credentials: UserLogin, db: Session = Depends(get_db)):
 
 # logout endpoint
 @router.post("/logout")
-def logout_user(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Logout user and update online status"""
-    return AuthViews.logout(current_user, db)
+def logout_user(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Logout user and revoke the tokens of this login"""
+    return AuthViews.logout(current_user, db, credentials)
 
 
 # refresh token endpoint
-@router.post("/refresh", response_model=Token)
+@router.post("/refresh", response_model=Token, dependencies=[Depends(limit_by_ip(REFRESH_PER_IP))])
 def refresh_token(token_data: TokenRefresh, db: Session = Depends(get_db)):
     """Refresh access token using refresh token"""
     return AuthViews.refresh_token(token_data, db)
@@ -61,7 +69,7 @@ def get_all_users(
 
 
 # password reset request
-@router.post("/password-reset")
+@router.post("/password-reset", dependencies=[Depends(limit_by_ip(PASSWORD_RESET_PER_IP))])
 def request_password_reset(
     reset_request: PasswordResetRequest, 
     db: Session = Depends(get_db),
@@ -72,7 +80,7 @@ def request_password_reset(
 
 
 # password reset confirmation
-@router.post("/password-reset-confirm")
+@router.post("/password-reset-confirm", dependencies=[Depends(limit_by_ip(PASSWORD_RESET_CONFIRM_PER_IP))])
 def confirm_password_reset(
     reset_confirm: PasswordResetConfirm,
     db: Session = Depends(get_db),
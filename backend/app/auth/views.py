@@ -4,23 +4,36 @@ Class-based views for authentication endpoints
 from datetime import timedelta
 from typing import Annotated
 from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from app.database.database import get_db
 from app.auth.schemas import (
     UserCreate, UserLogin, UserResponse, Token, TokenRefresh,
     PasswordResetRequest, PasswordResetConfirm
 )
-from app.auth.dependencies import get_current_user
+from app.auth.dependencies import get_current_user, security
+from app.auth.revocation import token_revocation
+from app.core.rate_limit import LOGIN_PER_EMAIL, PASSWORD_RESET_PER_EMAIL, REFRESH_PER_USER, rate_limiter
 from app.models.user import User
 from app.core.security import (
-    create_access_token, create_refresh_token, verify_password, 
-    get_password_hash, verify_token
+    create_access_token, create_refresh_token, verify_and_update_password,
+    get_password_hash, verify_token, new_token_family
 )
 from app.core.config import settings
 from app.auth.password_reset_service import PasswordResetService
+from app.chat.presence import presence
 from app.database.redis_client import get_redis
 
 
+def user_response(user: User) -> UserResponse:
+    """
+    Profile of a user, online status from the presence cache
+    """
+    response = UserResponse.model_validate(user)
+    response.is_online = presence.is_online(user.id)
+    return response
+
+
 class AuthViews:
     """Class-based views for authentication operations"""
     
@@ -61,36 +74,49 @@ class AuthViews:
         db.commit()
         db.refresh(db_user)
         
-        return db_user
+        return user_response(db_user)
     
     @staticmethod
     def login(user_credentials: UserLogin, db: Session = Depends(get_db)) -> Token:
         """
         Authenticate user and return JWT tokens
         
+        The bcrypt check runs in the password hasher's process pool (503 with
+        Retry-After when it is saturated). Attempts are limited per client IP
+        (see routes) and per email, before any bcrypt work (429 with
+        Retry-After).
+        
         Time Complexity: O(1) - database query with index lookup
         Space Complexity: O(1) - token strings
         """
+        rate_limiter.check(LOGIN_PER_EMAIL, user_credentials.email.lower())
+        
         # find user by email
         user = db.query(User).filter(User.email == user_credentials.email).first()
         
-        if not user or not verify_password(user_credentials.password, user.hashed_password):
+        valid, new_hash = (
+            verify_and_update_password(user_credentials.password, user.hashed_password)
+            if user else (False, None)
+        )
+        if not valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect email or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        # update user online status
-        user.is_online = True
-        db.commit()
+        # hashed with an older work factor, upgrade it while we have the password
+        if new_hash is not None:
+            user.hashed_password = new_hash
+            db.commit()
         
-        # create tokens
+        # create tokens, both in a new family so logout can revoke them together
+        family = new_token_family()
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": str(user.id)}, expires_delta=access_token_expires
+            data={"sub": str(user.id), "fam": family}, expires_delta=access_token_expires
         )
-        refresh_token = create_refresh_token(data={"sub": str(user.id)})
+        refresh_token = create_refresh_token(data={"sub": str(user.id), "fam": family})
         
         return {
             "access_token": access_token,
@@ -99,16 +125,26 @@ class AuthViews:
         }
     
     @staticmethod
-    def logout(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)) -> dict:
+    def logout(
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_db),
+        credentials: HTTPAuthorizationCredentials = Depends(security)
+    ) -> dict:
         """
-        Logout user and update online status
+        Logout user
         
-        Time Complexity: O(1) - single database update
+        Revokes the access token and its family, so the refresh token of
+        this login stops working too. Online status follows the user's
+        sockets (app.chat.presence), so there is nothing else to write.
+        
+        Time Complexity: O(1) - one or two denylist writes
         Space Complexity: O(1)
         """
-        current_user.is_online = False
-        db.commit()
-        
+        payload = verify_token(credentials.credentials)
+        if payload is not None:
+            token_revocation.revoke(payload)
+            if payload.get("fam"):
+                token_revocation.revoke_family(payload["fam"])
         return {"message": "Successfully logged out"}
     
     @staticmethod
@@ -116,12 +152,18 @@ class AuthViews:
         """
         Refresh access token using refresh token
         
+        Refresh tokens are single use: the presented one is revoked and a new
+        pair of the same family is issued. Presenting a used one again means
+        it leaked, and the whole family is revoked (app.auth.revocation).
+        Limited per client IP (see routes) and per user (429 with Retry-After).
+        
         Time Complexity: O(1) - token verification and database lookup
         Space Complexity: O(1) - token strings
         """
         payload = verify_token(token_data.refresh_token)
         
-        if payload is None:
+        # access tokens carry typ=access, tokens from before typ existed are accepted
+        if payload is None or payload.get("typ", "refresh") != "refresh":
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid refresh token",
@@ -135,6 +177,7 @@ class AuthViews:
                 detail="Invalid refresh token",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        rate_limiter.check(REFRESH_PER_USER, str(user_id))
         
         # verify user exists
         user = db.query(User).filter(User.id == int(user_id)).first()
@@ -145,12 +188,20 @@ class AuthViews:
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
+        if not token_revocation.use_refresh_token(payload):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Refresh token already used",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        
         # create new tokens
+        family = payload.get("fam") or new_token_family()
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": str(user.id)}, expires_delta=access_token_expires
+            data={"sub": str(user.id), "fam": family}, expires_delta=access_token_expires
         )
-        new_refresh_token = create_refresh_token(data={"sub": str(user.id)})
+        new_refresh_token = create_refresh_token(data={"sub": str(user.id), "fam": family})
         
         return {
             "access_token": access_token,
@@ -166,7 +217,7 @@ class AuthViews:
         Time Complexity: O(1) - user already loaded from token
         Space Complexity: O(1)
         """
-        return current_user
+        return user_response(current_user)
     
     @staticmethod
     def get_all_users(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)) -> list[UserResponse]:
@@ -177,7 +228,7 @@ class AuthViews:
         Space Complexity: O(n)
         """
         users = db.query(User).all()
-        return users
+        return [user_response(user) for user in users]
     
     @staticmethod
     def request_password_reset(
@@ -188,9 +239,14 @@ class AuthViews:
         """
         Request a password reset token
         
+        Limited per client IP (see routes) and per email, so the endpoint
+        cannot be used to flood a mailbox.
+        
         Time Complexity: O(1) - database lookup and Redis set
         Space Complexity: O(1) - token string
         """
+        rate_limiter.check(PASSWORD_RESET_PER_EMAIL, reset_request.email.lower())
+        
         reset_service = PasswordResetService(db, redis_client)
         token = reset_service.create_reset_token(reset_request.email, send_email=True)
         
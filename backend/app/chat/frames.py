@@ -0,0 +1,73 @@
+"""
+Serialize-once WebSocket frames
+
+A broadcast is encoded to JSON exactly once. The resulting Frame is
+shared by every recipient's send queue and by the Redis publish, so the cost
+of serialization no longer grows with the size of the room.
+"""
+from typing import Tuple
+import json
+from app.chat.wire import encode_compact
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used when missing
+    orjson = None
+
+
+def encode_json(obj) -> Tuple[str, bytes]:
+    """
+    Encode an object as compact JSON, as text and as UTF-8 bytes
+
+    Non-ASCII characters are kept as they are, escaping them would double
+    the size of most non-Latin text on the wire and in Redis. Strings that
+    are not valid Unicode (lone surrogates) are escaped instead.
+    """
+    if orjson is not None:
+        try:
+            data = orjson.dumps(obj)
+            return data.decode("utf-8"), data
+        except orjson.JSONEncodeError:
+            pass
+    text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    try:
+        return text, text.encode("utf-8")
+    except UnicodeEncodeError:
+        text = json.dumps(obj, separators=(",", ":"))
+        return text, text.encode("ascii")
+
+
+class Frame:
+    """
+    An encoded message, reusable across all recipients
+
+    Holds the text form for clients on text frames and the bytes form for
+    binary clients and Redis. Both are plain attributes so the per-send cost
+    in the writer tasks is a lookup. The compact form for clients of the
+    msgpack subprotocol is built once, by the first writer that needs it.
+    ASGI servers only accept str or bytes payloads, so this is the closest
+    we can get to a pre-built WebSocket frame.
+    """
+    __slots__ = ("text", "data", "_compact")
+
+    def __init__(self, text: str, data: bytes):
+        self.text = text
+        self.data = data
+        self._compact = None
+
+    @property
+    def compact(self) -> bytes:
+        """
+        The compact wire form (app.chat.wire), encoded on first use
+        """
+        if self._compact is None:
+            self._compact = encode_compact(self.text)
+        return self._compact
+
+    @classmethod
+    def from_message(cls, message: dict) -> "Frame":
+        return cls(*encode_json(message))
+
+    @classmethod
+    def from_text(cls, text: str) -> "Frame":
+        return cls(text, text.encode("utf-8"))
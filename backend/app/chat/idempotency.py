@@ -0,0 +1,102 @@
+"""
+Idempotency keys of chat messages sent over WebSockets
+
+Clients may tag every message with a client_id of their own choosing. The
+server id a message got is kept under msg_client:{sender_id}:{client_id}
+for MESSAGE_CLIENT_ID_TTL_SECONDS, so a client that resends after a
+reconnect (it never saw the ack) gets the original id back and the message
+is neither stored nor broadcast twice. Keys are claimed with SET NX, which
+makes the check race-free across nodes, and released again when the
+messages could not be accepted, so a resend is not taken for a duplicate.
+
+Redis errors are not fatal: the messages are then accepted as new.
+"""
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.database.redis_client import get_async_redis
+
+# longest accepted client_id
+MAX_CLIENT_ID_LENGTH = 64
+
+
+class ClientMessageIds:
+    """
+    Server message ids by (sender, client_id), claimed atomically in Redis
+    """
+    def __init__(self, redis_client=None, ttl: Optional[int] = None):
+        self._redis = redis_client
+        self.ttl = ttl or settings.MESSAGE_CLIENT_ID_TTL_SECONDS
+
+        # counters for monitoring
+        self.claimed = 0
+        self.duplicates = 0
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = get_async_redis()
+        return self._redis
+
+    @staticmethod
+    def key(sender_id: int, client_id: str) -> str:
+        return f"msg_client:{sender_id}:{client_id}"
+
+    async def claim(self, sender_id: int, ids: Dict[str, int]) -> Dict[str, int]:
+        """
+        Register client_id -> new server id for a sender
+
+        Returns the client ids that were already taken, with the server id
+        they were first given. At most two round-trips: one SET NX per key
+        in a pipeline, then a GET of the keys that were taken.
+
+        Time Complexity: O(k) for k client ids
+        """
+        if not ids:
+            return {}
+        client_ids = list(ids)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for client_id in client_ids:
+                pipe.set(self.key(sender_id, client_id), ids[client_id], nx=True, ex=self.ttl)
+            claimed = await pipe.execute()
+
+            taken = [client_id for client_id, ok in zip(client_ids, claimed) if not ok]
+            if not taken:
+                self.claimed += len(client_ids)
+                return {}
+            pipe = self.redis.pipeline(transaction=False)
+            for client_id in taken:
+                pipe.get(self.key(sender_id, client_id))
+            existing = await pipe.execute()
+        except Exception as e:
+            print(f"Redis idempotency error (non-critical): {e}")
+            return {}
+
+        self.claimed += len(client_ids) - len(taken)
+        self.duplicates += len(taken)
+        return {
+            client_id: int(server_id)
+            for client_id, server_id in zip(taken, existing)
+            if server_id is not None
+        }
+
+    async def release(self, sender_id: int, client_ids: List[str]):
+        """
+        Give back client ids claimed for messages that were not accepted
+        """
+        if not client_ids:
+            return
+        try:
+            await self.redis.delete(*[self.key(sender_id, client_id) for client_id in client_ids])
+        except Exception as e:
+            print(f"Redis idempotency error (non-critical): {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "claimed": self.claimed,
+            "duplicates": self.duplicates,
+        }
+
+
+# global idempotency key registry
+client_message_ids = ClientMessageIds()
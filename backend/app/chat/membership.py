@@ -0,0 +1,212 @@
+"""
+Cached room membership checks
+
+Membership is checked on every WebSocket handshake, every typing event and
+every message REST call. Answers are cached in process memory keyed by
+(room_id, user_id) with a TTL, optionally backed by a per-room Redis hash
+shared between nodes. A miss costs a single indexed EXISTS query.
+
+All callers run on the event loop, so the Redis tier is reached through
+the asyncio client and never blocks it.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.database.redis_client import get_async_redis
+from app.models.chat import room_memberships
+import time
+
+
+def query_room_membership(db: Session, room_id: int, user_id: int) -> bool:
+    """
+    Cold path: single EXISTS query on the room_memberships primary key
+
+    Time Complexity: O(log n) index lookup
+    """
+    return db.execute(
+        select(
+            exists().where(
+                room_memberships.c.room_id == room_id,
+                room_memberships.c.user_id == user_id
+            )
+        )
+    ).scalar()
+
+
+def query_user_room_ids(db: Session, user_id: int) -> List[int]:
+    """
+    Ids of all rooms a user is a member of
+
+    Time Complexity: O(log n + r), a range scan of the (user_id, room_id) primary key
+    """
+    return list(db.execute(
+        select(room_memberships.c.room_id).where(room_memberships.c.user_id == user_id)
+    ).scalars())
+
+
+class MembershipCache:
+    """
+    TTL cache of membership answers, both positive and negative
+
+    Entries are also indexed by room and by user so a room or a user can be
+    invalidated without scanning the whole cache.
+    """
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        redis_client=None,
+        use_redis: Optional[bool] = None
+    ):
+        self.ttl = ttl if ttl is not None else settings.MEMBERSHIP_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or settings.MEMBERSHIP_CACHE_MAX_ENTRIES
+        self.use_redis = use_redis if use_redis is not None else settings.MEMBERSHIP_CACHE_REDIS
+        # asyncio redis client
+        self.redis = redis_client
+
+        # (room_id, user_id) -> (is_member, expires_at)
+        self._entries: Dict[Tuple[int, int], Tuple[bool, float]] = {}
+        self._by_room: Dict[int, Set[int]] = {}
+        self._by_user: Dict[int, Set[int]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def redis_key(room_id: int) -> str:
+        return f"room_membership:{room_id}"
+
+    def _redis(self):
+        if self.redis is None:
+            self.redis = get_async_redis()
+        return self.redis
+
+    def _get_local(self, room_id: int, user_id: int) -> Optional[bool]:
+        entry = self._entries.get((room_id, user_id))
+        if entry is not None:
+            is_member, expires_at = entry
+            if expires_at > time.monotonic():
+                return is_member
+            self._forget(room_id, user_id)
+        return None
+
+    async def get_async(self, room_id: int, user_id: int) -> Optional[bool]:
+        """
+        Cached answer, or None when unknown or expired
+
+        Time Complexity: O(1)
+        """
+        cached = self._get_local(room_id, user_id)
+        if cached is not None or not self.use_redis:
+            return cached
+        try:
+            cached = await self._redis().hget(self.redis_key(room_id), str(user_id))
+        except Exception as e:
+            print(f"Redis membership lookup error (non-critical): {e}")
+            return None
+        if cached is None:
+            return None
+        is_member = cached in ("1", b"1")
+        self._store(room_id, user_id, is_member)
+        return is_member
+
+    async def set_async(self, room_id: int, user_id: int, is_member: bool):
+        """
+        Remember an answer locally and, when enabled, in Redis
+        """
+        self._store(room_id, user_id, is_member)
+        if self.use_redis:
+            try:
+                pipe = self._redis().pipeline()
+                pipe.hset(self.redis_key(room_id), str(user_id), "1" if is_member else "0")
+                pipe.expire(self.redis_key(room_id), int(self.ttl))
+                await pipe.execute()
+            except Exception as e:
+                print(f"Redis membership store error (non-critical): {e}")
+
+    async def invalidate_room_async(self, room_id: int):
+        """
+        Forget every answer about a room (created, deleted or members changed)
+        """
+        for user_id in list(self._by_room.get(room_id, ())):
+            self._forget(room_id, user_id)
+        if self.use_redis:
+            try:
+                await self._redis().delete(self.redis_key(room_id))
+            except Exception as e:
+                print(f"Redis membership invalidation error (non-critical): {e}")
+
+    async def invalidate_user_async(self, user_id: int):
+        """
+        Forget every answer about a user (deleted or memberships changed)
+        """
+        room_ids = list(self._by_user.get(user_id, ()))
+        for room_id in room_ids:
+            self._forget(room_id, user_id)
+        if self.use_redis and room_ids:
+            try:
+                pipe = self._redis().pipeline()
+                for room_id in room_ids:
+                    pipe.hdel(self.redis_key(room_id), str(user_id))
+                await pipe.execute()
+            except Exception as e:
+                print(f"Redis membership invalidation error (non-critical): {e}")
+
+    def clear(self):
+        self._entries.clear()
+        self._by_room.clear()
+        self._by_user.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Hit/miss counters for monitoring
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def is_member_async(self, db: AsyncSession, room_id: int, user_id: int) -> bool:
+        """
+        Membership check served from the cache, querying the database on a miss
+        """
+        cached = await self.get_async(room_id, user_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        is_member = await db.run_sync(query_room_membership, room_id, user_id)
+        await self.set_async(room_id, user_id, is_member)
+        return is_member
+
+    def _store(self, room_id: int, user_id: int, is_member: bool):
+        key = (room_id, user_id)
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            # dicts keep insertion order, so the first key is the oldest entry
+            self._forget(*next(iter(self._entries)))
+        self._entries[key] = (is_member, time.monotonic() + self.ttl)
+        self._by_room.setdefault(room_id, set()).add(user_id)
+        self._by_user.setdefault(user_id, set()).add(room_id)
+
+    def _forget(self, room_id: int, user_id: int):
+        self._entries.pop((room_id, user_id), None)
+        users = self._by_room.get(room_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._by_room[room_id]
+        rooms = self._by_user.get(user_id)
+        if rooms is not None:
+            rooms.discard(room_id)
+            if not rooms:
+                del self._by_user[user_id]
+
+
+# global membership cache instance
+membership_cache = MembershipCache()
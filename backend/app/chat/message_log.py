@@ -0,0 +1,144 @@
+"""
+Durable per-room log of broadcast chat messages on Redis Streams
+
+Pub/sub delivery is lossy: a socket that drops for a moment misses whatever
+was broadcast meanwhile. With MESSAGE_STREAM_ENABLED every chat message
+broadcast to a room is also appended to the room's stream (XADD with
+approximate MAXLEN trimming), and a client reconnecting with last_seen_id
+is sent the messages it missed from there instead of refetching history
+from the messages table.
+
+Stream entry ids are assigned by Redis, each entry carries the message id
+and the encoded frame. Message ids embed their creation time, so replay
+reads from a little before last_seen_id was created and skips what the
+client already has.
+"""
+from dataclasses import dataclass, field
+from typing import List, Optional
+from app.core.config import settings
+from app.core.ids import ID_EPOCH_MS, TIMESTAMP_SHIFT
+from app.database.redis_client import get_async_redis
+
+# allowed clock difference between the nodes generating ids and redis
+REPLAY_CLOCK_SKEW_MS = 5000
+
+
+@dataclass
+class Replay:
+    """Messages missed since last_seen_id, oldest first"""
+    frames: List[str] = field(default_factory=list)
+    message_ids: List[int] = field(default_factory=list)
+    # False when the stream may not reach back to last_seen_id
+    complete: bool = True
+
+
+class RoomMessageLog:
+    """
+    Appends broadcast chat messages to room_stream:{room_id} and replays them
+    """
+    def __init__(
+        self,
+        redis_client=None,
+        enabled: Optional[bool] = None,
+        maxlen: Optional[int] = None,
+        ttl: Optional[int] = None
+    ):
+        self._redis = redis_client
+        self.enabled = settings.MESSAGE_STREAM_ENABLED if enabled is None else enabled
+        self.maxlen = maxlen or settings.MESSAGE_STREAM_MAXLEN
+        self.ttl = ttl or settings.MESSAGE_STREAM_TTL_SECONDS
+
+        # counters for monitoring
+        self.appended = 0
+        self.replayed = 0
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = get_async_redis()
+        return self._redis
+
+    @staticmethod
+    def stream_key(room_id: int) -> str:
+        """
+        Redis stream holding the recent chat messages of a room
+        """
+        return f"room_stream:{room_id}"
+
+    async def append(self, room_id: int, message_id: int, frame: str):
+        """
+        Add a broadcast message to its room's stream
+
+        One round-trip: XADD trimmed to about maxlen entries, and an EXPIRE
+        so streams of rooms that went quiet are dropped.
+        """
+        if not self.enabled:
+            return
+        key = self.stream_key(room_id)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.xadd(key, {"id": message_id, "frame": frame}, maxlen=self.maxlen, approximate=True)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+            self.appended += 1
+        except Exception as e:
+            print(f"Redis stream append error (non-critical): {e}")
+
+    async def read_after(self, room_id: int, last_seen_id: int) -> Replay:
+        """
+        Messages of a room newer than last_seen_id
+
+        Errors and trimmed streams are reported as an incomplete replay, the
+        client then falls back to the REST history.
+
+        Time Complexity: O(log n + m) where m is the number of entries read
+        """
+        if not self.enabled:
+            return Replay(complete=False)
+        key = self.stream_key(room_id)
+        created_ms = (last_seen_id >> TIMESTAMP_SHIFT) + ID_EPOCH_MS
+        start = max(created_ms - REPLAY_CLOCK_SKEW_MS, 0)
+        try:
+            oldest = await self.redis.xrange(key, count=1)
+            entries = await self.redis.xrange(key, min=f"{start}-0")
+        except Exception as e:
+            print(f"Redis stream read error (non-critical): {e}")
+            return Replay(complete=False)
+
+        replay = Replay()
+        # entries older than last_seen_id may have been trimmed away
+        if not oldest or int(oldest[0][1]["id"]) > last_seen_id:
+            replay.complete = False
+
+        missed = sorted(
+            (int(fields["id"]), fields["frame"])
+            for _, fields in entries
+            if int(fields["id"]) > last_seen_id
+        )
+        for message_id, frame in missed:
+            replay.message_ids.append(message_id)
+            replay.frames.append(frame)
+        self.replayed += len(missed)
+        return replay
+
+    async def invalidate(self, room_id: int):
+        """
+        Drop a room's stream, e.g. after a message was deleted
+        """
+        if not self.enabled:
+            return
+        try:
+            await self.redis.delete(self.stream_key(room_id))
+        except Exception as e:
+            print(f"Redis stream delete error (non-critical): {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "appended": self.appended,
+            "replayed": self.replayed,
+        }
+
+
+# global message log instance
+message_log = RoomMessageLog()
@@ -0,0 +1,136 @@
+"""
+Keyset (cursor) pagination of room message history
+
+Message ids are time-ordered (app.core.ids), so a page is a range scan of
+the (room_id, id) index starting at a known id. Unlike OFFSET, the cost of a
+page does not depend on how far back in the history it is.
+"""
+from dataclasses import dataclass
+from typing import List, Optional
+from sqlalchemy import exists, select
+from sqlalchemy.orm import Session, joinedload
+from app.models.chat import Message
+import base64
+import binascii
+
+# cursor directions
+OLDER = "b"
+NEWER = "a"
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor was not produced by encode_cursor"""
+
+
+def encode_cursor(direction: str, message_id: int) -> str:
+    """
+    Opaque cursor for the page next to message_id in the given direction
+    """
+    raw = f"{direction}:{message_id}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    (direction, message_id) of a cursor, raises InvalidCursor
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, message_id = base64.urlsafe_b64decode(padded).decode("ascii").split(":")
+        if direction not in (OLDER, NEWER):
+            raise ValueError(direction)
+        return direction, int(message_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+@dataclass
+class MessagePage:
+    """A page of messages, oldest first"""
+    messages: List[Message]
+    # more messages exist before the first / after the last one of the page
+    has_older: bool
+    has_newer: bool
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        """Cursor for the page of older messages"""
+        if not self.has_older or not self.messages:
+            return None
+        return encode_cursor(OLDER, self.messages[0].id)
+
+    @property
+    def prev_cursor(self) -> Optional[str]:
+        """Cursor for the page of newer messages"""
+        if not self.has_newer or not self.messages:
+            return None
+        return encode_cursor(NEWER, self.messages[-1].id)
+
+
+def _older(db: Session, room_id: int, before_id: Optional[int], limit: int, inclusive: bool = False):
+    """
+    Up to limit messages older than before_id (newest first), plus whether
+    more exist beyond them
+
+    Time Complexity: O(log n + k) range scan of the (room_id, id) index
+    """
+    query = db.query(Message).options(joinedload(Message.sender)).filter(Message.room_id == room_id)
+    if before_id is not None:
+        query = query.filter(Message.id <= before_id if inclusive else Message.id < before_id)
+    rows = query.order_by(Message.id.desc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def _newer(db: Session, room_id: int, after_id: int, limit: int):
+    """
+    Up to limit messages newer than after_id (oldest first), plus whether
+    more exist beyond them
+
+    Time Complexity: O(log n + k) range scan of the (room_id, id) index
+    """
+    rows = db.query(Message).options(joinedload(Message.sender)).filter(
+        Message.room_id == room_id,
+        Message.id > after_id
+    ).order_by(Message.id.asc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def _exists(db: Session, *criteria) -> bool:
+    return db.execute(select(exists().where(*criteria))).scalar()
+
+
+def fetch_message_page(
+    db: Session,
+    room_id: int,
+    page_size: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    around_id: Optional[int] = None
+) -> MessagePage:
+    """
+    Page of room messages relative to an anchor message id
+
+    - no anchor: the newest page_size messages
+    - before_id: the page_size messages right before it
+    - after_id: the page_size messages right after it
+    - around_id: the anchor itself with messages on both sides of it
+
+    Time Complexity: O(log n + k) where n is messages in the room, k is page_size
+    Space Complexity: O(k)
+    """
+    if after_id is not None:
+        messages, has_newer = _newer(db, room_id, after_id, page_size)
+        has_older = _exists(db, Message.room_id == room_id, Message.id <= after_id)
+        return MessagePage(messages, has_older, has_newer)
+
+    if around_id is not None:
+        # the anchor and older messages fill the first half of the page
+        older, has_older = _older(db, room_id, around_id, page_size - page_size // 2, inclusive=True)
+        newer, has_newer = _newer(db, room_id, around_id, page_size // 2)
+        return MessagePage(list(reversed(older)) + newer, has_older, has_newer)
+
+    messages, has_older = _older(db, room_id, before_id, page_size)
+    has_newer = before_id is not None and _exists(
+        db, Message.room_id == room_id, Message.id >= before_id
+    )
+    return MessagePage(list(reversed(messages)), has_older, has_newer)
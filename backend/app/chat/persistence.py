@@ -0,0 +1,298 @@
+"""
+Write-behind persistence for chat messages
+
+WebSocket messages get their id up front (app.core.ids), are broadcast right
+away and handed to a MessageWriter. The writer buffers them in a bounded
+queue and flushes them to the messages table with multi-row INSERTs from a
+worker thread, so the event loop never waits on a database round-trip.
+The messages of a client batch frame are submitted as one group and are
+always written in the same transaction.
+"""
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.ids import generate_message_id
+from app.database.database import SessionLocal
+from app.models.chat import Message
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# queue marker telling the flush task to finish after the rows ahead of it
+_STOP = object()
+
+# errors a retry cannot fix, the rows themselves are refused
+PERMANENT_ERRORS = (IntegrityError, DataError)
+
+
+class MessageWriter:
+    """
+    Bounded buffer of pending messages flushed in batches by a background task
+
+    A flush happens when batch_size rows are waiting or when the oldest row
+    has waited flush_interval seconds, whichever comes first. When the buffer
+    is full, submit() waits, which slows down only the sockets producing the
+    backlog. stop() drains everything still buffered before returning.
+
+    Transient errors (a lost connection, a failover) are retried with
+    backoff capped at max_backoff for as long as the writer runs, the full
+    buffer holding back the senders meanwhile. Only rows the database
+    refuses (integrity and data errors) are dropped. Once stopping, a batch
+    gets max_retries attempts so shutdown ends even without a database.
+    The on_dropped callback of a group (submit_many) is awaited when its
+    rows are dropped, they were acked and broadcast but are not stored.
+    """
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        max_buffer: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_retries: int = 3,
+        retry_base: float = 0.1,
+        max_backoff: Optional[float] = None
+    ):
+        self.session_factory = session_factory
+        self.max_buffer = max_buffer or settings.MESSAGE_WRITER_BUFFER_SIZE
+        self.batch_size = batch_size or settings.MESSAGE_WRITER_BATCH_SIZE
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else settings.MESSAGE_WRITER_FLUSH_INTERVAL_MS / 1000
+        )
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.max_backoff = (
+            max_backoff if max_backoff is not None
+            else settings.MESSAGE_WRITER_MAX_BACKOFF_MS / 1000
+        )
+        self._stopping = False
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        # submitted rows by id until their batch is written (or dropped)
+        self._unwritten: Dict[int, dict] = {}
+        # on_dropped callbacks by the id of their group's first row
+        self._on_dropped: Dict[int, Callable[[List[dict]], Awaitable[None]]] = {}
+
+        # counters for monitoring
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def unwritten_rows(self, room_id: int) -> List[dict]:
+        """
+        Rows of a room submitted but not inserted yet, oldest first
+
+        Time Complexity: O(b) where b is the number of unwritten rows
+        """
+        return [row for row in self._unwritten.values() if row["room_id"] == room_id]
+
+    def get_stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "unwritten": len(self._unwritten),
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+        }
+
+    def start(self):
+        """
+        Start the background flush task
+        """
+        if self.task is not None and not self.task.done():
+            return
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.max_buffer)
+        self._stopping = False
+        self.task = asyncio.create_task(self._run())
+
+    async def submit(self, row: dict):
+        """
+        Buffer a message row for the next flush, waits while the buffer is full
+        """
+        await self.submit_many([row])
+
+    async def submit_many(
+        self,
+        rows: List[dict],
+        on_dropped: Optional[Callable[[List[dict]], Awaitable[None]]] = None
+    ):
+        """
+        Buffer rows that are written together, in one transaction
+
+        A group is never split across flushes; it succeeds or fails as a
+        whole, and on_dropped(rows) is awaited if it fails.
+        """
+        self.start()
+        for row in rows:
+            self._unwritten[row["id"]] = row
+        if on_dropped is not None:
+            self._on_dropped[rows[0]["id"]] = on_dropped
+        await self.queue.put(rows)
+
+    async def stop(self):
+        """
+        Flush everything still buffered, then stop the background task
+        """
+        if self.task is None:
+            return
+        if not self.task.done():
+            self._stopping = True
+            # queued behind every pending row, so those are flushed first
+            await self.queue.put(_STOP)
+            await self.task
+        self.task = None
+        self.queue = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                break
+
+            groups = [item]
+            size = len(item)
+            deadline = loop.time() + self.flush_interval
+            while size < self.batch_size:
+                if not self.queue.empty():
+                    item = self.queue.get_nowait()
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    self.queue.task_done()
+                    break
+                groups.append(item)
+                size += len(item)
+
+            dropped: List[List[dict]] = []
+            callbacks = {}
+            try:
+                dropped = await asyncio.to_thread(self._write_batch, groups)
+            finally:
+                for group in groups:
+                    for row in group:
+                        self._unwritten.pop(row["id"], None)
+                    callbacks[group[0]["id"]] = self._on_dropped.pop(group[0]["id"], None)
+                    self.queue.task_done()
+
+            for group in dropped:
+                on_dropped = callbacks[group[0]["id"]]
+                if on_dropped is None:
+                    continue
+                try:
+                    await on_dropped(group)
+                except Exception as e:
+                    logger.error(f"Dropped message callback failed: {e}")
+
+    def _write_batch(self, groups: List[List[dict]]) -> List[List[dict]]:
+        """
+        Insert a batch in one transaction, isolating the groups it is refused for
+
+        Runs in a worker thread. Returns the groups that were dropped.
+        """
+        rows = [row for group in groups for row in group]
+        try:
+            self._insert_retrying(rows)
+            self.written += len(rows)
+            self.batches += 1
+            return []
+        except PERMANENT_ERRORS as e:
+            logger.warning(f"Message batch refused, writing its groups one by one: {e}")
+        except Exception as e:
+            # stopping, and the database did not come back
+            self._drop(groups, e)
+            return groups
+
+        # one bad row must not take the whole batch down with it, only its group
+        dropped = []
+        for group in groups:
+            try:
+                self._insert_retrying(group)
+                self.written += len(group)
+            except Exception as e:
+                self._drop([group], e)
+                dropped.append(group)
+        return dropped
+
+    def _insert_retrying(self, rows: List[dict]):
+        """
+        Insert rows, retrying transient errors with capped exponential backoff
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self._insert(rows)
+                return
+            except PERMANENT_ERRORS:
+                raise
+            except Exception as e:
+                if self._stopping and attempt >= self.max_retries:
+                    raise
+                delay = min(self.retry_base * 2 ** min(attempt - 1, 16), self.max_backoff)
+                logger.warning(
+                    f"Message insert failed (attempt {attempt}), retrying in {delay:.2f}s: {e}"
+                )
+                time.sleep(delay)
+
+    def _drop(self, groups: List[List[dict]], error: Exception):
+        for group in groups:
+            self.failed += len(group)
+            logger.error(
+                f"Dropping {len(group)} message(s) from {group[0].get('id')} "
+                f"after insert failure: {error}"
+            )
+
+    def _insert(self, rows: List[dict]):
+        db = self.session_factory()
+        try:
+            db.execute(insert(Message), rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+def build_message_row(
+    room_id: int,
+    sender_id: int,
+    content: str,
+    message_type: str = "text"
+) -> dict:
+    """
+    Message row with its id and timestamp assigned up front
+    """
+    return {
+        "id": generate_message_id(),
+        "room_id": room_id,
+        "sender_id": sender_id,
+        "content": content,
+        "timestamp": datetime.utcnow(),
+        "message_type": message_type,
+        "is_edited": False,
+    }
+
+
+# global message writer instance
+message_writer = MessageWriter()
@@ -0,0 +1,417 @@
+"""
+Presence of users with open sockets, kept in Redis instead of the users table
+
+Every node heartbeats the users it holds sockets for into one sorted set,
+presence:online, with a member per (user, node) scored by its expiry time.
+Entries of a node that died expire after PRESENCE_TTL_SECONDS. A tick that
+runs every PRESENCE_HEARTBEAT_SECONDS (and shortly after a connect or
+disconnect) sends all heartbeats and removes the expired entries in one
+MULTI, so only one node sees each expiry.
+
+Nodes do not read the set back on every tick. The members a tick added,
+removed or saw expire are published as one diff on the presence:changes
+channel, and every node applies the diffs to its copy of the online
+members. The whole set is read only when a node starts or its
+subscription was broken. The changes go out as one presence frame per
+local room, and last_seen of users who left this node is written to the
+database in one bulk UPDATE.
+"""
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.database.database import AsyncSessionLocal
+from app.database.redis_client import get_async_redis
+from app.models.chat import room_memberships
+from app.models.user import User
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_KEY = "presence:online"
+PRESENCE_CHANNEL = "presence:changes"
+
+
+def member_user_id(member) -> int:
+    """
+    User id of a presence set member ("{user_id}:{node_id}")
+    """
+    if isinstance(member, bytes):
+        member = member.decode("utf-8")
+    return int(member.split(":", 1)[0])
+
+
+class PresenceService:
+    """
+    Online users from the presence set, with the heartbeat/flush loop of this node
+    """
+    def __init__(
+        self,
+        redis_client=None,
+        node_id: Optional[str] = None,
+        ttl: Optional[int] = None,
+        heartbeat_interval: Optional[float] = None,
+        batch_delay: Optional[float] = None,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal
+    ):
+        self._redis = redis_client
+        self._node_id = node_id
+        self.ttl = ttl or settings.PRESENCE_TTL_SECONDS
+        self.heartbeat_interval = heartbeat_interval or settings.PRESENCE_HEARTBEAT_SECONDS
+        self.batch_delay = (
+            batch_delay if batch_delay is not None else settings.PRESENCE_BATCH_MS / 1000
+        )
+        self.session_factory = session_factory
+        # the connection manager delivering presence frames to local rooms
+        self.manager = None
+
+        # user id -> open sockets on this node
+        self.local_sockets: Dict[int, int] = {}
+        # users whose last socket on this node closed, with the time it did
+        self._departed: Dict[int, datetime] = {}
+        # online users, the presence cache, and their members in the set
+        self.online: Set[int] = set()
+        self.members: Dict[int, Set[str]] = {}
+        # local users whose member the other nodes were told about
+        self._announced: Set[int] = set()
+        # member -> online, changes not published yet
+        self._unpublished: Dict[str, bool] = {}
+        # whether the online members were read since the subscription started
+        self._synced = False
+        self._wake: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.listener_task: Optional[asyncio.Task] = None
+
+        # counters for monitoring
+        self.ticks = 0
+        self.diffs_published = 0
+        self.frames_sent = 0
+        self.last_seen_written = 0
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = get_async_redis()
+        return self._redis
+
+    @property
+    def node_id(self) -> str:
+        if self._node_id is None and self.manager is not None:
+            self._node_id = self.manager.node_id
+        return self._node_id or "local"
+
+    def is_online(self, user_id: int) -> bool:
+        """
+        Online status from the presence cache
+
+        Time Complexity: O(1)
+        """
+        return user_id in self.online or user_id in self.local_sockets
+
+    def member(self, user_id: int) -> str:
+        return f"{user_id}:{self.node_id}"
+
+    def start(self, manager=None):
+        """
+        Start the tick and listener tasks, presence frames are sent through manager
+        """
+        if manager is not None:
+            self.manager = manager
+        if self.task is not None and not self.task.done():
+            return
+        self._wake = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+        self.listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        """
+        Stop the tasks, after a last tick that flushes pending last_seen writes
+        """
+        if self.task is None:
+            return
+        for task in (self.task, self.listener_task):
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self.task = None
+        self.listener_task = None
+        # sockets still open are closed by the shutdown
+        now = datetime.utcnow()
+        for user_id in self.local_sockets:
+            self._departed[user_id] = now
+        self.local_sockets.clear()
+        await self.tick()
+
+    def connect(self, user_id: int):
+        """
+        Count a socket of a user opened on this node
+        """
+        self.start()
+        count = self.local_sockets.get(user_id, 0)
+        self.local_sockets[user_id] = count + 1
+        if count == 0:
+            self._departed.pop(user_id, None)
+            self._wake.set()
+
+    def disconnect(self, user_id: int):
+        """
+        Count a socket of a user closed on this node
+        """
+        count = self.local_sockets.get(user_id, 0) - 1
+        if count > 0:
+            self.local_sockets[user_id] = count
+            return
+        self.local_sockets.pop(user_id, None)
+        self._departed[user_id] = datetime.utcnow()
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.heartbeat_interval)
+                # let connects and disconnects arriving together share a tick
+                await asyncio.sleep(self.batch_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Presence tick failed: {e}")
+
+    async def _listen(self):
+        """
+        Apply the diffs published by the other nodes
+        """
+        backoff = 0.5
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(PRESENCE_CHANNEL)
+                # diffs may have been missed while not subscribed
+                self._synced = False
+                self._wake.set()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+                    if message is not None:
+                        await self._on_diff(message["data"])
+                    backoff = 0.5
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis presence listener error (non-critical): {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def _on_diff(self, data):
+        try:
+            diff = json.loads(data)
+            node_id, changes = diff["node"], diff["changes"]
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Dropping malformed presence diff: {e}")
+            return
+        if node_id == self.node_id:
+            return
+        for member, online in changes.items():
+            if not online and member.endswith(f":{self.node_id}"):
+                # our entry expired (heartbeats were lost), announce it again
+                self._announced.discard(member_user_id(member))
+                self._wake.set()
+        await self._apply(changes)
+
+    async def _apply(self, changes: Dict[str, bool], snapshot: bool = False):
+        """
+        Update the online members, fanning out the users whose status changed
+
+        With snapshot the changes are the whole set and replace the members.
+        """
+        before = set(self.online)
+        if snapshot:
+            self.members = {}
+        for member, online in changes.items():
+            user_id = member_user_id(member)
+            if online:
+                self.members.setdefault(user_id, set()).add(member)
+            elif user_id in self.members:
+                self.members[user_id].discard(member)
+                if not self.members[user_id]:
+                    del self.members[user_id]
+        self.online = set(self.members)
+
+        changed = {user_id: True for user_id in self.online - before}
+        changed.update({user_id: False for user_id in before - self.online})
+        if changed:
+            await self._fan_out(changed)
+
+    async def tick(self):
+        """
+        Heartbeat local users, publish the members that changed, fan out
+        the changes and flush last_seen
+
+        Time Complexity: O(u + c) for u local users and c changed members,
+        O(o) for o online entries when the members are read again
+        """
+        self.ticks += 1
+        now = time.time()
+        departed = self._departed
+        self._departed = {}
+        synced = self._synced
+
+        pipe = self.redis.pipeline(transaction=True)
+        if self.local_sockets:
+            expires = now + self.ttl
+            pipe.zadd(PRESENCE_KEY, {self.member(user_id): expires for user_id in self.local_sockets})
+        if departed:
+            pipe.zrem(PRESENCE_KEY, *[self.member(user_id) for user_id in departed])
+        # entries of nodes that stopped heartbeating
+        pipe.zrangebyscore(PRESENCE_KEY, "-inf", now)
+        pipe.zremrangebyscore(PRESENCE_KEY, "-inf", now)
+        if not synced:
+            pipe.zrangebyscore(PRESENCE_KEY, now, "+inf")
+        try:
+            results = await pipe.execute()
+        except Exception as e:
+            print(f"Redis presence error (non-critical): {e}")
+            # retry the departures on the next tick, unless the user came back
+            for user_id, seen in departed.items():
+                if user_id not in self.local_sockets:
+                    self._departed.setdefault(user_id, seen)
+            return
+
+        changes: Dict[str, bool] = {}
+        for user_id in self.local_sockets:
+            if user_id not in self._announced:
+                changes[self.member(user_id)] = True
+        for user_id in departed:
+            if user_id not in self.local_sockets:
+                changes[self.member(user_id)] = False
+        expired = results[-2] if synced else results[-3]
+        for member in expired:
+            if isinstance(member, bytes):
+                member = member.decode("utf-8")
+            changes[member] = False
+
+        self._announced = set(self.local_sockets)
+        if changes:
+            self._unpublished.update(changes)
+        if self._unpublished:
+            await self._publish()
+
+        if synced:
+            await self._apply(changes)
+        else:
+            self._synced = True
+            members = {
+                member if isinstance(member, str) else member.decode("utf-8"): True
+                for member in results[-1]
+            }
+            members.update({self.member(user_id): True for user_id in self.local_sockets})
+            await self._apply(members, snapshot=True)
+
+        if departed:
+            await self._flush_last_seen(
+                {user_id: seen for user_id, seen in departed.items() if user_id not in self.online}
+            )
+
+    async def _publish(self):
+        """
+        Send the unpublished changes to the other nodes, kept for the next tick on failure
+        """
+        try:
+            await self.redis.publish(
+                PRESENCE_CHANNEL,
+                json.dumps({"node": self.node_id, "changes": self._unpublished})
+            )
+        except Exception as e:
+            print(f"Redis presence publish error (non-critical): {e}")
+            return
+        self._unpublished = {}
+        self.diffs_published += 1
+
+    async def _fan_out(self, changes: Dict[int, bool]):
+        """
+        Send one presence frame to each local room with a changed member
+        """
+        if self.manager is None:
+            return
+        rooms = list(self.manager.active_connections)
+        if not rooms:
+            return
+
+        by_room: Dict[int, List[dict]] = {}
+        async with self.session_factory() as db:
+            for room_id, user_id in await self._room_members(db, rooms, changes):
+                by_room.setdefault(room_id, []).append(
+                    {"user_id": user_id, "is_online": changes[user_id]}
+                )
+
+        for room_id, room_changes in by_room.items():
+            self.manager.deliver_local(room_id, {
+                "type": "presence",
+                "room_id": room_id,
+                "changes": room_changes
+            })
+            self.frames_sent += 1
+
+    @staticmethod
+    async def _room_members(db: AsyncSession, rooms: List[int], users: Iterable[int]):
+        return (await db.execute(
+            select(room_memberships.c.room_id, room_memberships.c.user_id).where(
+                room_memberships.c.room_id.in_(rooms),
+                room_memberships.c.user_id.in_(list(users))
+            )
+        )).all()
+
+    async def _flush_last_seen(self, seen: Dict[int, datetime]):
+        """
+        Write last_seen of users who went offline in one bulk UPDATE
+        """
+        if not seen:
+            return
+        try:
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(User),
+                    [{"id": user_id, "last_seen": at} for user_id, at in seen.items()]
+                )
+                await db.commit()
+            self.last_seen_written += len(seen)
+        except Exception as e:
+            logger.warning(f"Flushing last_seen of {len(seen)} users failed: {e}")
+
+    def clear(self):
+        self.local_sockets.clear()
+        self._departed.clear()
+        self.online.clear()
+        self.members.clear()
+        self._announced.clear()
+        self._unpublished.clear()
+        self._synced = False
+
+    def get_stats(self) -> dict:
+        return {
+            "online": len(self.online),
+            "local_users": len(self.local_sockets),
+            "ticks": self.ticks,
+            "diffs_published": self.diffs_published,
+            "frames_sent": self.frames_sent,
+            "last_seen_written": self.last_seen_written,
+        }
+
+
+# global presence service instance
+presence = PresenceService()
@@ -0,0 +1,203 @@
+"""
+In-memory tail of recent messages for hot rooms
+
+The room detail endpoint embeds the last ROOM_RECENT_MESSAGES messages of a
+room. For recently viewed rooms these are kept in a ring buffer that the
+broadcast path appends to, so the tail is served without a database query.
+A room's buffer is filled from the database on first use and only trusted
+from then on, so it never holds a partial tail.
+
+A node only sees the messages of the rooms it broadcasts to or is
+subscribed to, so a buffer lives for RECENT_MESSAGES_TTL_SECONDS at most
+and the connection manager drops it when it unsubscribes from the room.
+
+While a room's tail loads, messages recorded for it are held aside and
+merged into the loaded tail, together with the rows the write-behind
+writer has not inserted yet (the load cannot see those).
+"""
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+from app.core.config import settings
+import threading
+import time
+
+
+class RecentMessagesCache:
+    """
+    Bounded ring buffers of message dicts (MessageResponse fields) per room
+
+    At most max_rooms rooms are kept, the least recently used is dropped,
+    and a room is loaded again ttl seconds after it was filled. Loads of
+    the same room can interleave at await points of the async views, the
+    begin_fill/fill bookkeeping keeps their results consistent.
+    """
+    def __init__(
+        self,
+        window: Optional[int] = None,
+        max_rooms: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        self.window = window or settings.ROOM_RECENT_MESSAGES
+        self.max_rooms = max_rooms or settings.RECENT_MESSAGES_CACHE_ROOMS
+        self.ttl = ttl or settings.RECENT_MESSAGES_TTL_SECONDS
+        self._rooms: "OrderedDict[int, Deque[dict]]" = OrderedDict()
+        # room id -> monotonic time its buffer was filled
+        self._filled_at: Dict[int, float] = {}
+        # room id -> messages recorded while its tail loads, and the loads running
+        self._loading: Dict[int, Dict[int, dict]] = {}
+        self._loaders: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, room_id: int) -> bool:
+        return room_id in self._rooms
+
+    def get(self, room_id: int, loader: Callable[[int], List[dict]]) -> List[dict]:
+        """
+        Recent messages of a room, oldest first
+
+        loader(limit) returns the newest `limit` messages from the database,
+        oldest first; it is only called when the room is not cached.
+
+        Time Complexity: O(w) where w is the window size
+        """
+        messages = self.lookup(room_id)
+        if messages is None:
+            self.begin_fill(room_id)
+            try:
+                loaded = loader(self.window)
+            except BaseException:
+                self.cancel_fill(room_id)
+                raise
+            messages = self.fill(room_id, loaded)
+        return messages
+
+    def lookup(self, room_id: int) -> Optional[List[dict]]:
+        """
+        Cached recent messages of a room, None when the room is not cached
+        """
+        with self._lock:
+            buffer = self._rooms.get(room_id)
+            if buffer is not None and time.monotonic() - self._filled_at[room_id] > self.ttl:
+                self._drop(room_id)
+                buffer = None
+            if buffer is None:
+                self.misses += 1
+                return None
+            self._rooms.move_to_end(room_id)
+            self.hits += 1
+            return list(buffer)
+
+    def begin_fill(self, room_id: int):
+        """
+        Hold messages recorded for a room from now until fill(), call before
+        loading its tail
+        """
+        with self._lock:
+            self._loaders[room_id] = self._loaders.get(room_id, 0) + 1
+            self._loading.setdefault(room_id, {})
+
+    def cancel_fill(self, room_id: int):
+        """
+        The load started with begin_fill() failed
+        """
+        with self._lock:
+            self._end_fill(room_id)
+
+    def _end_fill(self, room_id: int) -> Dict[int, dict]:
+        recorded = self._loading.get(room_id, {})
+        self._loaders[room_id] = self._loaders.get(room_id, 1) - 1
+        if self._loaders[room_id] <= 0:
+            del self._loaders[room_id]
+            self._loading.pop(room_id, None)
+        return recorded
+
+    def fill(self, room_id: int, messages: List[dict], unwritten: Iterable[dict] = ()) -> List[dict]:
+        """
+        Start caching a room from the newest `window` messages loaded from
+        the database, returns the cached tail
+
+        Messages recorded since begin_fill() and the `unwritten` ones (not
+        inserted yet when the load started) are merged in by id.
+        """
+        with self._lock:
+            recorded = self._end_fill(room_id)
+            buffer = self._rooms.get(room_id)
+            if buffer is None:
+                merged = {m["id"]: m for m in messages}
+                merged.update((m["id"], m) for m in unwritten)
+                merged.update(recorded)
+                tail = [merged[i] for i in sorted(merged)][-self.window:]
+                buffer = deque(tail, maxlen=self.window)
+                self._rooms[room_id] = buffer
+                self._filled_at[room_id] = time.monotonic()
+                while len(self._rooms) > self.max_rooms:
+                    self._drop(next(iter(self._rooms)))
+            return list(buffer)
+
+    def record(self, room_id: int, message: dict):
+        """
+        Append a new message to a cached room, held aside for a room whose
+        tail is loading, ignored for other rooms
+
+        Time Complexity: O(1), O(w) for a message older than the newest one
+        """
+        with self._lock:
+            buffer = self._rooms.get(room_id)
+            if buffer is None:
+                if room_id in self._loading:
+                    self._loading[room_id][message["id"]] = message
+                return
+            if not buffer or buffer[-1]["id"] < message["id"]:
+                buffer.append(message)
+                return
+
+            # out of order, e.g. published by another node a moment earlier
+            ids = [m["id"] for m in buffer]
+            index = bisect_left(ids, message["id"])
+            if index < len(ids) and ids[index] == message["id"]:
+                return
+            if len(buffer) == self.window:
+                if index == 0:
+                    # older than everything in a full window
+                    return
+                buffer.popleft()
+                index -= 1
+            buffer.insert(index, message)
+
+    def invalidate(self, room_id: int):
+        """
+        Forget a room's buffer, e.g. after a message was edited or deleted
+        """
+        with self._lock:
+            self._drop(room_id)
+
+    def _drop(self, room_id: int):
+        self._rooms.pop(room_id, None)
+        self._filled_at.pop(room_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self._filled_at.clear()
+            self._loading.clear()
+            self._loaders.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Hit/miss counters for monitoring
+        """
+        lookups = self.hits + self.misses
+        return {
+            "rooms": len(self._rooms),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# global recent messages cache instance
+recent_messages = RecentMessagesCache()
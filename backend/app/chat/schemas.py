@@ -67,7 +67,14 @@ class MessageCreate(BaseModel):
 
 class MessageListResponse(BaseModel):
     messages: List[MessageResponse]
-    total: int
-    page: int
+    # exact count, only computed for page requests or when include_total is set
+    total: Optional[int] = None
+    page: Optional[int] = None
     page_size: int
+    # older messages exist before this page
     has_more: bool
+    # newer messages exist after this page
+    has_newer: bool = False
+    # opaque cursors for the pages of older and newer messages
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
@@ -0,0 +1,249 @@
+"""
+Per-connection outbound queues for WebSocket fan-out
+
+Every connection gets a bounded queue drained by its own writer task, so a
+broadcast only enqueues frames and never waits on a client's network. When a
+queue is full the configured backpressure policy decides what gives way.
+"""
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+from fastapi import WebSocket, status
+from app.chat.frames import Frame
+import asyncio
+import enum
+
+
+class BackpressurePolicy(str, enum.Enum):
+    """What happens when a connection's outbound queue is full"""
+    # evict the oldest queued frame to make room for the new one
+    drop_oldest = "drop_oldest"
+    # replace queued typing frames in place, then evict the oldest frame
+    coalesce_typing = "coalesce_typing"
+    # reject new frames and close the socket after a threshold of drops
+    disconnect = "disconnect"
+
+
+@dataclass
+class SendQueueStats:
+    """Counters shared by all connections of a manager"""
+    dropped_frames: int = 0
+    coalesced_frames: int = 0
+    slow_consumer_disconnects: int = 0
+
+
+class _QueuedFrame:
+    """Queue slot, mutable so coalesced frames can be replaced in place"""
+    __slots__ = ("frame", "coalesce_key")
+
+    def __init__(self, frame: Frame, coalesce_key: Optional[str]):
+        self.frame = frame
+        self.coalesce_key = coalesce_key
+
+
+class ClientConnection:
+    """
+    A websocket with its own bounded outbound queue and writer task
+    """
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        max_queue_size: int,
+        policy: BackpressurePolicy,
+        slow_consumer_threshold: int,
+        stats: SendQueueStats,
+        on_failure: Callable[["ClientConnection"], Awaitable[None]],
+        binary: bool = False,
+        held: bool = False,
+        compact: bool = False
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        # binary clients get the shared pre-encoded bytes as-is
+        self.binary = binary
+        # clients of the msgpack subprotocol get the compact form
+        self.compact = compact
+        self.rooms: Set[int] = set()
+        self.max_queue_size = max_queue_size
+        self.policy = policy
+        self.slow_consumer_threshold = slow_consumer_threshold
+        self.stats = stats
+        self.on_failure = on_failure
+
+        self.queue: Deque[_QueuedFrame] = deque()
+        # coalesce key -> queued frame, for in-place replacement
+        self._pending: Dict[str, _QueuedFrame] = {}
+        self._ready = asyncio.Event()
+        self.writer_task: Optional[asyncio.Task] = None
+        self._closing_task: Optional[asyncio.Task] = None
+        self.closed = False
+        # while held, frames are queued but not sent (see release)
+        self.held = held
+
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        # drops since the queue last drained, drives the disconnect policy
+        self.overflow_streak = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.queue)
+
+    def start(self):
+        """
+        Start the writer task that drains the queue
+        """
+        if self.writer_task is None:
+            self.writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, frame: Frame, coalesce_key: Optional[str] = None) -> bool:
+        """
+        Queue a frame for sending, returns False when the frame was dropped
+
+        Time Complexity: O(1), O(q) when coalesce_typing evicts from a full queue
+        """
+        if self.closed:
+            return False
+
+        if coalesce_key is not None and self.policy == BackpressurePolicy.coalesce_typing:
+            queued = self._pending.get(coalesce_key)
+            if queued is not None:
+                # a newer state supersedes the one still waiting in the queue
+                queued.frame = frame
+                self.stats.coalesced_frames += 1
+                return True
+
+        if len(self.queue) >= self.max_queue_size:
+            if not self._make_room():
+                return False
+
+        queued = _QueuedFrame(frame, coalesce_key)
+        self.queue.append(queued)
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = queued
+        self._ready.set()
+        return True
+
+    def release(
+        self,
+        frames: List[Frame] = (),
+        drop: Optional[Callable[[Frame], bool]] = None
+    ):
+        """
+        Start sending a held connection, frames go out ahead of everything
+        queued while it was held
+
+        Queued frames for which drop(frame) is true are discarded, e.g. live
+        copies of messages that are part of frames.
+        """
+        if drop is not None:
+            kept = deque()
+            for queued in self.queue:
+                if drop(queued.frame):
+                    self._evict(queued)
+                else:
+                    kept.append(queued)
+            self.queue = kept
+        self.queue.extendleft(_QueuedFrame(frame, None) for frame in reversed(frames))
+        self.held = False
+        self._ready.set()
+
+    async def close(self, code: Optional[int] = None):
+        """
+        Stop the writer task and optionally close the socket
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._pending.clear()
+
+        if self.writer_task is not None and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+
+        if code is not None:
+            try:
+                await self.websocket.close(code=code)
+            except Exception:
+                pass
+
+    def _record_drop(self):
+        self.dropped_frames += 1
+        self.overflow_streak += 1
+        self.stats.dropped_frames += 1
+
+    def _evict(self, frame: _QueuedFrame):
+        if frame.coalesce_key is not None and self._pending.get(frame.coalesce_key) is frame:
+            del self._pending[frame.coalesce_key]
+
+    def _make_room(self) -> bool:
+        """
+        Apply the backpressure policy to a full queue, returns True if the
+        new frame can be appended
+        """
+        if self.policy == BackpressurePolicy.disconnect:
+            self._record_drop()
+            if self.overflow_streak >= self.slow_consumer_threshold and self._closing_task is None:
+                self.stats.slow_consumer_disconnects += 1
+                self._closing_task = asyncio.create_task(self._disconnect_slow_consumer())
+            return False
+
+        victim = None
+        if self.policy == BackpressurePolicy.coalesce_typing:
+            # typing frames are the cheapest to lose, evict one of them first
+            victim = next((f for f in self.queue if f.coalesce_key is not None), None)
+        if victim is not None:
+            self.queue.remove(victim)
+        else:
+            victim = self.queue.popleft()
+        self._evict(victim)
+        self._record_drop()
+        return True
+
+    async def _disconnect_slow_consumer(self):
+        await self.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        await self.on_failure(self)
+
+    async def _writer(self):
+        """
+        Drain the queue onto the socket, one frame at a time
+        """
+        try:
+            while not self.closed:
+                if not self.queue or self.held:
+                    self.overflow_streak = 0
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                queued = self.queue.popleft()
+                self._evict(queued)
+                if self.compact:
+                    await self.websocket.send_bytes(queued.frame.compact)
+                elif self.binary:
+                    await self.websocket.send_bytes(queued.frame.data)
+                else:
+                    await self.websocket.send_text(queued.frame.text)
+                self.sent_frames += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error sending to websocket: {e}")
+            await self.close()
+            await self.on_failure(self)
+
+
+def queue_metrics(connections: List[ClientConnection], stats: SendQueueStats) -> dict:
+    """
+    Aggregate queue depth and drop counters for monitoring
+    """
+    depths = [conn.queue_depth for conn in connections]
+    return {
+        "connections": len(connections),
+        "queue_depth_total": sum(depths),
+        "queue_depth_max": max(depths, default=0),
+        "dropped_frames": stats.dropped_frames,
+        "coalesced_frames": stats.coalesced_frames,
+        "slow_consumer_disconnects": stats.slow_consumer_disconnects,
+    }
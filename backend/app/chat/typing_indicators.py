@@ -0,0 +1,160 @@
+"""
+Typing indicators aggregated per room and sent as periodic snapshots
+
+Clients report typing on every keystroke. Instead of fanning out each
+report, the node keeps a (room, user) typing state that expires after
+TYPING_TTL_MS without a refresh. Rooms whose set of typing users changed
+get one "who is typing" snapshot per TYPING_TICK_MS tick, so typing
+traffic grows with rooms and ticks, not with keystrokes.
+
+Snapshot (server -> client):
+{
+    "type": "typing",
+    "room_id": 1,
+    "node": "host-123-ab12cd34",
+    "users": [{"user_id": 5, "username": "john_doe"}]
+}
+
+Each node reports the users typing on its own sockets; clients combine the
+latest snapshot of every node.
+"""
+from typing import Dict, Optional, Set, Tuple
+from app.core.config import settings
+from app.chat.websocket import manager
+import asyncio
+import time
+
+
+class TypingAggregator:
+    """
+    Per-room typing state of this node's users, flushed by a tick task
+    """
+    def __init__(
+        self,
+        manager=None,
+        tick_interval: Optional[float] = None,
+        ttl: Optional[float] = None
+    ):
+        self.manager = manager
+        self.tick_interval = tick_interval or settings.TYPING_TICK_MS / 1000
+        self.ttl = ttl or settings.TYPING_TTL_MS / 1000
+        # room id -> user id -> (username, expires_at)
+        self.rooms: Dict[int, Dict[int, Tuple[str, float]]] = {}
+        # rooms whose typing users changed since the last snapshot
+        self.dirty: Set[int] = set()
+        self._active: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+        # counters for monitoring
+        self.updates = 0
+        self.snapshots = 0
+
+    def start(self, manager=None):
+        """
+        Start the tick task, snapshots are broadcast through manager
+        """
+        if manager is not None:
+            self.manager = manager
+        if self.task is not None and not self.task.done():
+            return
+        self._active = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self.task = None
+
+    def update(self, room_id: int, user_id: int, username: str, is_typing: bool):
+        """
+        Record a typing report, repeated reports only extend the expiry
+
+        Time Complexity: O(1)
+        """
+        self.start()
+        self.updates += 1
+        typing = self.rooms.setdefault(room_id, {})
+        if is_typing:
+            if user_id not in typing:
+                self.dirty.add(room_id)
+            typing[user_id] = (username, time.monotonic() + self.ttl)
+            self._active.set()
+        elif typing.pop(user_id, None) is not None:
+            self.dirty.add(room_id)
+        if not typing:
+            del self.rooms[room_id]
+
+    def clear_user(self, user_id: int):
+        """
+        Stop a user's typing everywhere, e.g. when their socket closes
+        """
+        for room_id in list(self.rooms):
+            typing = self.rooms[room_id]
+            if typing.pop(user_id, None) is not None:
+                self.dirty.add(room_id)
+            if not typing:
+                del self.rooms[room_id]
+
+    def snapshot(self, room_id: int) -> dict:
+        users = self.rooms.get(room_id, {})
+        return {
+            "type": "typing",
+            "room_id": room_id,
+            "node": self.manager.node_id,
+            "users": [
+                {"user_id": user_id, "username": username}
+                for user_id, (username, _) in sorted(users.items())
+            ]
+        }
+
+    async def _run(self):
+        while True:
+            if not self.rooms and not self.dirty:
+                # nobody typing, sleep until the next report
+                self._active.clear()
+                await self._active.wait()
+            await asyncio.sleep(self.tick_interval)
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Typing tick error (non-critical): {e}")
+
+    async def tick(self):
+        """
+        Expire stale typing state and send one snapshot per changed room
+
+        Time Complexity: O(t + r) for t typing users and r changed rooms
+        """
+        now = time.monotonic()
+        for room_id in list(self.rooms):
+            typing = self.rooms[room_id]
+            expired = [user_id for user_id, (_, expires) in typing.items() if expires <= now]
+            for user_id in expired:
+                del typing[user_id]
+            if expired:
+                self.dirty.add(room_id)
+            if not typing:
+                del self.rooms[room_id]
+
+        dirty, self.dirty = self.dirty, set()
+        for room_id in dirty:
+            await self.manager.broadcast_to_room(room_id, self.snapshot(room_id))
+            self.snapshots += 1
+
+    def get_stats(self) -> dict:
+        return {
+            "typing_rooms": len(self.rooms),
+            "updates": self.updates,
+            "snapshots": self.snapshots,
+        }
+
+
+# global typing aggregator, broadcasting through the global connection manager
+typing_indicators = TypingAggregator(manager)
@@ -2,51 +2,124 @@
 Class-based views for chat endpoints
 """
 from fastapi import Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func
-from typing import List
-from app.database.database import get_db
-from app.auth.dependencies import get_current_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy import distinct, func, select
+from typing import List, Optional
+from app.database.database import get_async_db
+from app.auth.dependencies import get_current_principal
+from app.auth.principal import Principal
 from app.models.user import User
 from app.models.chat import ChatRoom, Message, RoomType, room_memberships
 from app.chat.schemas import (
     ChatRoomCreate, ChatRoomResponse, ChatRoomDetail, ChatRoomMember,
     MessageCreate, MessageResponse, MessageListResponse
 )
+from app.chat.membership import membership_cache
+from app.chat.recent import recent_messages
+from app.chat.persistence import message_writer
+from app.chat.presence import presence
+from app.chat.websocket import manager
+from app.chat.pagination import (
+    OLDER, InvalidCursor, MessagePage, decode_cursor, fetch_message_page
+)
 from datetime import datetime
 
 
+async def require_room_membership(db: AsyncSession, room_id: int, user_id: int):
+    """
+    Raise 404 if the room does not exist, 403 if the user is not a member
+
+    Members are answered from the membership cache, the room lookup only
+    runs for non-members to tell the two errors apart.
+    """
+    if await membership_cache.is_member_async(db, room_id, user_id):
+        return
+    
+    if await db.scalar(select(ChatRoom.id).where(ChatRoom.id == room_id)) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat room not found"
+        )
+    
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="You are not a member of this chat room"
+    )
+
+
+def message_to_dict(msg: Message) -> dict:
+    """
+    MessageResponse fields of a message, the form kept in the recent messages cache
+    """
+    return {
+        "id": msg.id,
+        "room_id": msg.room_id,
+        "sender_id": msg.sender_id,
+        "content": msg.content,
+        "timestamp": msg.timestamp,
+        "message_type": msg.message_type,
+        "is_edited": msg.is_edited,
+        "sender_username": msg.sender.username if msg.sender else None
+    }
+
+
 class ChatRoomViews:
     """Class-based views for chat room operations"""
     
     @staticmethod
-    def list_user_chat_rooms(
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+    async def list_user_chat_rooms(
+        current_user: Principal = Depends(get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
     ) -> List[ChatRoomResponse]:
         """
         List all chat rooms for the current user
         
-        Time Complexity: O(n) where n is the number of rooms user is member of
+        Time Complexity: O(n log m) where n is the number of rooms user is
+        member of and m is messages per room
         Space Complexity: O(n) for storing room list
         """
-        # query rooms where user is a member
-        rooms = db.query(ChatRoom).join(
-            room_memberships
-        ).filter(
-            room_memberships.c.user_id == current_user.id
-        ).options(
-            joinedload(ChatRoom.members),
-            joinedload(ChatRoom.messages)
-        ).all()
+        # id of the newest message of each room - one (room_id, id) index
+        # seek per room instead of loading the whole history
+        last_message_id = select(
+            Message.id
+        ).where(
+            Message.room_id == ChatRoom.id
+        ).order_by(
+            Message.id.desc()
+        ).limit(1).correlate(ChatRoom).scalar_subquery()
+        
+        # query rooms where user is a member, members batched in one query
+        rows = (await db.execute(
+            select(ChatRoom, last_message_id).join(
+                room_memberships
+            ).where(
+                room_memberships.c.user_id == current_user.id
+            ).options(
+                selectinload(ChatRoom.members)
+            )
+        )).all()
+        
+        # load all last messages with their senders in one query - o(n)
+        message_ids = [message_id for _, message_id in rows if message_id is not None]
+        last_messages = {}
+        if message_ids:
+            last_messages = {
+                msg.id: msg for msg in await db.scalars(
+                    select(Message).where(
+                        Message.id.in_(message_ids)
+                    ).options(
+                        joinedload(Message.sender)
+                    )
+                )
+            }
         
         # format response with last message
         result = []
-        for room in rooms:
-            # get last message - o(m log m) where m is messages per room
+        for room, message_id in rows:
             last_message = None
-            if room.messages:
-                last_msg = sorted(room.messages, key=lambda m: m.timestamp, reverse=True)[0]
+            last_msg = last_messages.get(message_id)
+            if last_msg is not None:
                 last_message = MessageResponse(
                     id=last_msg.id,
                     room_id=last_msg.room_id,
@@ -68,7 +141,7 @@ class ChatRoomViews:
                     id=member.id,
                     username=member.username,
                     email=member.email,
-                    is_online=member.is_online
+                    is_online=presence.is_online(member.id)
                 ) for member in room.members],
                 last_message=last_message
             )
@@ -77,10 +150,10 @@ class ChatRoomViews:
         return result
     
     @staticmethod
-    def create_chat_room(
+    async def create_chat_room(
         room_data: ChatRoomCreate,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
     ) -> ChatRoomResponse:
         """
         Create a new chat room
@@ -96,27 +169,33 @@ class ChatRoomViews:
                     detail="One-to-one chat must have exactly one other member"
                 )
             
-            # check if one-to-one room already exists between these users
+            # check if one-to-one room already exists between these users -
+            # a one-to-one room both of them are members of
             other_user_id = room_data.member_ids[0]
-            existing_room = db.query(ChatRoom).join(
-                room_memberships, ChatRoom.id == room_memberships.c.room_id
-            ).filter(
-                ChatRoom.room_type == RoomType.one_to_one
-            ).group_by(ChatRoom.id).having(
-                func.count(room_memberships.c.user_id) == 2
-            ).all()
+            existing_room = await db.scalar(
+                select(ChatRoom.id).join(
+                    room_memberships, ChatRoom.id == room_memberships.c.room_id
+                ).where(
+                    ChatRoom.room_type == RoomType.one_to_one,
+                    room_memberships.c.user_id.in_([current_user.id, other_user_id])
+                ).group_by(ChatRoom.id).having(
+                    func.count(distinct(room_memberships.c.user_id)) == 2
+                ).limit(1)
+            )
             
-            for room in existing_room:
-                member_ids = [m.id for m in room.members]
-                if set(member_ids) == {current_user.id, other_user_id}:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="One-to-one chat already exists with this user"
-                    )
+            if existing_room is not None:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="One-to-one chat already exists with this user"
+                )
         
         # verify all member users exist - o(n) database query
-        members = db.query(User).filter(User.id.in_(room_data.member_ids)).all()
-        if len(members) != len(room_data.member_ids):
+        members = (await db.scalars(
+            select(User).where(User.id.in_(room_data.member_ids + [current_user.id]))
+        )).all()
+        creator = next((m for m in members if m.id == current_user.id), None)
+        members = [m for m in members if m.id in room_data.member_ids]
+        if creator is None or len(members) != len(set(room_data.member_ids)):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="One or more users not found"
@@ -130,14 +209,16 @@ class ChatRoomViews:
         )
         
         # add creator and members - o(n)
-        new_room.members.append(current_user)
+        new_room.members.append(creator)
         for member in members:
             if member.id != current_user.id:
                 new_room.members.append(member)
         
         db.add(new_room)
-        db.commit()
-        db.refresh(new_room)
+        await db.commit()
+        
+        # cached "not a member" answers for the new room are now stale
+        await membership_cache.invalidate_room_async(new_room.id)
         
         return ChatRoomResponse(
             id=new_room.id,
@@ -149,28 +230,33 @@ class ChatRoomViews:
                 id=member.id,
                 username=member.username,
                 email=member.email,
-                is_online=member.is_online
+                is_online=presence.is_online(member.id)
             ) for member in new_room.members],
             last_message=None
         )
     
     @staticmethod
-    def get_chat_room_details(
+    async def get_chat_room_details(
         room_id: int,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
     ) -> ChatRoomDetail:
         """
         Get details of a specific chat room including recent messages
         
-        Time Complexity: O(m log m) where m is number of messages (for sorting)
-        Space Complexity: O(m) for storing messages
+        Only the last ROOM_RECENT_MESSAGES messages are embedded, served
+        from the recent messages cache for hot rooms. Older history is
+        paged through the messages endpoint.
+        
+        Time Complexity: O(p + w) where p is number of members, w is the window
+        Space Complexity: O(p + w)
         """
-        # get room with members and messages
-        room = db.query(ChatRoom).filter(ChatRoom.id == room_id).options(
-            joinedload(ChatRoom.members),
-            joinedload(ChatRoom.messages).joinedload(Message.sender)
-        ).first()
+        # get room with members, batched in one query
+        room = await db.scalar(
+            select(ChatRoom).where(ChatRoom.id == room_id).options(
+                selectinload(ChatRoom.members)
+            )
+        )
         
         if not room:
             raise HTTPException(
@@ -178,15 +264,32 @@ class ChatRoomViews:
                 detail="Chat room not found"
             )
         
-        # check if user is a member - o(n) where n is number of members
+        # check if user is a member - o(p) where p is number of members
         if current_user.id not in [member.id for member in room.members]:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You are not a member of this chat room"
             )
         
-        # sort messages by timestamp - o(m log m)
-        sorted_messages = sorted(room.messages, key=lambda m: m.timestamp)
+        # tail window - from memory, or one (room_id, id) index scan on a miss
+        messages = recent_messages.lookup(room_id)
+        if messages is None:
+            # messages recorded from here on are held for the fill, and rows
+            # still unwritten now are ones the query below cannot see
+            recent_messages.begin_fill(room_id)
+            usernames = {member.id: member.username for member in room.members}
+            unwritten = [
+                dict(row, sender_username=usernames.get(row["sender_id"]))
+                for row in message_writer.unwritten_rows(room_id)
+            ]
+            try:
+                page = await db.run_sync(fetch_message_page, room_id, recent_messages.window)
+            except BaseException:
+                recent_messages.cancel_fill(room_id)
+                raise
+            messages = recent_messages.fill(
+                room_id, [message_to_dict(msg) for msg in page.messages], unwritten
+            )
         
         return ChatRoomDetail(
             id=room.id,
@@ -198,18 +301,9 @@ class ChatRoomViews:
                 id=member.id,
                 username=member.username,
                 email=member.email,
-                is_online=member.is_online
+                is_online=presence.is_online(member.id)
             ) for member in room.members],
-            messages=[MessageResponse(
-                id=msg.id,
-                room_id=msg.room_id,
-                sender_id=msg.sender_id,
-                content=msg.content,
-                timestamp=msg.timestamp,
-                message_type=msg.message_type,
-                is_edited=msg.is_edited,
-                sender_username=msg.sender.username if msg.sender else None
-            ) for msg in sorted_messages]
+            messages=[MessageResponse(**msg) for msg in messages]
         )
 
 
@@ -217,59 +311,82 @@ class MessageViews:
     """Class-based views for message operations"""
     
     @staticmethod
-    def get_room_messages(
+    async def get_room_messages(
         room_id: int,
-        page: int = Query(1, ge=1),
+        page: Optional[int] = Query(None, ge=1),
         page_size: int = Query(50, ge=1, le=100),
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        before_id: Optional[int] = Query(None),
+        after_id: Optional[int] = Query(None),
+        around_id: Optional[int] = Query(None),
+        cursor: Optional[str] = Query(None),
+        include_total: bool = Query(False),
+        current_user: Principal = Depends(get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
     ) -> MessageListResponse:
         """
-        Get paginated message history for a chat room
+        Get message history for a chat room, oldest first within the page
+        
+        Pages are addressed by a message id (before_id, after_id, around_id)
+        or by a cursor returned with a previous page. Without any of them the
+        newest messages are returned. The page parameter selects the legacy
+        OFFSET pagination and always computes the total.
         
         Time Complexity: O(log n + k) where n is total messages, k is page_size
+        (O(n) for page requests and include_total)
         Space Complexity: O(k) for storing page of messages
         """
-        # verify room exists - o(1) with index
-        room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
-        
-        if not room:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Chat room not found"
-            )
+        # verify membership - o(1) from the membership cache
+        await require_room_membership(db, room_id, current_user.id)
         
-        # check if user is a member - o(1) with index
-        is_member = db.query(room_memberships).filter(
-            room_memberships.c.room_id == room_id,
-            room_memberships.c.user_id == current_user.id
-        ).first()
+        if cursor is not None:
+            try:
+                direction, message_id = decode_cursor(cursor)
+            except InvalidCursor as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            if direction == OLDER:
+                before_id = message_id
+            else:
+                after_id = message_id
         
-        if not is_member:
+        anchors = [a for a in (before_id, after_id, around_id) if a is not None]
+        if len(anchors) > 1:
             raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You are not a member of this chat room"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Use only one of before_id, after_id, around_id and cursor"
             )
         
-        # get total count - o(1) with index
-        total = db.query(Message).filter(Message.room_id == room_id).count()
-        
-        # calculate offset
-        offset = (page - 1) * page_size
-        
-        # get paginated messages - o(log n + k)
-        messages = db.query(Message).filter(
-            Message.room_id == room_id
-        ).options(
-            joinedload(Message.sender)
-        ).order_by(
-            Message.timestamp.desc()
-        ).offset(offset).limit(page_size).all()
-        
-        # reverse to show oldest first in the page - o(k)
-        messages = list(reversed(messages))
+        total = None
+        if include_total or (page is not None and not anchors):
+            # o(n) over the room, only on request
+            total = await db.scalar(
+                select(func.count(Message.id)).where(Message.room_id == room_id)
+            )
         
-        has_more = offset + page_size < total
+        if page is not None and not anchors:
+            # legacy offset pagination - o(offset + k)
+            offset = (page - 1) * page_size
+            messages = (await db.scalars(
+                select(Message).where(
+                    Message.room_id == room_id
+                ).options(
+                    joinedload(Message.sender)
+                ).order_by(
+                    Message.id.desc()
+                ).offset(offset).limit(page_size)
+            )).all()
+            
+            # reverse to show oldest first in the page - o(k)
+            result = MessagePage(
+                messages=list(reversed(messages)),
+                has_older=offset + page_size < total,
+                has_newer=page > 1
+            )
+        else:
+            # keyset pagination on the (room_id, id) index - o(log n + k)
+            result = await db.run_sync(
+                fetch_message_page, room_id, page_size,
+                before_id=before_id, after_id=after_id, around_id=around_id
+            )
         
         return MessageListResponse(
             messages=[MessageResponse(
@@ -281,46 +398,34 @@ class MessageViews:
                 message_type=msg.message_type,
                 is_edited=msg.is_edited,
                 sender_username=msg.sender.username if msg.sender else None
-            ) for msg in messages],
+            ) for msg in result.messages],
             total=total,
             page=page,
             page_size=page_size,
-            has_more=has_more
+            has_more=result.has_older,
+            has_newer=result.has_newer,
+            next_cursor=result.next_cursor,
+            prev_cursor=result.prev_cursor
         )
     
     @staticmethod
-    def send_message(
+    async def send_message(
         room_id: int,
         message_data: MessageCreate,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
     ) -> MessageResponse:
         """
         Send a message to a chat room via REST API
         
+        The stored message goes out like one sent over a socket: to the
+        room's sockets on every node, the replay log and the recent tail.
+        
         Time Complexity: O(1) - single database insert
         Space Complexity: O(1) - single message object
         """
-        # verify room exists - o(1) with index
-        room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
-        
-        if not room:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Chat room not found"
-            )
-        
-        # check if user is a member - o(1) with index
-        is_member = db.query(room_memberships).filter(
-            room_memberships.c.room_id == room_id,
-            room_memberships.c.user_id == current_user.id
-        ).first()
-        
-        if not is_member:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You are not a member of this chat room"
-            )
+        # verify membership - o(1) from the membership cache
+        await require_room_membership(db, room_id, current_user.id)
         
         # create message - o(1)
         new_message = Message(
@@ -332,10 +437,9 @@ class MessageViews:
         )
         
         db.add(new_message)
-        db.commit()
-        db.refresh(new_message)
+        await db.commit()
         
-        return MessageResponse(
+        response = MessageResponse(
             id=new_message.id,
             room_id=new_message.room_id,
             sender_id=new_message.sender_id,
@@ -345,3 +449,10 @@ class MessageViews:
             is_edited=new_message.is_edited,
             sender_username=current_user.username
         )
+        # live delivery, and keeps the tail of hot rooms current
+        await manager.broadcast_to_room(room_id, {
+            "type": "message",
+            "data": response.model_dump(mode="json")
+        })
+        
+        return response
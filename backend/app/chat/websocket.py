@@ -1,180 +1,830 @@
 """
 WebSocket connection manager and handlers for real-time chat
 """
-from typing import Dict, Set
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 from fastapi import WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-from app.database.redis_client import get_redis
-from app.models.chat import Message, ChatRoom
-from app.models.user import User
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.database.redis_client import get_async_redis
+from app.chat.frames import Frame
+from app.chat.send_queue import (
+    BackpressurePolicy, ClientConnection, SendQueueStats, queue_metrics
+)
+from app.chat.membership import membership_cache
+from app.chat.message_log import RoomMessageLog, message_log
+from app.chat.recent import RecentMessagesCache, recent_messages
+from app.chat.wire import is_compact
+import enum
 import json
 import asyncio
-from datetime import datetime
+import os
+import socket
+import uuid
+
+
+class DeliveryMode(str, enum.Enum):
+    """How broadcast_to_room reaches the sockets of a room"""
+    # sockets on this node only, redis is never touched
+    local = "local"
+    # publish only, every node (this one included) delivers from the listener
+    redis = "redis"
+    # local sockets directly, other nodes via pub/sub, own echo is skipped
+    hybrid = "hybrid"
+    # hybrid, but only published when another node holds sockets in the room
+    cluster = "cluster"
+
+
+ENVELOPE_VERSION = "v1"
+
+# cluster mode: nodes announce room interest changes on this channel
+CLUSTER_CHANNEL = "chat_cluster"
+
+
+def generate_node_id() -> str:
+    """
+    Generate a process-unique node identity
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def pack_envelope(
+    node_id: str,
+    room_id: int,
+    payload: bytes,
+    coalesce_key: Optional[str] = None
+) -> bytes:
+    """
+    Wrap an encoded message with the publishing node, the room id and the
+    optional coalesce key used by the send queues
+
+    The header is plain text so the payload is forwarded to sockets as-is,
+    without decoding and re-encoding the JSON on the receiving node.
+    """
+    header = f"{ENVELOPE_VERSION}|{node_id}|{room_id}|{coalesce_key or ''}|"
+    return header.encode("utf-8") + payload
+
+
+def unpack_envelope(data: Union[str, bytes]) -> Tuple[str, int, Optional[str], str]:
+    """
+    Split an envelope into (node_id, room_id, coalesce_key, message_json)
+    """
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    version, node_id, room_id, coalesce_key, message_json = data.split("|", 4)
+    if version != ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version: {version}")
+    return node_id, int(room_id), coalesce_key or None, message_json
+
+
+def chat_messages(message: dict) -> List[dict]:
+    """
+    Chat messages carried by a broadcast, several for a batch frame
+    """
+    if message.get("type") == "message" and isinstance(message.get("data"), dict):
+        return [message["data"]]
+    if message.get("type") == "batch" and isinstance(message.get("messages"), list):
+        return message["messages"]
+    return []
+
+
+def chat_message_id(message: dict) -> Optional[int]:
+    """
+    Id of a chat message broadcast, None for other message types
+    
+    A batch frame goes by the id of its last (newest) message.
+    """
+    messages = chat_messages(message)
+    return messages[-1].get("id") if messages else None
+
+
+def frame_message_id(frame: Frame) -> Optional[int]:
+    """
+    Id of the chat message in an encoded frame, None for other frames
+    """
+    try:
+        message = json.loads(frame.text)
+    except ValueError:
+        return None
+    return chat_message_id(message) if isinstance(message, dict) else None
+
+
+def coalesce_key_for(room_id: int, message: dict) -> Optional[str]:
+    """
+    Queue coalescing key, only typing state is safe to supersede
+    
+    A typing snapshot supersedes the previous one of the same node, a
+    per-user typing event the previous one of the same user.
+    """
+    if message.get("type") == "typing":
+        source = message.get("node") if "users" in message else message.get("user_id")
+        return f"typing:{room_id}:{source}"
+    return None
 
 
 class ConnectionManager:
     """
     Manages WebSocket connections and message broadcasting
+
+    Cross-node fan-out uses a single long-lived Redis pub/sub subscription per
+    process. Room channels are subscribed when the first local socket joins a
+    room and unsubscribed when the last one leaves, and a listener task blocks
+    on the subscription so messages are delivered as soon as they arrive.
+    
+    With WS_CHANNEL_SHARDS set, rooms hash onto that many shard channels and
+    a shard is subscribed while any of its rooms has local sockets, so the
+    subscription count stays bounded however many rooms a node serves.
+    Messages of other rooms on a subscribed shard are dropped by room id.
+    
+    Published messages are wrapped in an envelope tagged with the node id, so
+    in hybrid mode a node skips its own publications instead of delivering
+    them to its local sockets a second time.
+    
+    In cluster mode every node registers the rooms it holds sockets for in a
+    Redis set per room (room_nodes:{room_id}) and announces changes on the
+    cluster channel. Each node mirrors the remote interest of the rooms it
+    publishes to, so a message for a room no other node serves never goes
+    through Redis. A node that dies without leaving its rooms stays in their
+    sets, which only costs publishes nobody receives.
+    
+    Chat messages are also appended to the room's Redis stream when the
+    message log is enabled, so a reconnecting socket can be replayed what it
+    missed (see replay and app.chat.message_log).
+    
+    Each socket has a bounded outbound queue drained by its own writer task
+    (see app.chat.send_queue), so broadcasting is an O(n) enqueue that never
+    waits on a slow client. Messages are serialized once into a Frame that is
+    shared by all recipients and the Redis publish.
     """
-    def __init__(self):
+    def __init__(
+        self,
+        redis_client=None,
+        node_id: Optional[str] = None,
+        delivery_mode: Optional[str] = None,
+        send_queue_size: Optional[int] = None,
+        backpressure_policy: Optional[str] = None,
+        slow_consumer_threshold: Optional[int] = None,
+        recent_cache: Optional[RecentMessagesCache] = None,
+        channel_shards: Optional[int] = None,
+        stream_log: Optional[RoomMessageLog] = None
+    ):
         # active connections: room_id -> set of websockets
         self.active_connections: Dict[int, Set[WebSocket]] = {}
-        # websocket to user mapping
-        self.websocket_users: Dict[WebSocket, int] = {}
-        # redis client for pub/sub
-        self.redis = get_redis()
-        # pubsub instance
+        # websocket to connection (user, outbound queue, rooms) mapping
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        # asyncio redis client for pub/sub
+        self.redis = redis_client if redis_client is not None else get_async_redis()
+        # pubsub instance (created on first subscription)
         self.pubsub = None
         # listener task
         self.listener_task = None
+        # rooms currently subscribed on the pubsub connection
+        self.subscribed_rooms: Set[int] = set()
+        # 0 for a channel per room, else the number of shard channels
+        self.channel_shards = (
+            settings.WS_CHANNEL_SHARDS if channel_shards is None else channel_shards
+        )
+        # subscribed channel -> number of subscribed rooms mapped onto it
+        self.channel_refs: Dict[str, int] = {}
+        # serializes subscribe/unsubscribe commands on the shared connection
+        self._pubsub_lock = asyncio.Lock()
+        # identity used to recognise our own publications
+        self.node_id = node_id or settings.NODE_ID or generate_node_id()
+        self.delivery_mode = DeliveryMode(delivery_mode or settings.WS_DELIVERY_MODE)
+        # outbound queue configuration
+        self.send_queue_size = send_queue_size or settings.WS_SEND_QUEUE_SIZE
+        self.backpressure_policy = BackpressurePolicy(
+            backpressure_policy or settings.WS_BACKPRESSURE_POLICY
+        )
+        self.slow_consumer_threshold = slow_consumer_threshold or settings.WS_SLOW_CONSUMER_THRESHOLD
+        self.queue_stats = SendQueueStats()
+        # tail of hot rooms, kept current with every chat message seen here
+        self.recent = recent_cache if recent_cache is not None else recent_messages
+        # durable per-room stream for replay on reconnect
+        self.message_log = stream_log if stream_log is not None else message_log
+        # cluster mode: room id -> other nodes with sockets in the room, only
+        # for rooms this node has published to and kept current from the
+        # cluster channel
+        self.remote_interest: Dict[int, Set[str]] = {}
+        # registry loads in flight, and the joins announced meanwhile
+        self._interest_loads: Dict[int, asyncio.Future] = {}
+        self._pending_joins: Dict[int, Set[str]] = {}
+        self.cluster_subscribed = False
+        self.skipped_publishes = 0
+    
+    def room_channel(self, room_id: int) -> str:
+        """
+        Redis channel name for a chat room, its shard channel when sharded
+        
+        Every node of a cluster must use the same number of shards.
+        """
+        if self.channel_shards:
+            return f"chat_shard_{room_id % self.channel_shards}"
+        return f"chat_room_{room_id}"
+    
+    @staticmethod
+    def room_nodes_key(room_id: int) -> str:
+        """
+        Redis set of the nodes holding sockets in a chat room (cluster mode)
+        """
+        return f"room_nodes:{room_id}"
     
-    async def connect(self, websocket: WebSocket, room_id: int, user_id: int):
+    async def connect(
+        self,
+        websocket: WebSocket,
+        room_id: int,
+        user_id: int,
+        binary: bool = False,
+        hold: bool = False,
+        subprotocol: Optional[str] = None
+    ):
         """
         Accept websocket connection and add to room
+        
+        binary clients receive the pre-encoded frames as binary messages.
+        With hold, broadcasts are queued but not sent until replay() ran.
+        subprotocol is the negotiated wire format (see app.chat.wire).
+        """
+        await self.connect_rooms(
+            websocket, [room_id], user_id, binary=binary, hold=hold, subprotocol=subprotocol
+        )
+    
+    async def connect_rooms(
+        self,
+        websocket: WebSocket,
+        room_ids: Iterable[int],
+        user_id: int,
+        binary: bool = False,
+        hold: bool = False,
+        subprotocol: Optional[str] = None
+    ):
+        """
+        Accept a websocket connection and add it to several rooms at once
+        
+        The socket has one outbound queue and writer task however many rooms
+        it is in; frames carry their room_id for routing on the client.
+        """
+        await websocket.accept(subprotocol=subprotocol)
+        
+        # give the socket its outbound queue and writer task
+        connection = self.connections.get(websocket)
+        if connection is None:
+            connection = ClientConnection(
+                websocket,
+                user_id,
+                max_queue_size=self.send_queue_size,
+                policy=self.backpressure_policy,
+                slow_consumer_threshold=self.slow_consumer_threshold,
+                stats=self.queue_stats,
+                on_failure=self._on_connection_failure,
+                binary=binary,
+                held=hold,
+                compact=is_compact(subprotocol)
+            )
+            self.connections[websocket] = connection
+            connection.start()
+        
+        for room_id in room_ids:
+            await self.join_room(websocket, room_id)
+    
+    async def join_room(self, websocket: WebSocket, room_id: int):
+        """
+        Add a connected websocket to another room
         """
-        await websocket.accept()
+        self.connections[websocket].rooms.add(room_id)
         
         # add to active connections
-        if room_id not in self.active_connections:
+        is_new_room = room_id not in self.active_connections
+        if is_new_room:
             self.active_connections[room_id] = set()
         self.active_connections[room_id].add(websocket)
         
-        # map websocket to user
-        self.websocket_users[websocket] = user_id
-        
-        # start redis listener if not already running
-        if self.listener_task is None:
-            self.listener_task = asyncio.create_task(self._redis_listener())
+        # subscribe to the room channel when the first local socket joins
+        if is_new_room:
+            await self._subscribe(room_id)
     
     async def disconnect(self, websocket: WebSocket, room_id: int):
         """
         Remove websocket connection from room
         """
-        if room_id in self.active_connections:
-            self.active_connections[room_id].discard(websocket)
-            if not self.active_connections[room_id]:
-                del self.active_connections[room_id]
+        await self.leave_room(websocket, room_id)
+        
+        # stop the writer once the socket left its last room
+        connection = self.connections.get(websocket)
+        if connection is not None and not connection.rooms:
+            del self.connections[websocket]
+            await connection.close()
+    
+    async def disconnect_all(self, websocket: WebSocket):
+        """
+        Remove a websocket from all of its rooms and stop its writer
+        """
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        # out of every room before the first await, so no broadcast meanwhile
+        # finds the socket without its connection
+        emptied = [room_id for room_id in list(connection.rooms) if self._detach(websocket, room_id)]
+        connection.rooms.clear()
+        for room_id in emptied:
+            await self._unsubscribe(room_id)
+        await connection.close()
+    
+    async def leave_room(self, websocket: WebSocket, room_id: int):
+        """
+        Remove a websocket from one room, keeping its connection open
+        """
+        room_emptied = self._detach(websocket, room_id)
+        
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.rooms.discard(room_id)
         
-        # remove from user mapping
-        if websocket in self.websocket_users:
-            del self.websocket_users[websocket]
+        # unsubscribe once no local socket is left in the room
+        if room_emptied:
+            await self._unsubscribe(room_id)
+    
+    def _detach(self, websocket: WebSocket, room_id: int) -> bool:
+        """
+        Remove a websocket from a room's local sockets, True if it was the last
+        """
+        sockets = self.active_connections.get(room_id)
+        if sockets is None:
+            return False
+        sockets.discard(websocket)
+        if sockets:
+            return False
+        del self.active_connections[room_id]
+        return True
     
     async def broadcast_to_room(self, room_id: int, message: dict):
         """
         Broadcast message to all connections in a room
-        For single-server: direct broadcast to websockets
-        For multi-server: use Redis pub/sub
+        
+        local:  direct send to this node's websockets
+        redis:  publish only, the listener delivers on every node
+        hybrid: direct send here, publish for the other nodes
+        """
+        # serialize once, the frame is shared by every recipient and redis
+        frame = Frame.from_message(message)
+        coalesce_key = coalesce_key_for(room_id, message)
+        self._record_recent(room_id, message)
+        message_id = chat_message_id(message)
+        if message_id is not None:
+            await self.message_log.append(room_id, message_id, frame.text)
+        
+        if self.delivery_mode == DeliveryMode.redis:
+            # our own echo delivers locally, unless publishing failed
+            if not await self._publish(room_id, frame, coalesce_key):
+                self._send_to_local(room_id, frame, coalesce_key)
+            return
+        
+        # enqueueing never blocks, so local sockets don't wait for redis
+        self._send_to_local(room_id, frame, coalesce_key)
+        if self.delivery_mode == DeliveryMode.hybrid:
+            await self._publish(room_id, frame, coalesce_key)
+        elif self.delivery_mode == DeliveryMode.cluster:
+            if await self._has_remote_interest(room_id):
+                await self._publish(room_id, frame, coalesce_key)
+            else:
+                self.skipped_publishes += 1
+    
+    async def replay(
+        self,
+        websocket: WebSocket,
+        room_id: int,
+        last_seen_id: int,
+        greeting: Optional[str] = None
+    ) -> int:
+        """
+        Send a socket connected with hold the greeting, the messages after
+        last_seen_id and a replay_complete marker, then the live messages
+        queued meanwhile
+        
+        Live copies of replayed messages are dropped. complete is false when
+        the log may not reach back to last_seen_id and the client should
+        fetch the history over REST. Returns the number of messages replayed.
+        """
+        replay = await self.message_log.read_after(room_id, last_seen_id)
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return 0
+        
+        frames = [Frame.from_text(text) for text in replay.frames]
+        if greeting is not None:
+            frames.insert(0, Frame.from_text(greeting))
+        frames.append(Frame.from_message({
+            "type": "replay_complete",
+            "room_id": room_id,
+            "replayed": len(replay.frames),
+            "complete": replay.complete
+        }))
+        replayed_ids = set(replay.message_ids)
+        
+        def is_replayed(frame: Frame) -> bool:
+            return frame_message_id(frame) in replayed_ids
+        
+        connection.release(frames, drop=is_replayed if replayed_ids else None)
+        return len(replay.frames)
+    
+    def deliver_local(self, room_id: int, message: dict):
+        """
+        Send a message to this node's sockets of a room only, for events
+        every node derives itself (e.g. presence changes)
+        """
+        self._send_to_local(room_id, Frame.from_message(message))
+    
+    async def send_personal_message(self, message: str, websocket: WebSocket):
+        """
+        Send message to specific websocket connection
+        
+        Goes through the socket's queue when it has one, so personal frames
+        keep their order relative to broadcasts.
+        """
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.enqueue(Frame.from_text(message))
+        else:
+            await websocket.send_text(message)
+    
+    def get_metrics(self) -> dict:
+        """
+        Connection, queue depth and dropped frame counters
         """
-        message_json = json.dumps(message)
+        metrics = queue_metrics(list(self.connections.values()), self.queue_stats)
+        metrics["rooms"] = len(self.active_connections)
+        metrics["subscribed_rooms"] = len(self.subscribed_rooms)
+        metrics["subscribed_channels"] = len(self.channel_refs)
+        metrics["skipped_publishes"] = self.skipped_publishes
+        return metrics
+    
+    async def close(self):
+        """
+        Stop the writer and listener tasks and release the pubsub connection
+        """
+        for connection in list(self.connections.values()):
+            await connection.close()
+        self.connections.clear()
+        self.active_connections.clear()
+        
+        # leave the cluster registry before dropping the subscriptions
+        for room_id in list(self.subscribed_rooms):
+            await self._unregister_interest(room_id)
+        
+        if self.listener_task is not None:
+            self.listener_task.cancel()
+            try:
+                await self.listener_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.listener_task = None
+        
+        if self.pubsub is not None:
+            try:
+                await self.pubsub.aclose()
+            except Exception as e:
+                print(f"Redis pubsub close error (non-critical): {e}")
+            self.pubsub = None
+        self.subscribed_rooms.clear()
+        self.channel_refs.clear()
+        self.remote_interest.clear()
+        self._interest_loads.clear()
+        self.cluster_subscribed = False
+        self._pubsub_lock = asyncio.Lock()
+    
+    async def _publish(
+        self,
+        room_id: int,
+        frame: Frame,
+        coalesce_key: Optional[str] = None
+    ) -> bool:
+        """
+        Publish an encoded message for the other nodes, returns False on error
+        """
+        try:
+            await self.redis.publish(
+                self.room_channel(room_id),
+                pack_envelope(self.node_id, room_id, frame.data, coalesce_key)
+            )
+            return True
+        except Exception as e:
+            print(f"Redis publish error (non-critical): {e}")
+            return False
+    
+    def _send_to_local(
+        self,
+        room_id: int,
+        frame: Frame,
+        coalesce_key: Optional[str] = None
+    ):
+        """
+        Queue an encoded frame on every websocket of a room on this node
+        
+        Time Complexity: O(n) enqueues where n is the number of local sockets
+        """
+        for websocket in self.active_connections.get(room_id, ()):
+            connection = self.connections.get(websocket)
+            # a socket being disconnected has already lost its connection
+            if connection is not None:
+                connection.enqueue(frame, coalesce_key)
+    
+    async def _on_connection_failure(self, connection: ClientConnection):
+        """
+        Drop a connection whose writer failed or that was cut off as too slow
+        """
+        await self.disconnect_all(connection.websocket)
+    
+    async def _subscribe(self, room_id: int):
+        """
+        Add a room channel to the shared pubsub subscription
+        """
+        if self.delivery_mode == DeliveryMode.local:
+            return
+        
+        async with self._pubsub_lock:
+            # the room may have been emptied again while waiting for the lock
+            if room_id not in self.active_connections or room_id in self.subscribed_rooms:
+                return
+            try:
+                if self.pubsub is None:
+                    self.pubsub = self.redis.pubsub()
+                await self._subscribe_cluster()
+                channel = self.room_channel(room_id)
+                if channel not in self.channel_refs:
+                    await self.pubsub.subscribe(channel)
+                self.channel_refs[channel] = self.channel_refs.get(channel, 0) + 1
+                self.subscribed_rooms.add(room_id)
+            except Exception as e:
+                print(f"Redis subscribe error (non-critical): {e}")
+                return
+        
+        await self._register_interest(room_id)
         
-        # direct broadcast to all websockets in this room (single-server)
-        if room_id in self.active_connections:
-            disconnected = set()
-            for websocket in self.active_connections[room_id]:
+        # start redis listener if not already running
+        if self.listener_task is None or self.listener_task.done():
+            self.listener_task = asyncio.create_task(self._redis_listener())
+    
+    async def _unsubscribe(self, room_id: int):
+        """
+        Remove a room channel from the shared pubsub subscription
+        """
+        async with self._pubsub_lock:
+            # a socket may have rejoined the room while waiting for the lock
+            if room_id in self.active_connections or room_id not in self.subscribed_rooms:
+                return
+            self.subscribed_rooms.discard(room_id)
+            # the other nodes' messages stop arriving, the tail would go stale
+            self.recent.invalidate(room_id)
+            channel = self.room_channel(room_id)
+            self.channel_refs[channel] -= 1
+            if self.channel_refs[channel] == 0:
+                # the last subscribed room of the channel
+                del self.channel_refs[channel]
                 try:
-                    await websocket.send_text(message_json)
+                    await self.pubsub.unsubscribe(channel)
                 except Exception as e:
-                    print(f"Error sending to websocket: {e}")
-                    disconnected.add(websocket)
-            
-            # clean up disconnected websockets
-            for ws in disconnected:
-                await self.disconnect(ws, room_id)
+                    print(f"Redis unsubscribe error (non-critical): {e}")
+        
+        await self._unregister_interest(room_id)
+    
+    async def _resubscribe(self):
+        """
+        Replace a broken pubsub connection and restore the room subscriptions
+        """
+        async with self._pubsub_lock:
+            if self.pubsub is not None:
+                try:
+                    await self.pubsub.aclose()
+                except Exception:
+                    pass
+            self.pubsub = self.redis.pubsub()
+            rooms = [room_id for room_id in self.active_connections.keys()]
+            self.subscribed_rooms = set()
+            self.channel_refs = {}
+            # interest changes may have been missed, reload it on demand
+            self.remote_interest.clear()
+            self.cluster_subscribed = False
+            await self._subscribe_cluster()
+            if rooms:
+                channel_refs = Counter(self.room_channel(room_id) for room_id in rooms)
+                await self.pubsub.subscribe(*channel_refs)
+                self.channel_refs = dict(channel_refs)
+                self.subscribed_rooms.update(rooms)
         
-        # also publish to redis for multi-server support (optional)
+        # redis may have restarted and lost the registry
+        for room_id in rooms:
+            await self._register_interest(room_id)
+    
+    async def _subscribe_cluster(self):
+        """
+        Subscribe to the cluster channel, called with the pubsub lock held
+        """
+        if self.delivery_mode != DeliveryMode.cluster or self.cluster_subscribed:
+            return
+        if self.pubsub is None:
+            self.pubsub = self.redis.pubsub()
+        await self.pubsub.subscribe(CLUSTER_CHANNEL)
+        self.cluster_subscribed = True
+    
+    async def _announce(self, op: str, room_id: int):
+        await self.redis.publish(
+            CLUSTER_CHANNEL,
+            json.dumps({"op": op, "node": self.node_id, "room": room_id})
+        )
+    
+    async def _register_interest(self, room_id: int):
+        """
+        Add this node to the registry of a room and tell the other nodes
+        """
+        if self.delivery_mode != DeliveryMode.cluster:
+            return
         try:
-            channel = f"chat_room_{room_id}"
-            self.redis.publish(channel, message_json)
+            await self.redis.sadd(self.room_nodes_key(room_id), self.node_id)
+            await self._announce("join", room_id)
         except Exception as e:
-            print(f"Redis publish error (non-critical): {e}")
+            print(f"Redis interest registration error (non-critical): {e}")
     
-    async def send_personal_message(self, message: str, websocket: WebSocket):
+    async def _unregister_interest(self, room_id: int):
         """
-        Send message to specific websocket connection
+        Remove this node from the registry of a room and tell the other nodes
+        """
+        if self.delivery_mode != DeliveryMode.cluster:
+            return
+        try:
+            await self.redis.srem(self.room_nodes_key(room_id), self.node_id)
+            await self._announce("leave", room_id)
+        except Exception as e:
+            print(f"Redis interest registration error (non-critical): {e}")
+    
+    async def _has_remote_interest(self, room_id: int) -> bool:
+        """
+        Whether another node holds sockets in a room
+        
+        Loaded from the registry the first time this node publishes to the
+        room, then kept current from the cluster channel. Errs on the side of
+        publishing: a node that may be interested is kept.
+        
+        Time Complexity: O(1), one SMEMBERS on the first publish to a room
+        """
+        nodes = self.remote_interest.get(room_id)
+        if nodes is not None:
+            return bool(nodes)
+        
+        # concurrent broadcasts to the room share one load
+        load = self._interest_loads.get(room_id)
+        if load is None:
+            load = asyncio.ensure_future(self._load_interest(room_id))
+            self._interest_loads[room_id] = load
+        try:
+            return await asyncio.shield(load)
+        finally:
+            if load.done():
+                self._interest_loads.pop(room_id, None)
+    
+    async def _load_interest(self, room_id: int) -> bool:
+        """
+        Read the other nodes of a room from the registry into the mirror
+        """
+        self._pending_joins[room_id] = set()
+        try:
+            async with self._pubsub_lock:
+                await self._subscribe_cluster()
+            # the cluster channel is delivered by the listener
+            if self.listener_task is None or self.listener_task.done():
+                self.listener_task = asyncio.create_task(self._redis_listener())
+            members = await self.redis.smembers(self.room_nodes_key(room_id))
+        except Exception as e:
+            print(f"Redis interest lookup error (non-critical): {e}")
+            return True
+        finally:
+            joined = self._pending_joins.pop(room_id)
+        
+        nodes = {
+            node_id.decode("utf-8") if isinstance(node_id, bytes) else node_id
+            for node_id in members
+        }
+        # a join announced during the read may not be in its result yet
+        nodes |= joined
+        nodes.discard(self.node_id)
+        self.remote_interest[room_id] = nodes
+        return bool(nodes)
+    
+    def _apply_interest_event(self, data: Union[str, bytes]):
+        """
+        Update the remote interest mirror from a cluster channel event
+        """
+        try:
+            event = json.loads(data)
+            node_id, room_id = event["node"], int(event["room"])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Dropping malformed cluster event: {e}")
+            return
+        
+        if node_id == self.node_id:
+            return
+        joined = event.get("op") == "join"
+        nodes = self.remote_interest.get(room_id)
+        if nodes is None:
+            # a leave during a load is ignored, publishing once too many is harmless
+            if joined and room_id in self._pending_joins:
+                self._pending_joins[room_id].add(node_id)
+            return
+        if joined:
+            nodes.add(node_id)
+        else:
+            nodes.discard(node_id)
+    
+    def _record_recent(self, room_id: int, message: dict):
+        """
+        Add a chat message to the recent tail of its room, if that is cached
         """
-        await websocket.send_text(message)
+        for data in chat_messages(message):
+            self.recent.record(room_id, data)
+    
+    def _record_remote(self, room_id: int, message_json: str):
+        """
+        Add a chat message published by another node to the recent tail
+        
+        Only parsed for rooms whose tail is cached here.
+        """
+        try:
+            message = json.loads(message_json)
+        except ValueError:
+            return
+        self._record_recent(room_id, message)
     
     async def _redis_listener(self):
         """
         Listen to Redis pub/sub channels and broadcast to websockets
+        
+        Blocks on the subscription until a message arrives, so there is no
+        polling interval; the only sleep is the backoff after a Redis error.
         """
-        try:
-            self.pubsub = self.redis.pubsub()
+        backoff = 0.5
+        while True:
+            try:
+                message = await self.pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=None
+                )
+                backoff = 0.5
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis listener error: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                try:
+                    await self._resubscribe()
+                except Exception as e:
+                    print(f"Redis resubscribe error: {e}")
+                    continue
+                if not self.subscribed_rooms and not self.cluster_subscribed:
+                    # nothing left to listen to, _subscribe restarts the listener
+                    break
+                continue
             
-            while True:
-                # subscribe to all active room channels
-                channels = [f"chat_room_{room_id}" for room_id in self.active_connections.keys()]
-                if channels:
-                    self.pubsub.subscribe(*channels)
-                
-                # listen for messages
-                message = self.pubsub.get_message(timeout=1.0)
-                if message and message['type'] == 'message':
-                    channel = message['channel']
-                    data = message['data']
-                    
-                    # extract room_id from channel name
-                    room_id = int(channel.split('_')[-1])
-                    
-                    # broadcast to all websockets in this room
-                    if room_id in self.active_connections:
-                        disconnected = set()
-                        for websocket in self.active_connections[room_id]:
-                            try:
-                                await websocket.send_text(data)
-                            except Exception:
-                                disconnected.add(websocket)
-                        
-                        # clean up disconnected websockets
-                        for ws in disconnected:
-                            await self.disconnect(ws, room_id)
+            if not message or message['type'] != 'message':
+                continue
+            
+            channel = message['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode("utf-8")
+            if channel == CLUSTER_CHANNEL:
+                self._apply_interest_event(message['data'])
+                continue
+            
+            try:
+                node_id, room_id, coalesce_key, message_json = unpack_envelope(message['data'])
+            except ValueError as e:
+                print(f"Dropping malformed pub/sub message: {e}")
+                continue
+            
+            own = node_id == self.node_id
+            # in hybrid and cluster mode our own publications were already sent locally
+            if own and self.delivery_mode in (DeliveryMode.hybrid, DeliveryMode.cluster):
+                continue
+            try:
+                if not own and room_id in self.recent:
+                    self._record_remote(room_id, message_json)
                 
-                await asyncio.sleep(0.1)
-        except Exception as e:
-            print(f"Redis listener error: {e}")
-        finally:
-            if self.pubsub:
-                self.pubsub.close()
+                # broadcast to all websockets in this room, none for other
+                # rooms of a shard channel
+                self._send_to_local(room_id, Frame.from_text(message_json), coalesce_key)
+            except Exception as e:
+                # one bad delivery must not stop the listener for every room
+                print(f"Redis listener delivery error: {e}")
+            # buffered bursts are read without suspending, let the writers drain
+            await asyncio.sleep(0)
 
 
 # global connection manager instance
 manager = ConnectionManager()
 
 
-async def save_message_to_db(
-    db: Session,
-    room_id: int,
-    sender_id: int,
-    content: str,
-    message_type: str = "text"
-) -> Message:
-    """
-    Save message to database
-    """
-    message = Message(
-        room_id=room_id,
-        sender_id=sender_id,
-        content=content,
-        message_type=message_type,
-        timestamp=datetime.utcnow()
-    )
-    db.add(message)
-    db.commit()
-    db.refresh(message)
-    return message
-
-
-def verify_room_membership(db: Session, user_id: int, room_id: int) -> bool:
+async def verify_room_membership(db: AsyncSession, user_id: int, room_id: int) -> bool:
     """
     Verify if user is a member of the chat room
+
+    Time Complexity: O(1) from the membership cache, one indexed EXISTS query on a miss
     """
-    room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
-    if not room:
-        return False
-    
-    # check if user is a member
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        return False
-    
-    return user in room.members
+    return await membership_cache.is_member_async(db, room_id, user_id)
@@ -0,0 +1,166 @@
+"""
+Wire formats of the chat WebSockets, negotiated per socket via subprotocol
+
+chat.json.v1 (or no subprotocol): the JSON text frames of the API docs.
+chat.msgpack.v1: MessagePack binary frames with short field tags and
+integer timestamps (milliseconds since the epoch, UTC), e.g. a chat message
+
+    {"type": "message", "data": {"id": 1, "sender_username": "john_doe",
+     "timestamp": "2024-01-01T12:00:00", ...}}
+
+goes out as the MessagePack encoding of
+
+    {"t": "message", "d": {"i": 1, "u": "john_doe", "ts": 1704110400000, ...}}
+
+Clients of the compact protocol send their frames in the same form. Only
+keys are tagged, values are left alone; keys without a tag pass through.
+Compact frames are derived once per broadcast frame (see Frame.compact), so
+the encoding cost does not grow with the number of compact clients.
+
+msgpack is optional, the compact protocol is only offered when it is
+installed.
+"""
+from datetime import datetime, timezone
+from typing import List, Optional, Union
+from app.core.config import settings
+import json
+
+try:
+    import msgpack
+except ImportError:  # optional, compact clients fall back to JSON
+    msgpack = None
+
+JSON_SUBPROTOCOL = "chat.json.v1"
+MSGPACK_SUBPROTOCOL = "chat.msgpack.v1"
+
+# field name -> tag
+FIELD_TAGS = {
+    "type": "t",
+    "room_id": "r",
+    "rooms": "rs",
+    "data": "d",
+    "id": "i",
+    "sender_id": "s",
+    "sender_username": "u",
+    "content": "c",
+    "timestamp": "ts",
+    "is_edited": "e",
+    "message_type": "mt",
+    "user_id": "ui",
+    "username": "un",
+    "users": "us",
+    "node": "n",
+    "changes": "ch",
+    "is_online": "o",
+    "is_typing": "it",
+    "message": "m",
+    "messages": "ms",
+    "last_seen_id": "ls",
+    "client_id": "k",
+    "acks": "as",
+    "duplicate": "du",
+}
+TAG_FIELDS = {tag: field for field, tag in FIELD_TAGS.items()}
+
+# fields sent as integer milliseconds instead of ISO strings
+TIMESTAMP_FIELDS = {"timestamp"}
+
+
+def supported_subprotocols() -> List[str]:
+    """
+    Subprotocols this server speaks, most compact first
+    """
+    if msgpack is not None and settings.WS_COMPACT_PROTOCOL:
+        return [MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL]
+    return [JSON_SUBPROTOCOL]
+
+
+def negotiate_subprotocol(websocket) -> Optional[str]:
+    """
+    The first subprotocol offered by the client that the server speaks
+
+    None when the client offered none we speak, it then gets plain JSON.
+    """
+    scope = getattr(websocket, "scope", None) or {}
+    supported = supported_subprotocols()
+    for offered in scope.get("subprotocols", ()):
+        if offered in supported:
+            return offered
+    return None
+
+
+def is_compact(subprotocol: Optional[str]) -> bool:
+    return subprotocol == MSGPACK_SUBPROTOCOL
+
+
+def timestamp_ms(value: str) -> int:
+    """
+    ISO timestamp to milliseconds since the epoch, naive times are UTC
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def to_compact(value):
+    """
+    Tag the keys of a decoded JSON message, recursively
+
+    Time Complexity: O(n) for n values in the message
+    """
+    if isinstance(value, dict):
+        compact = {}
+        for key, item in value.items():
+            if key in TIMESTAMP_FIELDS and isinstance(item, str):
+                try:
+                    item = timestamp_ms(item)
+                except ValueError:
+                    pass
+            else:
+                item = to_compact(item)
+            compact[FIELD_TAGS.get(key, key)] = item
+        return compact
+    if isinstance(value, list):
+        return [to_compact(item) for item in value]
+    return value
+
+
+def from_compact(value):
+    """
+    Expand the tags of a compact message back to field names, recursively
+
+    Timestamps stay integers, clients never send them.
+    """
+    if isinstance(value, dict):
+        return {TAG_FIELDS.get(key, key): from_compact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_compact(item) for item in value]
+    return value
+
+
+def encode_compact(text: str) -> bytes:
+    """
+    Re-encode a JSON frame in the compact wire format
+    """
+    return msgpack.packb(to_compact(json.loads(text)), use_bin_type=True)
+
+
+def decode_message(data: Union[str, bytes]) -> dict:
+    """
+    Decode a client frame, JSON text or a compact binary frame
+
+    Raises ValueError for anything that is not a well-formed message.
+    """
+    if isinstance(data, str):
+        message = json.loads(data)
+    elif msgpack is None:
+        raise ValueError("Binary frames are not supported")
+    else:
+        try:
+            message = from_compact(msgpack.unpackb(data, raw=False))
+        except Exception as e:
+            raise ValueError(f"Invalid compact frame: {e}") from e
+    if not isinstance(message, dict):
+        raise ValueError("Message must be an object")
+    return message
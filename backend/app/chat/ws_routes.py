@@ -2,32 +2,265 @@
 WebSocket routes for real-time chat
 """
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status
-from sqlalchemy.orm import Session
-from app.database.database import get_db
-from app.chat.websocket import manager, save_message_to_db, verify_room_membership
-from app.core.security import verify_token
-from app.models.user import User
+from app.database.database import AsyncSessionLocal
+from app.chat.websocket import manager, verify_room_membership
+from app.chat.membership import query_user_room_ids
+from app.chat.persistence import message_writer, build_message_row
+from app.chat.presence import presence
+from app.chat.typing_indicators import typing_indicators
+from app.chat.wire import decode_message, is_compact, negotiate_subprotocol
+from app.chat.idempotency import MAX_CLIENT_ID_LENGTH, client_message_ids
+from app.core.config import settings
+from app.core.rate_limit import Gcra, parse_rate
+from app.auth.dependencies import user_id_from_token_async
+from app.auth.principal import Principal, principal_cache
+from typing import Dict, List, Optional, Union
 import json
 from datetime import datetime
 
 
 router = APIRouter()
 
+# sockets live for hours, so a session is only opened around each database
+# operation and no connection is held while a socket is idle
+session_factory = AsyncSessionLocal
 
-def get_current_user_ws(token: str, db: Session) -> User:
+
+async def get_current_user_ws(token: str) -> Optional[Principal]:
     """
     Get current user from JWT token for WebSocket connections
-    """
-    payload = verify_token(token)
-    if payload is None:
-        return None
     
-    user_id: int = payload.get("sub")
+    Served from the principal cache, the database is only hit on a miss
+    """
+    user_id = await user_id_from_token_async(token)
     if user_id is None:
         return None
     
-    user = db.query(User).filter(User.id == user_id).first()
-    return user
+    # an async session only checks out a connection when it runs a query
+    async with session_factory() as db:
+        return await principal_cache.load_async(db, user_id)
+
+
+async def check_room_membership(user_id: int, room_id: int) -> bool:
+    """
+    Room membership for a socket, from the membership cache or a short-lived session
+    """
+    async with session_factory() as db:
+        return await verify_room_membership(db, user_id, room_id)
+
+
+def message_payload(user: Principal, row: dict, client_id: Optional[str] = None) -> dict:
+    """
+    Broadcast form of a message row
+    """
+    data = {
+        "id": row["id"],
+        "room_id": row["room_id"],
+        "sender_id": user.id,
+        "sender_username": user.username,
+        "content": row["content"],
+        "timestamp": row["timestamp"].isoformat(),
+        "is_edited": False,
+        "message_type": "text"
+    }
+    if client_id is not None:
+        data["client_id"] = client_id
+    return data
+
+
+async def post_chat_messages(
+    user: Principal,
+    room_id: int,
+    messages: List[dict],
+    websocket: Optional[WebSocket] = None
+) -> List[dict]:
+    """
+    Persist (write-behind) and broadcast chat messages sent over a socket
+    
+    One message goes out as a message frame, several as a single batch frame
+    and are written in one transaction. A client_id the sender already used
+    is not sent again, its ack carries the id the message got the first time.
+    If the writer drops the rows later, their client_ids are released and
+    the sender's socket gets error acks for them (see unsaved_messages).
+    
+    Returns the acks, one per message with a client_id.
+    
+    Time Complexity: O(k) for k messages, plus at most two Redis round-trips
+    """
+    rows, client_ids, acks = [], [], []
+    fresh: Dict[str, int] = {}
+    for item in messages:
+        content = item.get("content")
+        client_id = item.get("client_id")
+        if client_id is not None and (
+            not isinstance(client_id, str) or not 0 < len(client_id) <= MAX_CLIENT_ID_LENGTH
+        ):
+            raise ValueError(f"client_id must be a string of 1-{MAX_CLIENT_ID_LENGTH} characters")
+        if not isinstance(content, str) or not content:
+            if client_id is not None:
+                acks.append({"client_id": client_id, "error": "Empty message"})
+            continue
+        if client_id in fresh:
+            # sent twice in the same frame
+            acks.append({"client_id": client_id, "id": fresh[client_id], "duplicate": True})
+            continue
+        
+        # id and timestamp are assigned up front, the rows are
+        # written behind by the message writer
+        row = build_message_row(room_id=room_id, sender_id=user.id, content=content)
+        if client_id is not None:
+            fresh[client_id] = row["id"]
+        rows.append(row)
+        client_ids.append(client_id)
+    
+    seen = await client_message_ids.claim(user.id, fresh)
+    datas = []
+    persisted = []
+    for row, client_id in zip(rows, client_ids):
+        if client_id in seen:
+            acks.append({"client_id": client_id, "id": seen[client_id], "duplicate": True})
+            continue
+        if client_id is not None:
+            acks.append({"client_id": client_id, "id": row["id"]})
+        persisted.append(row)
+        datas.append(message_payload(user, row, client_id))
+    
+    if not persisted:
+        return acks
+    try:
+        await message_writer.submit_many(
+            persisted, on_dropped=unsaved_messages(user, room_id, rows, client_ids, websocket)
+        )
+    except Exception:
+        # not accepted, a resend of these client_ids must not be a duplicate
+        await client_message_ids.release(user.id, [client_id for client_id in fresh if client_id not in seen])
+        raise
+    
+    # broadcast to all room members
+    if len(datas) == 1:
+        await manager.broadcast_to_room(room_id, {"type": "message", "data": datas[0]})
+    else:
+        await manager.broadcast_to_room(room_id, {
+            "type": "batch",
+            "room_id": room_id,
+            "messages": datas
+        })
+    return acks
+
+
+def unsaved_messages(
+    user: Principal,
+    room_id: int,
+    rows: List[dict],
+    client_ids: List[Optional[str]],
+    websocket: Optional[WebSocket]
+):
+    """
+    Callback for rows the message writer dropped after acking them
+    
+    Their client_ids are released, so a resend is stored instead of being
+    acked as a duplicate, and the sender is told which messages were lost.
+    """
+    client_id_of = {
+        row["id"]: client_id
+        for row, client_id in zip(rows, client_ids)
+        if client_id is not None
+    }
+    
+    async def on_dropped(group: List[dict]):
+        lost = [client_id_of[row["id"]] for row in group if row["id"] in client_id_of]
+        await client_message_ids.release(user.id, lost)
+        if websocket is None:
+            return
+        acks = []
+        for row in group:
+            ack = {"id": row["id"], "error": "Message could not be saved"}
+            if row["id"] in client_id_of:
+                ack["client_id"] = client_id_of[row["id"]]
+            acks.append(ack)
+        try:
+            await send_acks(websocket, room_id, acks)
+        except Exception:
+            # the socket is gone, the client resends what it never saw acked
+            pass
+    
+    return on_dropped
+
+
+def batch_messages(frame: dict) -> List[dict]:
+    """
+    The messages of a message or batch frame from a client
+    """
+    if frame.get("type") != "batch":
+        return [frame]
+    messages = frame.get("messages")
+    if not isinstance(messages, list) or not 0 < len(messages) <= settings.WS_MAX_BATCH_MESSAGES:
+        raise ValueError(f"A batch must hold 1-{settings.WS_MAX_BATCH_MESSAGES} messages")
+    if not all(isinstance(item, dict) for item in messages):
+        raise ValueError("Batch messages must be objects")
+    return messages
+
+
+def frame_room_id(frame: dict) -> Optional[int]:
+    """
+    The room_id of a notifications frame, None when it has none
+    
+    Integers and integer strings are accepted, anything else is a ValueError.
+    """
+    room_id = frame.get("room_id")
+    if room_id is None:
+        return None
+    if isinstance(room_id, bool) or not isinstance(room_id, (int, str)):
+        raise ValueError("room_id must be an integer")
+    try:
+        room_id = int(room_id)
+    except ValueError:
+        raise ValueError("room_id must be an integer") from None
+    if room_id <= 0:
+        raise ValueError("room_id must be positive")
+    return room_id
+
+
+async def send_acks(websocket: WebSocket, room_id: int, acks: List[dict]):
+    """
+    Tell the sender which server ids its client_ids got
+    """
+    if acks:
+        await manager.send_personal_message(
+            json.dumps({"type": "ack", "room_id": room_id, "acks": acks}),
+            websocket
+        )
+
+
+WS_MESSAGE_RATE = parse_rate("ws_messages", settings.WS_MESSAGE_RATE_LIMIT)
+
+
+async def within_message_rate(websocket: WebSocket, rate: Gcra, room_id: int, count: int) -> bool:
+    """
+    Count messages against the socket's rate, telling the client when it is over
+    """
+    wait = rate.hit(count)
+    if wait == 0:
+        return True
+    await manager.send_personal_message(
+        json.dumps({
+            "type": "error",
+            "room_id": room_id,
+            "message": "Rate limit exceeded, messages dropped",
+            "retry_after": round(wait, 3)
+        }),
+        websocket
+    )
+    return False
+
+
+async def receive_frame(websocket: WebSocket, subprotocol: Optional[str]) -> Union[str, bytes]:
+    """
+    Receive the next client frame, binary for the compact wire format
+    """
+    if is_compact(subprotocol):
+        return await websocket.receive_bytes()
+    return await websocket.receive_text()
 
 
 @router.websocket("/ws/chat/{room_id}")
@@ -35,17 +268,35 @@ async def websocket_chat_endpoint(
     websocket: WebSocket,
     room_id: int,
     token: str = Query(...),
+    last_seen_id: Optional[int] = Query(None),
 ):
     """
     WebSocket endpoint for real-time chat in a specific room
     
     Query parameters:
     - token: JWT authentication token
+    - last_seen_id: id of the last message the client received, when
+      reconnecting. The messages missed since are replayed from the room's
+      message stream before live delivery starts, followed by
+    
+      {"type": "replay_complete", "room_id": 1, "replayed": 3, "complete": true}
+    
+      complete is false when the stream does not reach back far enough (or
+      is disabled); the client then fetches the gap over REST.
+    
+    Subprotocols (Sec-WebSocket-Protocol): chat.json.v1 (the default) or
+    chat.msgpack.v1, binary MessagePack frames with short field tags and
+    integer timestamps, see app.chat.wire.
     
     Message format (client -> server):
     {
         "type": "message",
-        "content": "message text"
+        "content": "message text",
+        "client_id": "c-17"                  (optional idempotency key)
+    }
+    {
+        "type": "batch",
+        "messages": [{"content": "first", "client_id": "c-18"}, ...]
     }
     
     Message format (server -> client):
@@ -58,93 +309,85 @@ async def websocket_chat_endpoint(
         "content": "message text",
         "timestamp": "2024-01-01T12:00:00"
     }
-    """
-    # get database session
-    db = next(get_db())
+    {"type": "batch", "room_id": 1, "messages": [<message>, ...]}
+    
+    and to the sender, for the messages that carried a client_id:
+    {"type": "ack", "room_id": 1, "acks": [{"client_id": "c-18", "id": 124}]}
     
+    A client_id sent again (e.g. resent after a reconnect) is acked with the
+    id it got the first time and "duplicate": true, without a second copy.
+    A message that could not be stored after it was acked is acked again
+    with an error, its client_id can then be resent:
+    {"type": "ack", "room_id": 1, "acks": [{"client_id": "c-18", "id": 124, "error": "..."}]}
+
+    Messages beyond WS_MESSAGE_RATE_LIMIT are dropped with
+    {"type": "error", "room_id": 1, "message": "...", "retry_after": 0.5}
+    """
+    online_user_id = None
     try:
         # authenticate user
-        user = get_current_user_ws(token, db)
+        user = await get_current_user_ws(token)
         if not user:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
         
         # verify room membership
-        if not verify_room_membership(db, user.id, room_id):
+        if not await check_room_membership(user.id, room_id):
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
         
-        # connect to room
-        await manager.connect(websocket, room_id, user.id)
+        # connect to room, live messages are held back while replaying
+        subprotocol = negotiate_subprotocol(websocket)
+        await manager.connect(
+            websocket, room_id, user.id,
+            hold=last_seen_id is not None, subprotocol=subprotocol
+        )
+        presence.connect(user.id)
+        online_user_id = user.id
         
         # send connection confirmation
-        await manager.send_personal_message(
-            json.dumps({
-                "type": "connected",
-                "room_id": room_id,
-                "user_id": user.id
-            }),
-            websocket
-        )
+        connected = json.dumps({
+            "type": "connected",
+            "room_id": room_id,
+            "user_id": user.id
+        })
+        if last_seen_id is None:
+            await manager.send_personal_message(connected, websocket)
+        else:
+            await manager.replay(websocket, room_id, last_seen_id, greeting=connected)
         
         # listen for messages
+        message_rate = Gcra(WS_MESSAGE_RATE)
         while True:
             # receive message from client
-            data = await websocket.receive_text()
+            data = await receive_frame(websocket, subprotocol)
             
             try:
-                message_data = json.loads(data)
+                message_data = decode_message(data)
                 message_type = message_data.get("type", "message")
-                content = message_data.get("content", "")
                 
-                if message_type == "message" and content:
-                    # save message to database
-                    db_message = await save_message_to_db(
-                        db=db,
-                        room_id=room_id,
-                        sender_id=user.id,
-                        content=content
-                    )
-                    
-                    print(f"[WebSocket] Message saved to DB: id={db_message.id}, room={room_id}, sender={user.username}")
-                    
-                    # prepare broadcast message
-                    broadcast_data = {
-                        "type": "message",
-                        "data": {
-                            "id": db_message.id,
-                            "room_id": room_id,
-                            "sender_id": user.id,
-                            "sender_username": user.username,
-                            "content": content,
-                            "timestamp": db_message.timestamp.isoformat(),
-                            "is_edited": False,
-                            "message_type": "text"
-                        }
-                    }
-                    
-                    print(f"[WebSocket] Broadcasting message to room {room_id}: {broadcast_data}")
-                    
-                    # broadcast to all room members
-                    await manager.broadcast_to_room(room_id, broadcast_data)
-                    
-                    print(f"[WebSocket] Broadcast complete")
+                if message_type in ("message", "batch"):
+                    messages = batch_messages(message_data)
+                    if await within_message_rate(websocket, message_rate, room_id, len(messages)):
+                        acks = await post_chat_messages(user, room_id, messages, websocket)
+                        await send_acks(websocket, room_id, acks)
                 
-            except json.JSONDecodeError:
+            except ValueError as e:
                 # send error message
                 await manager.send_personal_message(
                     json.dumps({
                         "type": "error",
-                        "message": "Invalid message format"
+                        "message": f"Invalid message format: {e}"
                     }),
                     websocket
                 )
             except Exception as e:
-                # send error message
+                # details stay in the server log
+                print(f"WebSocket message error: {e}")
                 await manager.send_personal_message(
                     json.dumps({
                         "type": "error",
-                        "message": str(e)
+                        "message": "Message could not be processed"
                     }),
                     websocket
                 )
@@ -155,7 +398,8 @@ async def websocket_chat_endpoint(
         print(f"WebSocket error: {e}")
         await manager.disconnect(websocket, room_id)
     finally:
-        db.close()
+        if online_user_id is not None:
+            presence.disconnect(online_user_id)
 
 
 @router.websocket("/ws/notifications")
@@ -164,84 +408,132 @@ async def websocket_notifications_endpoint(
     token: str = Query(...),
 ):
     """
-    WebSocket endpoint for user notifications (typing indicators, presence updates)
+    Multiplexed WebSocket for all of a user's rooms
+    
+    The socket is added to every room the user is a member of, so one socket
+    (with one writer task) receives the messages, typing snapshots and
+    presence changes of all rooms; every frame carries its room_id.
     
     Query parameters:
     - token: JWT authentication token
     
+    Subprotocols as for the chat endpoint.
+    
     Message format (client -> server):
-    {
-        "type": "typing",
-        "room_id": 1,
-        "is_typing": true
-    }
+    {"type": "typing", "room_id": 1, "is_typing": true}
+    {"type": "message", "room_id": 1, "content": "message text"}
+    {"type": "batch", "room_id": 1, "messages": [...]}  (as for the chat endpoint)
+    {"type": "subscribe", "room_id": 2}      (e.g. a room joined since connecting)
+    {"type": "unsubscribe", "room_id": 2}
     
     Message format (server -> client):
+    {"type": "connected", "user_id": 5, "rooms": [1, 2]}
+    {"type": "subscribed", "room_id": 2} / {"type": "unsubscribed", "room_id": 2}
+    {"type": "ack", "room_id": 1, "acks": [...]}
+    
+    plus the room frames of the chat endpoint, and one typing snapshot per
+    room and tick while the set of typing users changes (see
+    app.chat.typing_indicators):
     {
         "type": "typing",
         "room_id": 1,
-        "user_id": 5,
-        "username": "john_doe",
-        "is_typing": true
+        "node": "host-123-ab12cd34",
+        "users": [{"user_id": 5, "username": "john_doe"}]
     }
     """
-    # get database session
-    db = next(get_db())
-    
+    online_user_id = None
     try:
         # authenticate user
-        user = get_current_user_ws(token, db)
+        user = await get_current_user_ws(token)
         if not user:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
         
-        await websocket.accept()
+        async with session_factory() as db:
+            room_ids = await db.run_sync(query_user_room_ids, user.id)
+        
+        subprotocol = negotiate_subprotocol(websocket)
+        await manager.connect_rooms(websocket, room_ids, user.id, subprotocol=subprotocol)
+        presence.connect(user.id)
+        online_user_id = user.id
+        rooms = manager.connections[websocket].rooms
         
         # send connection confirmation
-        await websocket.send_text(
+        await manager.send_personal_message(
             json.dumps({
                 "type": "connected",
-                "user_id": user.id
-            })
+                "user_id": user.id,
+                "rooms": sorted(rooms)
+            }),
+            websocket
         )
         
         # listen for notification events
+        message_rate = Gcra(WS_MESSAGE_RATE)
         while True:
-            data = await websocket.receive_text()
+            data = await receive_frame(websocket, subprotocol)
             
             try:
-                notification_data = json.loads(data)
+                notification_data = decode_message(data)
                 notification_type = notification_data.get("type")
+                room_id = frame_room_id(notification_data)
+                
+                if notification_type == "unsubscribe":
+                    if room_id in rooms:
+                        await manager.leave_room(websocket, room_id)
+                        await manager.send_personal_message(
+                            json.dumps({"type": "unsubscribed", "room_id": room_id}),
+                            websocket
+                        )
+                    continue
+                
+                if not room_id:
+                    continue
+                # rooms joined after connecting are checked once, then routed
+                if room_id not in rooms:
+                    if not await check_room_membership(user.id, room_id):
+                        await manager.send_personal_message(
+                            json.dumps({
+                                "type": "error",
+                                "room_id": room_id,
+                                "message": "Not a member of this room"
+                            }),
+                            websocket
+                        )
+                        continue
+                    await manager.join_room(websocket, room_id)
+                    await manager.send_personal_message(
+                        json.dumps({"type": "subscribed", "room_id": room_id}),
+                        websocket
+                    )
                 
                 if notification_type == "typing":
-                    room_id = notification_data.get("room_id")
                     is_typing = notification_data.get("is_typing", False)
-                    
-                    # verify room membership
-                    if room_id and verify_room_membership(db, user.id, room_id):
-                        # broadcast typing indicator
-                        broadcast_data = {
-                            "type": "typing",
-                            "room_id": room_id,
-                            "user_id": user.id,
-                            "username": user.username,
-                            "is_typing": is_typing
-                        }
-                        await manager.broadcast_to_room(room_id, broadcast_data)
+                    # aggregated, sent with the room's next snapshot
+                    typing_indicators.update(room_id, user.id, user.username, bool(is_typing))
+                elif notification_type in ("message", "batch"):
+                    messages = batch_messages(notification_data)
+                    if await within_message_rate(websocket, message_rate, room_id, len(messages)):
+                        acks = await post_chat_messages(user, room_id, messages, websocket)
+                        await send_acks(websocket, room_id, acks)
             
-            except json.JSONDecodeError:
-                await websocket.send_text(
+            except ValueError as e:
+                await manager.send_personal_message(
                     json.dumps({
                         "type": "error",
-                        "message": "Invalid notification format"
-                    })
+                        "message": f"Invalid notification format: {e}"
+                    }),
+                    websocket
                 )
             except Exception as e:
-                await websocket.send_text(
+                # details stay in the server log
+                print(f"WebSocket notification error: {e}")
+                await manager.send_personal_message(
                     json.dumps({
                         "type": "error",
-                        "message": str(e)
-                    })
+                        "message": "Notification could not be processed"
+                    }),
+                    websocket
                 )
     
     except WebSocketDisconnect:
@@ -249,4 +541,7 @@ async def websocket_notifications_endpoint(
     except Exception as e:
         print(f"WebSocket notification error: {e}")
     finally:
-        db.close()
+        await manager.disconnect_all(websocket)
+        if online_user_id is not None:
+            typing_indicators.clear_user(online_user_id)
+            presence.disconnect(online_user_id)
@@ -10,15 +10,128 @@ class Settings(BaseSettings):
     
     # database
     DATABASE_URL: str = "sqlite:///./chatserver.db"
+    # connection pool per engine (ignored for sqlite)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
     
     # redis
     REDIS_URL: str = "redis://localhost:6379"
     
+    # websocket fan-out
+    # identity of this process in the cluster (generated when empty)
+    NODE_ID: str = ""
+    # local: this node's sockets only, redis: deliver via pub/sub only,
+    # hybrid: local sockets directly plus pub/sub for other nodes,
+    # cluster: hybrid, publishing only for rooms other nodes hold sockets in
+    WS_DELIVERY_MODE: str = "hybrid"
+    # per-connection outbound queue
+    WS_SEND_QUEUE_SIZE: int = 256
+    # drop_oldest | coalesce_typing | disconnect
+    WS_BACKPRESSURE_POLICY: str = "coalesce_typing"
+    # dropped frames before a slow consumer is disconnected (disconnect policy)
+    WS_SLOW_CONSUMER_THRESHOLD: int = 64
+    # 0: one pub/sub channel per room, n: rooms hash onto n shard channels
+    # (must be the same on every node)
+    WS_CHANNEL_SHARDS: int = 0
+    # offer the chat.msgpack.v1 subprotocol (needs msgpack installed)
+    WS_COMPACT_PROTOCOL: bool = True
+    # permessage-deflate, negotiated with clients that support it (run_server.py)
+    WS_PER_MESSAGE_DEFLATE: bool = True
+    
+    # durable per-room redis stream, replayed to sockets reconnecting with last_seen_id
+    MESSAGE_STREAM_ENABLED: bool = False
+    # approximate number of messages kept per room
+    MESSAGE_STREAM_MAXLEN: int = 1000
+    # streams of rooms without new messages expire after this long
+    MESSAGE_STREAM_TTL_SECONDS: int = 86400
+    
+    # presence: heartbeats of users with open sockets, in a redis sorted set
+    PRESENCE_TTL_SECONDS: int = 30
+    PRESENCE_HEARTBEAT_SECONDS: int = 10
+    # connects/disconnects arriving within this window share one tick
+    PRESENCE_BATCH_MS: int = 500
+    
+    # typing indicators: one "who is typing" snapshot per changed room per tick
+    TYPING_TICK_MS: int = 300
+    # a typing user not refreshed for this long stops typing
+    TYPING_TTL_MS: int = 5000
+    
+    # message ids and write-behind persistence
+    # 0-31, unique per process; -1 leases a free one from Redis
+    ID_WORKER_ID: int = -1
+    # lifetime of a leased worker id, renewed every third of it
+    ID_WORKER_LEASE_SECONDS: int = 60
+    # messages buffered before websocket senders are made to wait
+    MESSAGE_WRITER_BUFFER_SIZE: int = 10000
+    # rows per multi-row INSERT
+    MESSAGE_WRITER_BATCH_SIZE: int = 500
+    # max time a message waits in the buffer before a flush
+    MESSAGE_WRITER_FLUSH_INTERVAL_MS: int = 50
+    # longest wait between retries of a failed insert
+    MESSAGE_WRITER_MAX_BACKOFF_MS: int = 5000
+    # most messages a client may send in one batch frame
+    WS_MAX_BATCH_MESSAGES: int = 100
+    # messages per socket, each message of a batch counts (app.core.rate_limit)
+    WS_MESSAGE_RATE_LIMIT: str = "200/10seconds"
+    # how long a client_id keeps mapping to the server id of its message
+    MESSAGE_CLIENT_ID_TTL_SECONDS: int = 86400
+    
+    # room membership cache
+    MEMBERSHIP_CACHE_TTL_SECONDS: int = 300
+    MEMBERSHIP_CACHE_MAX_ENTRIES: int = 100000
+    # share cached answers between nodes through a redis hash per room
+    MEMBERSHIP_CACHE_REDIS: bool = False
+    
+    # messages embedded in the room detail response, the number of rooms
+    # whose tail is kept in memory and how long a tail is trusted
+    ROOM_RECENT_MESSAGES: int = 50
+    RECENT_MESSAGES_CACHE_ROOMS: int = 1000
+    RECENT_MESSAGES_TTL_SECONDS: int = 30
+    
+    # authenticated user (principal) cache
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+    PRINCIPAL_CACHE_MAX_ENTRIES: int = 10000
+    
+    # password hashing: bcrypt work factor, hashed in a process pool
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    # 0 hashes on the request thread
+    PASSWORD_HASH_WORKERS: int = 2
+    # hashes waiting for a worker before requests get 503 + Retry-After
+    PASSWORD_HASH_QUEUE_SIZE: int = 32
+    PASSWORD_HASH_RETRY_AFTER_SECONDS: int = 1
+    
+    # rate limits, "<limit>/<period>" (e.g. 5/minute, 20/15minutes): redis | memory
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "redis"
+    RATE_LIMIT_LOGIN_PER_IP: str = "30/minute"
+    # failed or not, attempts per account
+    RATE_LIMIT_LOGIN_PER_EMAIL: str = "10/15minutes"
+    RATE_LIMIT_REFRESH_PER_IP: str = "60/minute"
+    # per user, from the refresh token's sub
+    RATE_LIMIT_REFRESH_PER_USER: str = "10/minute"
+    RATE_LIMIT_PASSWORD_RESET_PER_IP: str = "5/minute"
+    RATE_LIMIT_PASSWORD_RESET_CONFIRM_PER_IP: str = "10/minute"
+    RATE_LIMIT_PASSWORD_RESET_PER_EMAIL: str = "3/hour"
+    
     # jwt
     SECRET_KEY: str = "your-secret-key-change-this-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    # jose | pyjwt (needs PyJWT installed)
+    JWT_BACKEND: str = "jose"
+    # verified token claims kept until the token expires, 0 disables the cache
+    JWT_CLAIMS_CACHE_SIZE: int = 10000
+    
+    # token revocation (logout, refresh token reuse): redis | memory (single node)
+    REVOCATION_BACKEND: str = "redis"
+    # bloom filter of revoked ids in front of the denylist
+    REVOCATION_BLOOM_CAPACITY: int = 100000
+    REVOCATION_BLOOM_ERROR_RATE: float = 0.001
+    # how often each node rebuilds its filter from redis
+    REVOCATION_SYNC_SECONDS: float = 5
     
     # cors
     ALLOWED_HOSTS: Union[str, List[str]] = "http://localhost:3000,http://localhost:8501"
@@ -35,6 +148,20 @@ class Settings(BaseSettings):
     SMTP_USER: str = ""
     SMTP_PASSWORD: str = ""
     SMTP_TLS: bool = True
+    SMTP_TIMEOUT_SECONDS: float = 10
+    
+    # outbound email queue (app.core.email_queue): worker threads with one
+    # persistent SMTP session each, 0 sends on the request thread
+    EMAIL_QUEUE_WORKERS: int = 1
+    EMAIL_QUEUE_SIZE: int = 1000
+    # messages a worker sends back to back per wake-up
+    EMAIL_BATCH_SIZE: int = 20
+    # transient failures retried after base * 2^n seconds, then dead-lettered
+    EMAIL_MAX_ATTEMPTS: int = 5
+    EMAIL_RETRY_BASE_SECONDS: float = 2
+    # an idle session is closed after this long
+    EMAIL_SMTP_IDLE_SECONDS: float = 30
+    EMAIL_DEAD_LETTER_MAX: int = 1000
     
     @field_validator("ALLOWED_HOSTS", mode="before")
     @classmethod
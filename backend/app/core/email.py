@@ -1,13 +1,16 @@
 """
 Email service for sending password reset and other emails
 Supports SMTP and SendGrid
+
+Messages are handed to the outbound queue (app.core.email_queue) and
+delivered in the background over persistent SMTP sessions.
 """
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional
 import logging
 from app.core.config import settings
+from app.core.email_queue import email_queue
 
 logger = logging.getLogger(__name__)
 
@@ -20,13 +23,6 @@ class EmailService:
         self.from_email = settings.EMAIL_FROM
         self.from_name = settings.EMAIL_FROM_NAME
         
-        # SMTP settings
-        self.smtp_host = settings.SMTP_HOST
-        self.smtp_port = settings.SMTP_PORT
-        self.smtp_user = settings.SMTP_USER
-        self.smtp_password = settings.SMTP_PASSWORD
-        self.smtp_tls = settings.SMTP_TLS
-        
         # Frontend URL for reset links
         self.frontend_url = settings.FRONTEND_URL
     
@@ -37,25 +33,25 @@ class EmailService:
         html_content: str,
         text_content: Optional[str] = None
     ) -> bool:
-        """Send an email using configured email service"""
+        """Queue an email for delivery, True once accepted"""
         if not self.enabled:
             logger.info(f"Email disabled. Would send to {to_email}: {subject}")
             return False
         
         try:
-            return self._send_via_smtp(to_email, subject, html_content, text_content)
+            return email_queue.enqueue(self.build_message(to_email, subject, html_content, text_content))
         except Exception as e:
             logger.error(f"Failed to send email to {to_email}: {e}")
             return False
     
-    def _send_via_smtp(
+    def build_message(
         self,
         to_email: str,
         subject: str,
         html_content: str,
         text_content: Optional[str] = None
-    ) -> bool:
-        """Send email via SMTP"""
+    ) -> MIMEMultipart:
+        """Build the MIME message for an email"""
         msg = MIMEMultipart('alternative')
         msg['Subject'] = subject
         msg['From'] = f"{self.from_name} <{self.from_email}>"
@@ -69,16 +65,7 @@ class EmailService:
         part2 = MIMEText(html_content, 'html')
         msg.attach(part2)
         
-        # Send email
-        with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-            if self.smtp_tls:
-                server.starttls()
-            if self.smtp_user and self.smtp_password:
-                server.login(self.smtp_user, self.smtp_password)
-            server.send_message(msg)
-        
-        logger.info(f"Email sent successfully to {to_email}")
-        return True
+        return msg
     
     def send_password_reset_email(self, to_email: str, reset_token: str) -> bool:
         """Send password reset email with token"""
@@ -0,0 +1,353 @@
+"""
+Outbound email queue delivered by background workers over persistent SMTP sessions
+
+Sending mail from the request (connect, STARTTLS, login, send, quit) makes
+the request wait on several SMTP round-trips, and a slow or unreachable
+server holds it for the whole timeout. Instead, EmailService enqueues the
+built message and returns; worker threads deliver it.
+
+Each worker keeps one SMTP session open (smtplib connections are not
+thread safe, so the pool is one session per worker). It is connected,
+STARTTLS'd and logged in once, reused for every message, and closed after
+EMAIL_SMTP_IDLE_SECONDS without mail. A worker takes up to EMAIL_BATCH_SIZE
+waiting messages at a time and sends them back to back on its session.
+
+Failures:
+permanent (5xx, recipient refused): the message goes to the dead letters
+transient (4xx, connection errors, timeouts): the session is dropped and the
+    message retried with exponential backoff (EMAIL_RETRY_BASE_SECONDS * 2^n,
+    with jitter), up to EMAIL_MAX_ATTEMPTS, then dead-lettered
+
+Dead letters (recipient, subject, error, attempts) are pushed to the
+email_dead_letters redis list, capped at EMAIL_DEAD_LETTER_MAX, or kept in
+memory while redis is unavailable. The body is not kept: it can hold a
+live password reset link. Messages still queued at shutdown, or
+refused because the queue is full, are dead-lettered too.
+
+EMAIL_QUEUE_WORKERS=0 sends on the calling thread, one session per message
+and without retries (scripts, tests).
+"""
+from collections import deque
+from dataclasses import dataclass, field
+from email.message import Message
+from typing import List, Optional
+from app.core.config import settings
+from app.database.redis_client import get_redis
+import heapq
+import itertools
+import json
+import logging
+import random
+import smtplib
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_KEY = "email_dead_letters"
+
+
+@dataclass
+class QueuedEmail:
+    message: Message
+    attempts: int = 0
+    last_error: Optional[str] = None
+    queued_at: float = field(default_factory=time.time)
+
+    @property
+    def to_email(self) -> str:
+        return self.message["To"]
+
+
+def is_permanent(error: Exception) -> bool:
+    """
+    Whether retrying cannot help: the server refused the recipient or the message
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    # a bad login is a configuration problem, retried until it is fixed or gives up
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class SmtpSession:
+    """
+    One persistent SMTP connection, opened on first use
+    """
+    def __init__(self, host=None, port=None, user=None, password=None, tls=None, timeout=None):
+        self.host = host or settings.SMTP_HOST
+        self.port = port or settings.SMTP_PORT
+        self.user = settings.SMTP_USER if user is None else user
+        self.password = settings.SMTP_PASSWORD if password is None else password
+        self.tls = settings.SMTP_TLS if tls is None else tls
+        self.timeout = timeout or settings.SMTP_TIMEOUT_SECONDS
+        self.server: Optional[smtplib.SMTP] = None
+        self.last_used = 0.0
+        self.connects = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.tls:
+                server.starttls()
+            if self.user and self.password:
+                server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.connects += 1
+
+    def send(self, message: Message):
+        if self.server is None:
+            self._connect()
+        self.server.send_message(message)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
+
+
+class RedisDeadLetters:
+    """
+    Undeliverable messages, newest first, in a capped redis list
+    """
+    def __init__(self, redis_client=None, max_entries: Optional[int] = None):
+        self._redis = redis_client
+        self.max_entries = max_entries or settings.EMAIL_DEAD_LETTER_MAX
+        # used while redis is unavailable
+        self.fallback = deque(maxlen=self.max_entries)
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def add(self, entry: dict):
+        try:
+            pipe = self.redis.pipeline()
+            pipe.lpush(DEAD_LETTER_KEY, json.dumps(entry))
+            pipe.ltrim(DEAD_LETTER_KEY, 0, self.max_entries - 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"Redis dead letter error (non-critical): {e}")
+            self.fallback.appendleft(entry)
+
+    def list(self, limit: int = 50) -> List[dict]:
+        try:
+            entries = [json.loads(raw) for raw in self.redis.lrange(DEAD_LETTER_KEY, 0, limit - 1)]
+        except Exception as e:
+            print(f"Redis dead letter error (non-critical): {e}")
+            entries = []
+        return entries + list(self.fallback)[:max(0, limit - len(entries))]
+
+
+class EmailQueue:
+    """
+    Bounded queue of outgoing messages with worker threads delivering them
+    """
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        retry_base: Optional[float] = None,
+        idle_timeout: Optional[float] = None,
+        dead_letters=None,
+        session_factory=SmtpSession
+    ):
+        self.workers = settings.EMAIL_QUEUE_WORKERS if workers is None else workers
+        self.max_size = max_size or settings.EMAIL_QUEUE_SIZE
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.max_attempts = max_attempts or settings.EMAIL_MAX_ATTEMPTS
+        self.retry_base = settings.EMAIL_RETRY_BASE_SECONDS if retry_base is None else retry_base
+        self.idle_timeout = idle_timeout or settings.EMAIL_SMTP_IDLE_SECONDS
+        self.dead_letters = dead_letters or RedisDeadLetters()
+        self.session_factory = session_factory
+
+        self._ready: deque = deque()
+        # (due, sequence, email) waiting for a retry
+        self._delayed: list = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+
+        # counters for monitoring
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+
+    def enqueue(self, message: Message) -> bool:
+        """
+        Queue a message for delivery, False when it could not be accepted
+
+        Time Complexity: O(1), the request never waits on SMTP
+        """
+        email = QueuedEmail(message)
+        if not self.workers:
+            return self._deliver_inline(email)
+        with self._condition:
+            if self._stopping or len(self._ready) + len(self._delayed) >= self.max_size:
+                rejected = True
+            else:
+                rejected = False
+                self._ready.append(email)
+                self._condition.notify()
+        if rejected:
+            self._dead_letter(email, "queue full" if not self._stopping else "shutting down")
+            return False
+        return True
+
+    def _deliver_inline(self, email: QueuedEmail) -> bool:
+        session = self.session_factory()
+        try:
+            self._send(session, [email])
+        finally:
+            session.close()
+        return email.last_error is None
+
+    def start(self):
+        """
+        Start the worker threads
+        """
+        if self._threads or not self.workers:
+            return
+        self._stopping = False
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"email-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Deliver what is ready within the timeout, dead-letter the rest
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+        with self._condition:
+            left = list(self._ready) + [email for _, _, email in self._delayed]
+            self._ready.clear()
+            self._delayed = []
+        for email in left:
+            self._dead_letter(email, email.last_error or "not sent before shutdown")
+
+    def join(self, timeout: float = 10.0) -> bool:
+        """
+        Wait until nothing is queued, waiting for a retry or being sent
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._ready or self._delayed or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(min(remaining, 0.05))
+        return True
+
+    def _take(self, session: SmtpSession) -> Optional[List[QueuedEmail]]:
+        """
+        Next batch of messages, None when the worker should exit
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[2])
+                if self._ready:
+                    batch = [self._ready.popleft() for _ in range(min(self.batch_size, len(self._ready)))]
+                    self._in_flight += len(batch)
+                    return batch
+                if self._stopping:
+                    return None
+                timeout = self.idle_timeout
+                if self._delayed:
+                    timeout = min(timeout, self._delayed[0][0] - now)
+                if not self._condition.wait(timeout) and session.server is not None:
+                    # idle, release the server's connection slot
+                    if time.monotonic() - session.last_used >= self.idle_timeout:
+                        session.close()
+
+    def _run(self):
+        session = self.session_factory()
+        try:
+            while True:
+                batch = self._take(session)
+                if batch is None:
+                    return
+                try:
+                    self._send(session, batch)
+                finally:
+                    with self._condition:
+                        self._in_flight -= len(batch)
+                        self._condition.notify_all()
+        finally:
+            session.close()
+
+    def _send(self, session: SmtpSession, batch: List[QueuedEmail]):
+        for email in batch:
+            email.attempts += 1
+            try:
+                session.send(email.message)
+            except Exception as e:
+                email.last_error = f"{type(e).__name__}: {e}"
+                if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    # the session may be broken, start the next message on a new one
+                    session.close()
+                self._failed(email, e)
+                continue
+            email.last_error = None
+            self.sent += 1
+            logger.info(f"Email sent successfully to {email.to_email}")
+
+    def _failed(self, email: QueuedEmail, error: Exception):
+        if is_permanent(error) or email.attempts >= self.max_attempts or not self.workers:
+            self._dead_letter(email, email.last_error)
+            return
+        delay = self.retry_base * 2 ** (email.attempts - 1) * random.uniform(0.8, 1.2)
+        logger.warning(f"Email to {email.to_email} failed ({email.last_error}), retrying in {delay:.1f}s")
+        self.retried += 1
+        with self._condition:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), email))
+            self._condition.notify()
+
+    def _dead_letter(self, email: QueuedEmail, reason: Optional[str]):
+        self.dead += 1
+        logger.error(f"Email to {email.to_email} not delivered: {reason}")
+        self.dead_letters.add({
+            "to": email.to_email,
+            "subject": email.message["Subject"],
+            "error": reason,
+            "attempts": email.attempts,
+            "queued_at": email.queued_at,
+            "failed_at": time.time(),
+        })
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": len(self._ready),
+            "retrying": len(self._delayed),
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead_lettered": self.dead,
+        }
+
+
+# global email queue instance
+email_queue = EmailQueue()
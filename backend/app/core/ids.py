@@ -0,0 +1,217 @@
+"""
+Time-ordered unique ID generation (snowflake style)
+
+IDs are assigned by the application before a row reaches the database, so a
+message can be broadcast right away and persisted later. The layout fits in
+53 bits so IDs stay exact as JavaScript numbers on the client:
+
+    41 bits  milliseconds since ID_EPOCH_MS (about 69 years)
+     5 bits  worker id (up to 32 processes)
+     7 bits  per-millisecond sequence (128 ids per ms per process)
+
+Two processes generating with the same worker id can produce the same ids,
+so the worker id is either set per process (ID_WORKER_ID) or leased from
+Redis (WorkerIdLease).
+"""
+from datetime import datetime
+from typing import Optional
+import asyncio
+import random
+import threading
+import time
+import uuid
+from app.core.config import settings
+from app.database.redis_client import get_redis
+
+# 2024-01-01T00:00:00Z
+ID_EPOCH_MS = 1704067200000
+
+WORKER_BITS = 5
+SEQUENCE_BITS = 7
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_BITS + SEQUENCE_BITS
+
+
+class IdGenerator:
+    """
+    Thread-safe generator of increasing 53-bit IDs for one worker
+    """
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def set_worker_id(self, worker_id: int):
+        """
+        Continue with another worker id, e.g. after a lost lease
+        """
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+        with self._lock:
+            self.worker_id = worker_id
+
+    def next_id(self) -> int:
+        """
+        Generate the next ID
+
+        Time Complexity: O(1), spins at most until the next millisecond
+        when more than 128 IDs are requested within one millisecond
+        """
+        with self._lock:
+            # never go backwards, even if the wall clock does
+            now_ms = max(int(time.time() * 1000), self._last_ms)
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    while now_ms <= self._last_ms:
+                        now_ms = int(time.time() * 1000)
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+
+            return (
+                ((now_ms - ID_EPOCH_MS) << TIMESTAMP_SHIFT)
+                | (self.worker_id << SEQUENCE_BITS)
+                | self._sequence
+            )
+
+
+def id_timestamp(generated_id: int) -> datetime:
+    """
+    UTC time at which an ID was generated
+    """
+    ms = (generated_id >> TIMESTAMP_SHIFT) + ID_EPOCH_MS
+    return datetime.utcfromtimestamp(ms / 1000)
+
+
+class WorkerIdLease:
+    """
+    A worker id held in Redis, so no two processes generate with the same one
+
+    The id is claimed with SET NX under id_worker:{n} and kept by renewing
+    the key every third of ID_WORKER_LEASE_SECONDS (start()). When a renewal
+    finds the key taken by another process, for instance after Redis lost
+    it, a free id is leased and the generator switches to it.
+    """
+    def __init__(self, redis_client=None, ttl: Optional[int] = None):
+        self._redis = redis_client
+        self.ttl = ttl or settings.ID_WORKER_LEASE_SECONDS
+        self.owner = f"{settings.NODE_ID or 'node'}:{uuid.uuid4().hex}"
+        self.worker_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    @staticmethod
+    def key(worker_id: int) -> str:
+        return f"id_worker:{worker_id}"
+
+    def acquire(self) -> int:
+        """
+        Lease a free worker id, RuntimeError when all of them are taken
+
+        Time Complexity: O(w) SET NX round-trips at worst, w = 32 worker ids
+        """
+        first = random.randrange(MAX_WORKER_ID + 1)
+        for offset in range(MAX_WORKER_ID + 1):
+            worker_id = (first + offset) % (MAX_WORKER_ID + 1)
+            if self.redis.set(self.key(worker_id), self.owner, nx=True, ex=self.ttl):
+                self.worker_id = worker_id
+                return worker_id
+        raise RuntimeError(f"All {MAX_WORKER_ID + 1} message id worker ids are leased")
+
+    def renew(self) -> bool:
+        """
+        Extend the lease, False when another process holds the id now
+        """
+        key = self.key(self.worker_id)
+        owner = self.redis.get(key)
+        if owner is None:
+            # expired meanwhile, still ours unless someone was faster
+            return bool(self.redis.set(key, self.owner, nx=True, ex=self.ttl))
+        if owner != self.owner:
+            return False
+        return bool(self.redis.expire(key, self.ttl))
+
+    def start(self):
+        """
+        Start renewing the lease, nothing to do for a configured worker id
+        """
+        if self.worker_id is None or (self.task is not None and not self.task.done()):
+            return
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop renewing, the lease runs out after ttl seconds
+        """
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await asyncio.to_thread(self.renew):
+                    lost = self.worker_id
+                    worker_id = await asyncio.to_thread(self.acquire)
+                    get_message_id_generator().set_worker_id(worker_id)
+                    print(f"Message id worker id {lost} was taken over, now using {worker_id}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis worker id lease error: {e}")
+
+
+# global worker id lease instance
+worker_id_lease = WorkerIdLease()
+
+
+def default_worker_id() -> int:
+    """
+    Worker id from settings, else one leased from Redis
+
+    Raises RuntimeError when neither is available rather than guessing an
+    id another process may be using.
+    """
+    if settings.ID_WORKER_ID >= 0:
+        return settings.ID_WORKER_ID
+    try:
+        return worker_id_lease.acquire()
+    except Exception as e:
+        raise RuntimeError(
+            f"No unique message id worker id, set ID_WORKER_ID (0-{MAX_WORKER_ID}) "
+            f"per process or make Redis reachable: {e}"
+        ) from e
+
+
+# created on first use, the worker id may need Redis
+message_id_generator: Optional[IdGenerator] = None
+_generator_lock = threading.Lock()
+
+
+def get_message_id_generator() -> IdGenerator:
+    global message_id_generator
+    if message_id_generator is None:
+        with _generator_lock:
+            if message_id_generator is None:
+                message_id_generator = IdGenerator(default_worker_id())
+    return message_id_generator
+
+
+def generate_message_id() -> int:
+    return get_message_id_generator().next_id()
@@ -0,0 +1,203 @@
+"""
+Password hashing off the request threads, with admission control
+
+bcrypt is deliberately slow (a few hundred ms of CPU at the usual work
+factors). It releases the GIL, but hashed on the request threads a burst
+of logins still takes the threadpool every sync endpoint shares and all
+the CPU the process gets, so the event loop and the other requests slow
+down with it. The PasswordHasher runs it in a pool of
+PASSWORD_HASH_WORKERS processes instead, which caps bcrypt at that many
+cores and keeps it out of the serving process.
+
+The pool is started by the app lifespan, and its workers are spawned
+rather than forked: forking the multithreaded server (request threads,
+email workers) can copy locks held by other threads into the children.
+
+At most workers + PASSWORD_HASH_QUEUE_SIZE hashes are admitted at a time.
+Beyond that HasherBusy is raised right away, which the API answers with
+503 and a Retry-After header, so a login storm is shed instead of piling
+up requests that time out anyway.
+
+The work factor is PASSWORD_BCRYPT_ROUNDS. Hashes made with other
+parameters still verify, and are rehashed on the next successful login
+(verify_and_update).
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+from passlib.context import CryptContext
+from app.core.config import settings
+import asyncio
+import multiprocessing
+import threading
+
+
+class HasherBusy(Exception):
+    """All hashing slots are taken, the caller should retry later"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Password hashing is saturated")
+        self.retry_after = retry_after
+
+
+@lru_cache(maxsize=None)
+def _context(rounds: int) -> CryptContext:
+    """One CryptContext per work factor and process"""
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    """
+    Work factor of a bcrypt hash ($2b$<rounds>$...), None if it is not one
+    """
+    parts = hashed_password.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def _hash(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password, with a new hash when the stored one uses other parameters
+
+    Runs in a worker process, so the rehash costs no extra round-trip.
+    """
+    context = _context(rounds)
+    try:
+        valid = context.verify(password, hashed_password)
+    except ValueError:
+        # not a hash this context knows
+        return False, None
+    if valid and (context.needs_update(hashed_password) or hash_rounds(hashed_password) != rounds):
+        return True, context.hash(password)
+    return valid, None
+
+
+class PasswordHasher:
+    """
+    bcrypt in a bounded process pool, workers=0 hashes on the calling thread
+    """
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        rounds: Optional[int] = None,
+        retry_after: Optional[int] = None
+    ):
+        self.workers = settings.PASSWORD_HASH_WORKERS if workers is None else workers
+        self.queue_size = settings.PASSWORD_HASH_QUEUE_SIZE if queue_size is None else queue_size
+        self.rounds = rounds or settings.PASSWORD_BCRYPT_ROUNDS
+        self.retry_after = retry_after or settings.PASSWORD_HASH_RETRY_AFTER_SECONDS
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+        # counters for monitoring
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    @property
+    def executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers and self._executor is None:
+            self.start()
+        return self._executor
+
+    def start(self):
+        """
+        Start the worker processes, spawned so no thread state is inherited
+        """
+        if not self.workers:
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+
+    def _admit(self):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy(self.retry_after)
+
+    def _done(self, _=None):
+        self.completed += 1
+        self._slots.release()
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        """
+        Admit a job and run it in the pool (or inline), the slot is freed when it ends
+        """
+        self._admit()
+        if self.executor is None:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            self._done()
+            return future
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def hash(self, password: str) -> str:
+        """
+        Hash a password, raises HasherBusy when saturated
+        """
+        return self._submit(_hash, password, self.rounds).result()
+
+    def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password; the second value is a replacement hash when the
+        stored one was made with other parameters, else None
+
+        Raises HasherBusy when saturated.
+        """
+        valid, new_hash = self._submit(
+            _verify_and_update, password, hashed_password, self.rounds
+        ).result()
+        if new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        return self.verify_and_update(password, hashed_password)[0]
+
+    async def verify_async(self, password: str, hashed_password: str) -> bool:
+        """
+        verify for coroutines, the event loop is not blocked while bcrypt runs
+        """
+        future = self._submit(_verify_and_update, password, hashed_password, self.rounds)
+        valid, _ = await asyncio.wrap_future(future)
+        return valid
+
+    def shutdown(self):
+        """
+        Stop the worker processes, they are started again by start() or the next use
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
+
+
+# global password hasher instance
+password_hasher = PasswordHasher()
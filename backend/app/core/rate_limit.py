@@ -0,0 +1,235 @@
+"""
+Rate limiting for the auth endpoints and websocket messages
+
+A rule allows `limit` hits per `period` seconds for each key (a client IP,
+an email, a user id). Limits are checked before any expensive work, so a
+credential stuffing run is answered with 429 + Retry-After instead of
+bcrypt checks and reset emails.
+
+Two algorithms, both O(1) state per key:
+
+GCRA (generic cell rate algorithm): the in-process limiter. The state of a
+     key is one float, the theoretical arrival time of the next hit. Hits
+     are spaced period / limit apart, with bursts of up to `limit`.
+     Also used per websocket for message rates.
+sliding window counter: the redis limiter, shared by all nodes. Two fixed
+     window counters (this one and the previous one) are INCRed and read
+     in one MULTI; the previous window is weighted by how much of it still
+     overlaps the sliding window.
+
+In both stores rejected hits count too, so a client that keeps hammering
+stays limited, for at most about two periods after it stops.
+
+RATE_LIMIT_BACKEND picks redis (falling back to in-process when redis
+errors, enforced per node) or memory.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from fastapi import Request
+from app.core.config import settings
+from app.database.redis_client import get_redis
+import math
+import re
+import threading
+import time
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class RateLimited(Exception):
+    """Raised when a rule's limit is exhausted, answered with 429 (see app.main)"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Too many requests")
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    name: str
+    limit: int
+    period: float
+
+
+def parse_rate(name: str, spec: str) -> RateLimit:
+    """
+    Rule from a "<limit>/<period>" spec, e.g. "5/minute" or "20/15minutes"
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*", spec)
+    if match is None:
+        raise ValueError(f"Invalid rate limit for {name}: {spec!r}")
+    limit, count, unit = match.groups()
+    return RateLimit(name, int(limit), int(count or 1) * PERIODS[unit])
+
+
+def gcra(tat: float, now: float, cost: int, limit: int, period: float) -> Tuple[float, float]:
+    """
+    (new theoretical arrival time, 0) for an allowed hit, (tat, seconds to wait) otherwise
+    """
+    new_tat = max(tat, now) + cost * period / limit
+    wait = new_tat - now - period
+    if wait > 0:
+        return tat, wait
+    return new_tat, 0.0
+
+
+class Gcra:
+    """
+    Limits one stream of hits, e.g. the messages of a websocket
+    """
+    def __init__(self, rule: RateLimit):
+        self.rule = rule
+        self.tat = 0.0
+
+    def hit(self, cost: int = 1) -> float:
+        """
+        0 when allowed, else the seconds until it would be
+        """
+        self.tat, wait = gcra(self.tat, time.monotonic(), cost, self.rule.limit, self.rule.period)
+        return wait
+
+
+class MemoryRateLimiter:
+    """
+    GCRA per key in this process, least recently hit keys evicted first
+    """
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # (rule name, key) -> theoretical arrival time (monotonic)
+        self._tats: "OrderedDict[tuple, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, rule: RateLimit, key: str, cost: int = 1) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tat, wait = gcra(self._tats.get((rule.name, key), now), now, cost, rule.limit, rule.period)
+            if wait > 0:
+                # rejected hits count too, like in the redis windows, up to
+                # two periods ahead
+                tat = min(tat + cost * rule.period / rule.limit, now + 2 * rule.period)
+            self._tats[(rule.name, key)] = tat
+            self._tats.move_to_end((rule.name, key))
+            # an evicted key starts over, memory stays bounded under a spray of keys
+            while len(self._tats) > self.max_keys:
+                self._tats.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+
+
+class RedisRateLimiter:
+    """
+    Sliding window counter per key in redis, shared by all nodes
+    """
+    def __init__(self, redis_client=None):
+        self._redis = redis_client
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def hit(self, rule: RateLimit, key: str, cost: int = 1) -> float:
+        now = time.time()
+        window = int(now // rule.period)
+        elapsed = now / rule.period - window
+        current_key = f"ratelimit:{rule.name}:{key}:{window}"
+
+        pipe = self.redis.pipeline()
+        pipe.incrby(current_key, cost)
+        pipe.expire(current_key, math.ceil(2 * rule.period))
+        pipe.get(f"ratelimit:{rule.name}:{key}:{window - 1}")
+        current, _, previous = pipe.execute()
+        previous = int(previous or 0)
+
+        if previous * (1 - elapsed) + current <= rule.limit:
+            return 0.0
+        # wait until the weighted count is back under the limit
+        if current < rule.limit and previous:
+            return (1 - (rule.limit - current) / previous - elapsed) * rule.period
+        return (2 - elapsed - rule.limit / current) * rule.period
+
+    def clear(self):
+        pass
+
+
+class RateLimiter:
+    """
+    Checks rules against the configured store
+    """
+    def __init__(self, store=None, enabled: Optional[bool] = None):
+        self.memory = MemoryRateLimiter()
+        if store is None:
+            store = self.memory if settings.RATE_LIMIT_BACKEND == "memory" else RedisRateLimiter()
+        self.store = store
+        self.enabled = settings.RATE_LIMIT_ENABLED if enabled is None else enabled
+
+        # counters for monitoring
+        self.allowed = 0
+        self.limited = 0
+
+    def hit(self, rule: RateLimit, key: str, cost: int = 1) -> float:
+        """
+        Count a hit, 0 when allowed else the seconds until it would be
+
+        Time Complexity: O(1), one redis round-trip or a dict update
+        """
+        if not self.enabled:
+            return 0.0
+        try:
+            wait = self.store.hit(rule, key, cost)
+        except Exception as e:
+            print(f"Redis rate limit error (non-critical): {e}")
+            wait = self.memory.hit(rule, key, cost)
+        if wait > 0:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def check(self, rule: RateLimit, key: str, cost: int = 1):
+        """
+        Count a hit, raising RateLimited when over the limit
+        """
+        wait = self.hit(rule, key, cost)
+        if wait > 0:
+            raise RateLimited(wait)
+
+    def clear(self):
+        self.store.clear()
+        self.memory.clear()
+
+    def get_stats(self) -> dict:
+        return {"allowed": self.allowed, "limited": self.limited}
+
+
+# global rate limiter instance
+rate_limiter = RateLimiter()
+
+LOGIN_PER_IP = parse_rate("login_ip", settings.RATE_LIMIT_LOGIN_PER_IP)
+LOGIN_PER_EMAIL = parse_rate("login_email", settings.RATE_LIMIT_LOGIN_PER_EMAIL)
+REFRESH_PER_IP = parse_rate("refresh_ip", settings.RATE_LIMIT_REFRESH_PER_IP)
+REFRESH_PER_USER = parse_rate("refresh_user", settings.RATE_LIMIT_REFRESH_PER_USER)
+PASSWORD_RESET_PER_IP = parse_rate("reset_ip", settings.RATE_LIMIT_PASSWORD_RESET_PER_IP)
+PASSWORD_RESET_CONFIRM_PER_IP = parse_rate(
+    "reset_confirm_ip", settings.RATE_LIMIT_PASSWORD_RESET_CONFIRM_PER_IP
+)
+PASSWORD_RESET_PER_EMAIL = parse_rate("reset_email", settings.RATE_LIMIT_PASSWORD_RESET_PER_EMAIL)
+
+
+def client_ip(request: Request) -> str:
+    # behind a proxy, run uvicorn with --proxy-headers so this is the real client
+    return request.client.host if request.client else "unknown"
+
+
+def limit_by_ip(rule: RateLimit):
+    """
+    Dependency counting a request against a rule, keyed by client IP
+    """
+    def dependency(request: Request):
+        rate_limiter.check(rule, client_ip(request))
+    return dependency
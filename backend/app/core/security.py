@@ -1,11 +1,15 @@
 from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from typing import Optional, Tuple
 from fastapi import HTTPException, status
 from app.core.config import settings
+from app.core.passwords import password_hasher
+from app.core.tokens import token_verifier
+from app.auth.revocation import token_revocation
+import uuid
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def new_token_family() -> str:
+    """id shared by the tokens of one login, revoked together (app.auth.revocation)"""
+    return uuid.uuid4().hex
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -14,26 +18,40 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex, "typ": "access"})
+    encoded_jwt = token_verifier.encode(to_encode)
     return encoded_jwt
 
 def create_refresh_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    to_encode.setdefault("fam", new_token_family())
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex, "typ": "refresh"})
+    encoded_jwt = token_verifier.encode(to_encode)
     return encoded_jwt
 
+# bcrypt runs in the password hasher's process pool and raises HasherBusy
+# when saturated (answered with 503, see app.main)
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify(plain_password, hashed_password)
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return password_hasher.verify_and_update(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
 
+# claims of verified tokens are cached until they expire (app.core.tokens),
+# revocation is checked on every call, mostly against an in-memory filter
 def verify_token(token: str) -> Optional[dict]:
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
-    except JWTError:
-        return None
\ No newline at end of file
+    payload = token_verifier.verify(token)
+    if payload is None or token_revocation.is_revoked(payload):
+        return None
+    return payload
+
+# for the event loop: a revocation lookup in redis runs in a thread
+async def verify_token_async(token: str) -> Optional[dict]:
+    payload = token_verifier.verify(token)
+    if payload is None or await token_revocation.is_revoked_async(payload):
+        return None
+    return payload
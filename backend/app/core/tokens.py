@@ -0,0 +1,162 @@
+"""
+JWT encoding and verification with a cache of verified claims
+
+Clients send the same access token with every request for its whole
+lifetime, so checking its signature again each time is wasted work. The
+claims of a verified token are kept in an LRU cache keyed by the SHA-256
+digest of the token (the token itself is not kept) until the token's exp,
+and a repeat lookup is a hash and a dict access. Tokens that fail
+verification are not cached, so garbage tokens cannot flush the cache.
+
+The signing library is picked by JWT_BACKEND:
+jose:  python-jose, the default
+pyjwt: PyJWT (optional), with the HMAC key prepared once instead of on
+       every call; a little faster on cache misses
+"""
+from collections import OrderedDict
+from typing import Optional, Tuple
+from jose import JWTError, jwt as jose_jwt
+from app.core.config import settings
+import hashlib
+import threading
+import time
+
+try:
+    import jwt as pyjwt
+    from jwt.algorithms import get_default_algorithms
+except ImportError:  # optional, only needed for JWT_BACKEND=pyjwt
+    pyjwt = None
+
+
+class JoseBackend:
+    """python-jose"""
+    name = "jose"
+
+    def __init__(self, secret_key: str, algorithm: str):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    def encode(self, claims: dict) -> str:
+        return jose_jwt.encode(claims, self.secret_key, algorithm=self.algorithm)
+
+    def decode(self, token: str) -> Optional[dict]:
+        try:
+            return jose_jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        except JWTError:
+            return None
+
+
+class PyJWTBackend:
+    """PyJWT, with the signing key prepared once"""
+    name = "pyjwt"
+
+    def __init__(self, secret_key: str, algorithm: str):
+        if pyjwt is None:
+            raise RuntimeError("JWT_BACKEND=pyjwt needs PyJWT installed")
+        self.algorithm = algorithm
+        # the key object is reused, PyJWT skips preparing it for key objects
+        self.key = get_default_algorithms()[algorithm].prepare_key(secret_key)
+        self._jwt = pyjwt.PyJWT()
+
+    def encode(self, claims: dict) -> str:
+        return self._jwt.encode(claims, self.key, algorithm=self.algorithm)
+
+    def decode(self, token: str) -> Optional[dict]:
+        try:
+            return self._jwt.decode(token, self.key, algorithms=[self.algorithm])
+        except pyjwt.PyJWTError:
+            return None
+
+
+BACKENDS = {backend.name: backend for backend in (JoseBackend, PyJWTBackend)}
+
+
+def make_backend(name: Optional[str] = None):
+    name = name or settings.JWT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown JWT_BACKEND: {name}")
+    return BACKENDS[name](settings.SECRET_KEY, settings.ALGORITHM)
+
+
+class TokenVerifier:
+    """
+    Verifies tokens through a backend, with an LRU cache of verified claims
+
+    Tokens are verified on the event loop (get_current_principal) and on
+    threadpool threads (the sync get_current_user dependency) at the same
+    time, so the LRU is guarded by a lock.
+    """
+    def __init__(self, backend=None, max_entries: Optional[int] = None):
+        self._backend = backend
+        self.max_entries = (
+            settings.JWT_CLAIMS_CACHE_SIZE if max_entries is None else max_entries
+        )
+        # token digest -> (claims, exp), least recently used first
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = make_backend()
+        return self._backend
+
+    def encode(self, claims: dict) -> str:
+        return self.backend.encode(claims)
+
+    def verify(self, token: str) -> Optional[dict]:
+        """
+        Claims of a valid token, None when invalid or expired
+
+        Time Complexity: O(1) for a cached token, else a signature check
+        """
+        if not self.max_entries:
+            return self.backend.decode(token)
+
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, exp = entry
+                if exp > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(claims)
+                del self._entries[key]
+
+        self.misses += 1
+        claims = self.backend.decode(token)
+        exp = claims.get("exp") if claims is not None else None
+        # only tokens that expire are cached, and only until they do
+        if isinstance(exp, (int, float)) and exp > now:
+            with self._lock:
+                self._entries[key] = (claims, exp)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return dict(claims)
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Hit/miss counters for monitoring
+        """
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# global token verifier instance
+token_verifier = TokenVerifier()
@@ -1,8 +1,15 @@
 import redis
+import redis.asyncio as aioredis
 from app.core.config import settings
 
 # redis client for caching and pub/sub
 redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
 
+# asyncio redis client for use inside the event loop (websocket fan-out)
+async_redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+
 def get_redis():
-    return redis_client
\ No newline at end of file
+    return redis_client
+
+def get_async_redis():
+    return async_redis_client
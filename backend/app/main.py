@@ -1,23 +1,83 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from app.core.config import settings
 from app.api.v1.api import api_router
 from app.chat.ws_routes import router as ws_router
-from app.database.database import engine
+from app.chat.websocket import manager
+from app.chat.persistence import message_writer
+from app.chat.presence import presence
+from app.chat.typing_indicators import typing_indicators
+from app.core.passwords import HasherBusy, password_hasher
+from app.auth.revocation import token_revocation
+from app.core.rate_limit import RateLimited
+from app.core.email_queue import email_queue
+from app.core.ids import get_message_id_generator, worker_id_lease
+from app.database.database import engine, async_engine
 from app.models import Base
 from app.admin import setup_admin
 
 # create database tables
 Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # fail at startup, not on the first message, without a unique worker id
+    get_message_id_generator()
+    worker_id_lease.start()
+    message_writer.start()
+    presence.start(manager)
+    typing_indicators.start(manager)
+    token_revocation.start()
+    email_queue.start()
+    password_hasher.start()
+    yield
+    await token_revocation.stop()
+    await typing_indicators.stop()
+    # stop accepting messages: close the sockets and release the pub/sub subscription
+    await manager.close()
+    # then flush the messages already accepted and last_seen
+    await message_writer.stop()
+    await presence.stop()
+    await worker_id_lease.stop()
+    await async_engine.dispose()
+    password_hasher.shutdown()
+    # deliver queued emails, dead-letter what cannot go out in time
+    await asyncio.to_thread(email_queue.stop)
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
     description="A realtime chat server built with FastAPI",
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
 
+@app.exception_handler(HasherBusy)
+async def hasher_busy_handler(request: Request, exc: HasherBusy):
+    """Shed password hashing load instead of queueing requests without bound"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, please retry"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    """Refuse requests over a rate limit before they do any work"""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Too many requests, please retry later"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
 # add session middleware for admin authentication
 app.add_middleware(SessionMiddleware, secret_key=settings.SECRET_KEY)
 
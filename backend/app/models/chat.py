@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, Table
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, DateTime, ForeignKey, Enum, Table, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
 from app.database.database import Base
+from app.core.ids import generate_message_id
 
 
 class RoomType(enum.Enum):
@@ -44,7 +45,15 @@ class ChatRoom(Base):
 class Message(Base):
     __tablename__ = "messages"
     
-    id = Column(Integer, primary_key=True, index=True)
+    # application-assigned, time-ordered ids (see app.core.ids); sqlite needs
+    # INTEGER for a rowid primary key, which is 64-bit there anyway
+    id = Column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+        index=True,
+        autoincrement=False,
+        default=generate_message_id
+    )
     room_id = Column(Integer, ForeignKey("chat_rooms.id"), index=True)
     sender_id = Column(Integer, ForeignKey("users.id"), index=True)
     content = Column(Text, nullable=False)
@@ -55,6 +64,11 @@ class Message(Base):
     # relationships
     room = relationship("ChatRoom", back_populates="messages")
     sender = relationship("User", back_populates="sent_messages")
+    
+    __table_args__ = (
+        # keyset pagination of a room's history (app.chat.pagination)
+        Index("ix_messages_room_id_id", "room_id", "id"),
+    )
 
 
 # roommembership is defined as a table above for the many-to-many relationship
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""
+Per-recipient CPU cost of broadcast encoding, before and after serialize-once
+
+before: json.dumps once, then the ASGI server encodes the text to UTF-8 for
+        every recipient and redis-py encodes it again for the publish
+after:  one Frame per message (orjson when installed), whose bytes are shared
+        by every binary recipient and by the Redis envelope
+
+Only the encoding work is measured; no sockets or event loop are involved.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_broadcast_encode [--rounds 200]
+"""
+import argparse
+import json
+import time
+
+from app.chat.frames import Frame, orjson
+from app.chat.websocket import pack_envelope
+
+MESSAGE = {
+    "type": "message",
+    "data": {
+        "id": 123456789,
+        "room_id": 42,
+        "sender_id": 7,
+        "sender_username": "jane_doe",
+        "content": "Meeting moved to 15:00, bring the quarterly numbers please",
+        "timestamp": "2024-01-01T12:00:00.123456",
+        "is_edited": False,
+        "message_type": "text",
+    },
+}
+
+
+def before(recipients: int):
+    message_json = json.dumps(MESSAGE)
+    for _ in range(recipients):
+        # starlette send_text builds the ASGI event, the server encodes it
+        event = {"type": "websocket.send", "text": message_json}
+        event["text"].encode("utf-8")
+    # redis-py encodes the str once more for the publish
+    f"v1|node|42||{message_json}".encode("utf-8")
+
+
+def after_binary(recipients: int):
+    frame = Frame.from_message(MESSAGE)
+    for _ in range(recipients):
+        {"type": "websocket.send", "bytes": frame.data}
+    pack_envelope("node", 42, frame.data)
+
+
+def after_text(recipients: int):
+    frame = Frame.from_message(MESSAGE)
+    for _ in range(recipients):
+        # text frames still have to be encoded by the ASGI server per send
+        event = {"type": "websocket.send", "text": frame.text}
+        event["text"].encode("utf-8")
+    pack_envelope("node", 42, frame.data)
+
+
+def measure(fn, recipients: int, rounds: int, repeats: int = 5) -> float:
+    """Nanoseconds of CPU per recipient, best of several repeats"""
+    best = None
+    for _ in range(repeats):
+        started = time.process_time_ns()
+        for _ in range(rounds):
+            fn(recipients)
+        elapsed = time.process_time_ns() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / (rounds * recipients)
+
+
+def main(rounds: int):
+    global MESSAGE
+    print(f"json backend: {'orjson' if orjson is not None else 'stdlib json'}")
+    ascii_message = MESSAGE
+    unicode_message = json.loads(json.dumps(MESSAGE))
+    unicode_message["data"]["content"] = "Ça marche! Réunion déplacée à 15:00 👋"
+    
+    for label, message in (("ascii content", ascii_message), ("non-ascii content", unicode_message)):
+        MESSAGE = message
+        size_before = len(json.dumps(message).encode("utf-8"))
+        size_after = len(Frame.from_message(message).data)
+        print(f"\n{label} ({size_before} bytes before, {size_after} bytes after)")
+        print(f"{'room size':>10} {'before':>12} {'after/text':>12} {'after/binary':>14}   (ns per recipient)")
+        for recipients in (10, 100, 1000):
+            # scale rounds so every row does a similar amount of work
+            row_rounds = max(1, rounds * 100 // recipients)
+            results = [measure(fn, recipients, row_rounds) for fn in (before, after_text, after_binary)]
+            print(f"{recipients:>10} {results[0]:>12.1f} {results[1]:>12.1f} {results[2]:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    main(args.rounds)
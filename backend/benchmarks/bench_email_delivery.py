@@ -0,0 +1,118 @@
+"""
+Email sending cost seen by the request, a fresh SMTP connection per email vs the outbound queue
+
+Runs a local SMTP server (aiosmtpd, pip install aiosmtpd) that delays every
+SMTP reply by --rtt-ms, standing in for the network round-trip to a real
+mail server, and sends --emails password reset sized messages:
+
+inline: EMAIL_QUEUE_WORKERS=0, the request connects, says EHLO, sends and
+        quits for every email (the previous behavior, minus STARTTLS and
+        login, which would add more round-trips)
+queued: the request only enqueues, one worker delivers over one persistent
+        session
+
+For each it reports the p50/p99 time the request spends per email, the
+time until every email was delivered and the SMTP connections made.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_email_delivery [--emails 200] [--rtt-ms 5]
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import time
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import SMTP
+
+from app.core.email import EmailService
+from app.core.email_queue import EmailQueue, SmtpSession
+
+
+class SlowSMTP(SMTP):
+    """Replies after a fixed delay, like a server across a network"""
+
+    rtt = 0.0
+
+    async def push(self, status):
+        await asyncio.sleep(self.rtt)
+        await super().push(status)
+
+
+class SlowController(Controller):
+    def factory(self):
+        return SlowSMTP(self.handler)
+
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def run(workers: int, emails: int, port: int, handler: CountingHandler) -> dict:
+    sessions = []
+
+    def session_factory():
+        session = SmtpSession(host="127.0.0.1", port=port, user="", password="", tls=False)
+        sessions.append(session)
+        return session
+
+    queue = EmailQueue(workers=workers, max_size=emails, session_factory=session_factory)
+    service = EmailService()
+    received = handler.received
+    queue.start()
+    latencies = []
+    started = time.perf_counter()
+    body = "<p>" + ("x" * 70 + "\n") * 30 + "</p>"
+    for i in range(emails):
+        msg = service.build_message(f"user{i}@example.com", "Reset Your Password", body)
+        begun = time.perf_counter()
+        queue.enqueue(msg)
+        latencies.append(time.perf_counter() - begun)
+    queue.join(timeout=600)
+    delivered = time.perf_counter() - started
+    queue.stop()
+    assert handler.received - received == emails, (queue.get_stats(), queue.dead_letters.list(1))
+    return {
+        "p50": statistics.median(latencies),
+        "p99": sorted(latencies)[int(0.99 * (len(latencies) - 1))],
+        "delivered": delivered,
+        "connections": sum(session.connects for session in sessions),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    SlowSMTP.rtt = args.rtt_ms / 1000
+    handler = CountingHandler()
+    port = free_port()
+    server = SlowController(handler, hostname="127.0.0.1", port=port)
+    server.start()
+    try:
+        print(f"{args.emails} emails, {args.rtt_ms:g}ms per SMTP reply")
+        print(f"{'setup':>7} {'request p50':>12} {'request p99':>12} {'all delivered':>14} {'connections':>12}")
+        for label, workers in (("inline", 0), ("queued", 1)):
+            result = run(workers, args.emails, port, handler)
+            print(f"{label:>7} {result['p50'] * 1000:>10.2f}ms {result['p99'] * 1000:>10.2f}ms "
+                  f"{result['delivered']:>13.2f}s {result['connections']:>12}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
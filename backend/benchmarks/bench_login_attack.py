@@ -0,0 +1,132 @@
+"""
+CPU spent by the login endpoint under a credential stuffing attack, with and without rate limits
+
+A temporary SQLite database holds one victim account. Attackers send
+--attempts password guesses against it through the real /auth/login route,
+spread over --ips client addresses, while a legitimate user logs in to its
+own account every --legit-every attempts. bcrypt runs on the request thread
+(workers=0) so its CPU is counted in this process.
+
+For each setup it reports the process CPU seconds for the whole run, the
+bcrypt checks done, the attack responses by status and the legitimate
+user's login latency:
+
+unlimited: RATE_LIMIT_ENABLED off (the previous behavior), every guess
+           costs a bcrypt check
+limited:   the configured per IP and per email limits, in process; guesses
+           past the limits are refused before any hashing, so the CPU cost
+           is bounded by the limits however long the attack runs
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_login_attack [--attempts 500] [--ips 4] [--rounds 12]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.passwords import password_hasher
+from app.core.rate_limit import rate_limiter
+from app.database.database import Base, get_db
+from app.main import app
+from app.models.user import User
+
+
+def attack(attempts: int, ips: int, legit_every: int) -> dict:
+    clients = [TestClient(app, client=(f"203.0.113.{i + 1}", 40000)) for i in range(ips)]
+    legit = TestClient(app, client=("198.51.100.7", 40000))
+    statuses, legit_latencies = Counter(), []
+
+    verify = password_hasher.verify_and_update
+    checks = 0
+
+    def counting_verify(password, hashed):
+        nonlocal checks
+        checks += 1
+        return verify(password, hashed)
+
+    password_hasher.verify_and_update = counting_verify
+    started = time.process_time()
+    try:
+        for i in range(attempts):
+            response = clients[i % ips].post(
+                "/api/v1/auth/login", json={"email": "victim@example.com", "password": f"guess-{i}"}
+            )
+            statuses[response.status_code] += 1
+            if i % legit_every == 0:
+                begun = time.perf_counter()
+                response = legit.post(
+                    "/api/v1/auth/login", json={"email": "user@example.com", "password": "user-password"}
+                )
+                assert response.status_code == 200, response.text
+                legit_latencies.append(time.perf_counter() - begun)
+    finally:
+        password_hasher.verify_and_update = verify
+
+    return {
+        "cpu": time.process_time() - started,
+        "checks": checks,
+        "statuses": statuses,
+        "legit_p50": statistics.median(legit_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--attempts", type=int, default=500)
+    parser.add_argument("--ips", type=int, default=4)
+    parser.add_argument("--legit-every", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    session_factory = sessionmaker(bind=engine)
+
+    def get_bench_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = get_bench_db
+    password_hasher.workers = 0
+    password_hasher.rounds = args.rounds
+    rate_limiter.store = rate_limiter.memory
+    try:
+        Base.metadata.create_all(bind=engine)
+        db = session_factory()
+        db.add_all([
+            User(email="victim@example.com", username="victim",
+                 hashed_password=password_hasher.hash("victim-password")),
+            User(email="user@example.com", username="user",
+                 hashed_password=password_hasher.hash("user-password")),
+        ])
+        db.commit()
+        db.close()
+
+        print(f"{args.attempts} guesses from {args.ips} IPs, bcrypt rounds {args.rounds}")
+        print(f"{'setup':>9} {'cpu s':>7} {'bcrypt':>7} {'401':>5} {'429':>5} {'legit p50':>10}")
+        for label, enabled in (("unlimited", False), ("limited", True)):
+            rate_limiter.enabled = enabled
+            rate_limiter.clear()
+            result = attack(args.attempts, args.ips, args.legit_every)
+            print(f"{label:>9} {result['cpu']:>7.2f} {result['checks']:>7} "
+                  f"{result['statuses'][401]:>5} {result['statuses'][429]:>5} "
+                  f"{result['legit_p50'] * 1000:>8.0f}ms")
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
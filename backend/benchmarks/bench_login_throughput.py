@@ -0,0 +1,101 @@
+"""
+Login throughput of the password hasher, inline vs a pool of 1, 4 and 8 workers
+
+A burst of --logins password checks is issued from --threads request
+threads (FastAPI runs sync endpoints on a thread pool of 40), like a login
+storm would. For each setup it reports logins per second, the p50/p99
+latency of a login, the logins shed with HasherBusy, and the p99 latency of
+a cheap request (a little pure Python work) served alongside the storm,
+which shows how much the hashing starves the rest of the process.
+
+inline: workers=0, bcrypt on the request threads (the previous behavior)
+pool-N: PasswordHasher with N worker processes
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_login_throughput [--logins 200] [--rounds 12] [--workers 1 4 8]
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.passwords import HasherBusy, PasswordHasher
+
+
+def percentile(samples: list, q: float) -> float:
+    if not samples:
+        return float("nan")
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def probe(stop: threading.Event, latencies: list):
+    """A cheap request every 10 ms while the storm runs"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        sum(i * i for i in range(2000))
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.01)
+
+
+def storm(workers: int, logins: int, threads: int, rounds: int, queue_size: int) -> dict:
+    hasher = PasswordHasher(workers=workers, queue_size=queue_size, rounds=rounds)
+    hashed = PasswordHasher(workers=0, rounds=rounds).hash("correct horse battery staple")
+    # start the worker processes before timing
+    if workers:
+        for future in [hasher._submit(time.sleep, 0) for _ in range(workers)]:
+            future.result()
+
+    latencies, probe_latencies = [], []
+    shed = 0
+
+    def login(_):
+        nonlocal shed
+        started = time.perf_counter()
+        try:
+            hasher.verify("correct horse battery staple", hashed)
+        except HasherBusy:
+            shed += 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+    stop = threading.Event()
+    prober = threading.Thread(target=probe, args=(stop, probe_latencies))
+    prober.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    prober.join()
+    hasher.shutdown()
+
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else float("nan"),
+        "p99": percentile(latencies, 0.99),
+        "shed": shed,
+        "probe_p99": percentile(probe_latencies, 0.99),
+    }
+
+
+def main(logins: int, threads: int, rounds: int, worker_counts, queue_size: int):
+    print(f"{logins} logins from {threads} threads, bcrypt rounds {rounds}, queue size {queue_size}")
+    print(f"{'setup':>8} {'logins/s':>9} {'p50':>9} {'p99':>9} {'shed':>6} {'probe p99':>10}")
+    for workers in [0, *worker_counts]:
+        label = "inline" if workers == 0 else f"pool-{workers}"
+        result = storm(workers, logins, threads, rounds, queue_size)
+        print(f"{label:>8} {result['throughput']:>9.1f} {result['p50'] * 1000:>7.0f}ms "
+              f"{result['p99'] * 1000:>7.0f}ms {result['shed']:>6} {result['probe_p99'] * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--queue-size", type=int, default=1000)
+    args = parser.parse_args()
+    main(args.logins, args.threads, args.rounds, args.workers, args.queue_size)
@@ -0,0 +1,131 @@
+"""
+Per-page latency of room history pagination, OFFSET vs keyset, on SQLite
+
+Seeds one room with --messages rows (1M by default) in a temporary SQLite
+database, then fetches a page at increasing depths into the history:
+
+offset: the legacy page/page_size query, OFFSET plus COUNT(*) over the room
+keyset: fetch_message_page(before_id=...) on the (room_id, id) index
+
+Seeding 1M rows takes a minute or so; the database is deleted afterwards.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_message_pagination [--messages 1000000] [--page-size 50]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import joinedload, sessionmaker
+
+from app.chat.pagination import fetch_message_page
+from app.core.ids import IdGenerator
+from app.database.database import Base
+from app.models.chat import ChatRoom, Message, RoomType
+from app.models.user import User
+
+SEED_BATCH = 50000
+DEPTHS = (0.0, 0.01, 0.1, 0.5, 0.9, 0.99)
+
+
+def seed(session_factory, messages: int) -> list:
+    """Create one room with the given number of messages, returns their ids"""
+    db = session_factory()
+    user = User(email="bench@example.com", username="bench", hashed_password="x")
+    db.add(user)
+    db.flush()
+    room = ChatRoom(name="bench", room_type=RoomType.group, created_by=user.id)
+    room.members.append(user)
+    db.add(room)
+    db.commit()
+
+    generator = IdGenerator(worker_id=0)
+    now = datetime.utcnow()
+    ids = []
+    for start in range(0, messages, SEED_BATCH):
+        rows = []
+        for i in range(start, min(start + SEED_BATCH, messages)):
+            message_id = generator.next_id()
+            ids.append(message_id)
+            rows.append({
+                "id": message_id,
+                "room_id": room.id,
+                "sender_id": user.id,
+                "content": f"message {i}",
+                "timestamp": now,
+                "message_type": "text",
+                "is_edited": False,
+            })
+        db.execute(insert(Message), rows)
+        db.commit()
+    db.close()
+    return ids
+
+
+def offset_page(db, room_id: int, page: int, page_size: int):
+    total = db.query(func.count(Message.id)).filter(Message.room_id == room_id).scalar()
+    messages = db.query(Message).filter(
+        Message.room_id == room_id
+    ).options(
+        joinedload(Message.sender)
+    ).order_by(
+        Message.id.desc()
+    ).offset((page - 1) * page_size).limit(page_size).all()
+    return total, messages
+
+
+def measure(fn, rounds: int) -> float:
+    """Median milliseconds per call"""
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+
+        started = time.perf_counter()
+        ids = seed(session_factory, args.messages)
+        print(f"seeded {args.messages} messages in {time.perf_counter() - started:.1f}s\n")
+
+        db = session_factory()
+        room_id = db.query(ChatRoom.id).scalar()
+        print(f"{'depth':>7} {'messages back':>14} {'offset ms':>10} {'keyset ms':>10}")
+        for depth in DEPTHS:
+            back = int(args.messages * depth)
+            page = back // args.page_size + 1
+            # the message just newer than the requested page is the anchor
+            anchor = ids[len(ids) - (page - 1) * args.page_size] if page > 1 else None
+
+            offset_ms = measure(lambda: offset_page(db, room_id, page, args.page_size), args.rounds)
+            keyset_ms = measure(
+                lambda: fetch_message_page(db, room_id, args.page_size, before_id=anchor),
+                args.rounds
+            )
+            print(f"{depth:>7.0%} {back:>14} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+        db.close()
+        engine.dispose()
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Latency/throughput benchmark for the Redis pub/sub fan-out engine
+
+Two ConnectionManager instances ("nodes") share one in-process fake Redis
+server. Node A broadcasts, node B holds the subscribed sockets, so every
+message crosses the pub/sub path end to end.
+
+Usage (from the backend directory):
+    pip install fakeredis
+    python -m benchmarks.bench_redis_fanout [--messages 5000] [--sockets 10]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import fakeredis
+
+from app.chat.websocket import ConnectionManager
+
+
+class TimingWebSocket:
+    """Fake websocket recording the arrival time of every frame"""
+    
+    def __init__(self):
+        self.arrivals = []
+    
+    async def accept(self, subprotocol=None):
+        pass
+    
+    async def send_text(self, data: str):
+        self.arrivals.append((time.perf_counter(), data))
+
+
+def make_node(server) -> ConnectionManager:
+    return ConnectionManager(
+        redis_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    )
+
+
+async def wait_until(predicate, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while not predicate() and time.perf_counter() < deadline:
+        await asyncio.sleep(0)
+
+
+async def measure_latency(node_a, probe: TimingWebSocket, room_id: int, samples: int):
+    """One message in flight at a time: publish -> delivery on the remote node"""
+    latencies = []
+    for i in range(samples):
+        expected = len(probe.arrivals) + 1
+        sent_at = time.perf_counter()
+        await node_a.broadcast_to_room(room_id, {"type": "message", "seq": i})
+        await wait_until(lambda: len(probe.arrivals) >= expected, timeout=5.0)
+        latencies.append((probe.arrivals[-1][0] - sent_at) * 1e6)
+    return latencies
+
+
+async def measure_throughput(node_a, probe: TimingWebSocket, room_id: int, messages: int):
+    """Publish back to back and wait until the remote node drained everything"""
+    start_count = len(probe.arrivals)
+    started = time.perf_counter()
+    for i in range(messages):
+        await node_a.broadcast_to_room(room_id, {"type": "message", "seq": i})
+    await wait_until(lambda: len(probe.arrivals) - start_count >= messages, timeout=60.0)
+    elapsed = time.perf_counter() - started
+    delivered = len(probe.arrivals) - start_count
+    return delivered, elapsed
+
+
+async def main(messages: int, sockets: int):
+    server = fakeredis.FakeServer()
+    node_a, node_b = make_node(server), make_node(server)
+    room_id = 1
+    
+    remote_sockets = [TimingWebSocket() for _ in range(sockets)]
+    for user_id, ws in enumerate(remote_sockets):
+        await node_b.connect(ws, room_id, user_id)
+    probe = remote_sockets[0]
+    
+    latencies = await measure_latency(node_a, probe, room_id, samples=min(messages, 1000))
+    latencies.sort()
+    print(f"latency (publish -> remote socket), {len(latencies)} samples:")
+    print(f"  p50 {statistics.median(latencies):8.1f} us")
+    print(f"  p99 {latencies[int(len(latencies) * 0.99) - 1]:8.1f} us")
+    print(f"  max {latencies[-1]:8.1f} us")
+    
+    delivered, elapsed = await measure_throughput(node_a, probe, room_id, messages)
+    print(f"throughput: {delivered}/{messages} messages in {elapsed:.3f}s "
+          f"-> {delivered / elapsed:,.0f} msg/s per node "
+          f"({delivered * sockets / elapsed:,.0f} socket writes/s)")
+    print("(the previous polling listener was capped at ~10 msg/s by its 100 ms sleep)")
+    
+    # sanity check: frames arrive intact and in order
+    seqs = [json.loads(data)["seq"] for _, data in probe.arrivals[-delivered:]]
+    assert seqs == sorted(seqs), "messages delivered out of order"
+    
+    await node_a.close()
+    await node_b.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--sockets", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.sockets))
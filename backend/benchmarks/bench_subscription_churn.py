@@ -0,0 +1,98 @@
+"""
+Subscribe/unsubscribe churn of the pub/sub fan-out, per-room vs shard channels
+
+One ConnectionManager node against an in-process fake Redis server joins one
+socket to each of --rooms rooms, then disconnects them all again, for every
+room count in --rooms:
+
+per-room: WS_CHANNEL_SHARDS=0, one chat_room_{id} channel per room
+sharded:  WS_CHANNEL_SHARDS=--shards, rooms hash onto chat_shard_{n}
+
+It reports the wall time of each phase, the Redis SUBSCRIBE/UNSUBSCRIBE
+commands sent and the channels held at peak.
+
+Usage (from the backend directory):
+    pip install fakeredis
+    python -m benchmarks.bench_subscription_churn [--rooms 10000 100000] [--shards 64]
+"""
+import argparse
+import asyncio
+import time
+
+import fakeredis
+
+from app.chat.websocket import ConnectionManager
+
+
+class IdleWebSocket:
+    """Fake websocket that is never written to"""
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+
+class CountingPubSub:
+    """Wraps a pubsub and counts the subscription commands sent to Redis"""
+
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+        self.commands = 0
+
+    async def subscribe(self, *channels):
+        self.commands += 1
+        await self._pubsub.subscribe(*channels)
+
+    async def unsubscribe(self, *channels):
+        self.commands += 1
+        await self._pubsub.unsubscribe(*channels)
+
+    def __getattr__(self, name):
+        return getattr(self._pubsub, name)
+
+
+async def churn(rooms: int, shards: int) -> dict:
+    """Join and leave every room once, returns timings and counters"""
+    server = fakeredis.FakeServer()
+    redis = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    node = ConnectionManager(redis_client=redis, delivery_mode="hybrid", channel_shards=shards)
+    node.pubsub = CountingPubSub(redis.pubsub())
+    sockets = [IdleWebSocket() for _ in range(rooms)]
+
+    started = time.perf_counter()
+    for room_id, ws in enumerate(sockets):
+        await node.connect(ws, room_id, user_id=1)
+    joined = time.perf_counter()
+    peak_channels = len(await redis.pubsub_channels())
+
+    for room_id, ws in enumerate(sockets):
+        await node.disconnect(ws, room_id)
+    left = time.perf_counter()
+
+    commands = node.pubsub.commands
+    await node.close()
+    return {
+        "join": joined - started,
+        "leave": left - joined,
+        "commands": commands,
+        "channels": peak_channels,
+    }
+
+
+async def main(room_counts, shards: int):
+    print(f"{'rooms':>8} {'scheme':>14} {'join':>9} {'leave':>9} {'commands':>9} {'channels':>9}")
+    for rooms in room_counts:
+        for label, shard_count in (("per-room", 0), (f"sharded({shards})", shards)):
+            result = await churn(rooms, shard_count)
+            print(f"{rooms:>8} {label:>14} {result['join']:>8.2f}s {result['leave']:>8.2f}s "
+                  f"{result['commands']:>9} {result['channels']:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rooms", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--shards", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main(args.rooms, args.shards))
@@ -0,0 +1,139 @@
+"""
+Bytes on the wire and CPU per frame of the WebSocket wire formats
+
+json:          the JSON text frames of chat.json.v1 (one Frame per broadcast)
+json+deflate:  the same frames through permessage-deflate as negotiated by
+               browsers (raw deflate, 15 bit window, context takeover), with
+               the compression context of a socket in one room
+msgpack:       chat.msgpack.v1, short field tags and integer timestamps
+msgpack+deflate: both
+
+The message mix is generated from --seed: mostly chat messages of varying
+length, typing snapshots and presence changes in --rooms rooms. Bytes are
+per frame as sent (before TLS and framing); CPU is the encode cost once per
+broadcast plus the compression cost per recipient socket.
+
+Usage (from the backend directory):
+    pip install msgpack
+    python -m benchmarks.bench_wire_formats [--frames 20000] [--rooms 20] [--recipients 50]
+"""
+import argparse
+import random
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from app.chat.frames import Frame
+
+WORDS = (
+    "ok thanks meeting moved to tomorrow please check the deploy logs sounds good "
+    "lunch at noon can you review my pull request the build is green again ship it "
+    "numbers look off in the quarterly report"
+).split()
+
+
+def message_mix(count: int, rooms: int, seed: int) -> list:
+    """Chat messages (80%), typing snapshots (15%) and presence changes (5%)"""
+    rng = random.Random(seed)
+    users = [(user_id, f"user_{user_id:04d}") for user_id in range(1, 200)]
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    messages = []
+    for n in range(count):
+        room_id = rng.randint(1, rooms)
+        now += timedelta(milliseconds=rng.randint(1, 5000), microseconds=rng.randint(0, 999))
+        kind = rng.random()
+        if kind < 0.8:
+            user_id, username = rng.choice(users)
+            messages.append({
+                "type": "message",
+                "data": {
+                    "id": 7000000000000000000 + n * 4096,
+                    "room_id": room_id,
+                    "sender_id": user_id,
+                    "sender_username": username,
+                    "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 30))),
+                    "timestamp": now.isoformat(),
+                    "is_edited": False,
+                    "message_type": "text",
+                },
+            })
+        elif kind < 0.95:
+            typing = rng.sample(users, rng.randint(0, 3))
+            messages.append({
+                "type": "typing",
+                "room_id": room_id,
+                "node": "chat-7-1234-ab12cd34",
+                "users": [{"user_id": u, "username": name} for u, name in typing],
+            })
+        else:
+            messages.append({
+                "type": "presence",
+                "room_id": room_id,
+                "changes": [{"user_id": rng.choice(users)[0], "is_online": rng.random() < 0.5}],
+            })
+    return messages
+
+
+def deflate_sizes(payloads: list, room_ids: list) -> tuple:
+    """
+    Compress frames as permessage-deflate would, returns (bytes, seconds)
+
+    A socket only sees the frames of its room, so each room gets its own
+    compression context.
+    """
+    compressors = {}
+    total = 0
+    started = time.perf_counter()
+    for payload, room_id in zip(payloads, room_ids):
+        compressor = compressors.get(room_id)
+        if compressor is None:
+            compressor = compressors[room_id] = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15
+            )
+        data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        # the trailing empty block is stripped from every message (RFC 7692)
+        total += len(data) - 4
+    return total, time.perf_counter() - started
+
+
+def main(frames: int, rooms: int, recipients: int, seed: int):
+    messages = message_mix(frames, rooms, seed)
+
+    started = time.perf_counter()
+    json_frames = [Frame.from_message(message) for message in messages]
+    json_encode = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compact = [frame.compact for frame in json_frames]
+    compact_encode = time.perf_counter() - started
+
+    room_ids = [message.get("room_id") or message["data"]["room_id"] for message in messages]
+    json_payloads = [frame.data for frame in json_frames]
+    json_bytes = sum(map(len, json_payloads))
+    compact_bytes = sum(map(len, compact))
+    json_deflated, json_deflate_time = deflate_sizes(json_payloads, room_ids)
+    compact_deflated, compact_deflate_time = deflate_sizes(compact, room_ids)
+
+    # compression runs per socket, encoding once per broadcast
+    rows = (
+        ("json", json_bytes, json_encode),
+        ("json+deflate", json_deflated, json_encode + json_deflate_time * recipients),
+        ("msgpack", compact_bytes, json_encode + compact_encode),
+        ("msgpack+deflate", compact_deflated,
+         json_encode + compact_encode + compact_deflate_time * recipients),
+    )
+    print(f"{frames} frames, {rooms} rooms, {recipients} recipients per broadcast")
+    print(f"{'format':>16} {'bytes/frame':>12} {'vs json':>8} {'cpu us/broadcast':>17}")
+    for label, size, seconds in rows:
+        print(f"{label:>16} {size / frames:>12.1f} {size / json_bytes:>7.0%} "
+              f"{seconds / frames * 1e6:>17.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--recipients", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    main(args.frames, args.rooms, args.recipients, args.seed)
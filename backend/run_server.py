@@ -1,5 +1,6 @@
 import uvicorn
 from app.main import app
+from app.core.config import settings
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -7,5 +8,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
+        ws_per_message_deflate=settings.WS_PER_MESSAGE_DEFLATE,
         log_level="info"
     )
\ No newline at end of file
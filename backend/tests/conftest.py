@@ -1,12 +1,34 @@
+import asyncio
+import json
 import pytest
+from fastapi import WebSocketDisconnect
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from unittest.mock import Mock
 from app.main import app
-from app.database.database import get_db, Base
+from app.database.database import get_db, get_async_db, Base
 from app.database.redis_client import get_redis
+from app.chat.persistence import message_writer
+from app.core import ids
+from app.core.ids import IdGenerator
+from app.chat import ws_routes
+from app.chat.idempotency import ClientMessageIds
+from app.chat.websocket import ConnectionManager
+from app.chat.presence import PresenceService
+from app.chat.membership import membership_cache
+from app.auth.principal import principal_cache
+from app.chat.recent import recent_messages
+from app.chat.presence import presence
+from app.core.passwords import password_hasher
+from app.core.tokens import token_verifier
+from app.auth.revocation import MemoryDenylist, token_revocation
+from app.core.rate_limit import rate_limiter
+from app.core.security import get_password_hash
 from app.models import User, PasswordResetToken
+from app.models.chat import ChatRoom, RoomType
 
 # Use in-memory SQLite for testing
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -16,6 +38,10 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# every TestClient runs its own event loop, so async connections are not pooled
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 def override_get_db():
     try:
@@ -25,6 +51,11 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
 # Mock Redis for testing
 def override_get_redis():
     mock_redis = Mock()
@@ -35,12 +66,33 @@ def override_get_redis():
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 app.dependency_overrides[get_redis] = override_get_redis
 
+# message ids from a fixed worker id, there is no redis to lease one from
+ids.message_id_generator = IdGenerator(worker_id=0)
+# write-behind message persistence goes to the test database too
+message_writer.session_factory = TestingSessionLocal
+ws_routes.session_factory = TestingAsyncSessionLocal
+presence.session_factory = TestingAsyncSessionLocal
+# hash on the calling thread, forking pool workers from the test process is slow
+password_hasher.workers = 0
+# revoked tokens are kept in this process instead of redis
+token_revocation.store = MemoryDenylist()
+rate_limiter.store = rate_limiter.memory
+
 
 @pytest.fixture
 def client():
     Base.metadata.create_all(bind=engine)
+    # ids are reused once the tables are recreated
+    membership_cache.clear()
+    principal_cache.clear()
+    token_verifier.clear()
+    token_revocation.clear()
+    rate_limiter.clear()
+    recent_messages.clear()
+    presence.clear()
     with TestClient(app) as c:
         yield c
     Base.metadata.drop_all(bind=engine)
@@ -49,9 +101,137 @@ def client():
 @pytest.fixture
 def db_session():
     Base.metadata.create_all(bind=engine)
+    membership_cache.clear()
+    principal_cache.clear()
+    token_verifier.clear()
+    token_revocation.clear()
+    rate_limiter.clear()
+    recent_messages.clear()
+    presence.clear()
     db = TestingSessionLocal()
     try:
         yield db
     finally:
         db.close()
-        Base.metadata.drop_all(bind=engine)
\ No newline at end of file
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def test_user(db_session):
+    """Create a test user"""
+    user = User(
+        email="testuser@example.com",
+        username="testuser",
+        hashed_password=get_password_hash("testpassword123")
+    )
+    db_session.add(user)
+    db_session.commit()
+    db_session.refresh(user)
+    return user
+
+
+@pytest.fixture
+def test_user2(db_session):
+    """Create a second test user"""
+    user = User(
+        email="testuser2@example.com",
+        username="testuser2",
+        hashed_password=get_password_hash("testpassword123")
+    )
+    db_session.add(user)
+    db_session.commit()
+    db_session.refresh(user)
+    return user
+
+
+@pytest.fixture
+def test_room(db_session, test_user, test_user2):
+    """Create a test chat room with two members"""
+    room = ChatRoom(
+        name="Test Room",
+        room_type=RoomType.group,
+        created_by=test_user.id
+    )
+    room.members.append(test_user)
+    room.members.append(test_user2)
+    db_session.add(room)
+    db_session.commit()
+    db_session.refresh(room)
+    return room
+
+
+class IdleWebSocket:
+    """A connected client that sends nothing until it hangs up"""
+    
+    def __init__(self):
+        self.hang_up = asyncio.Event()
+        self.closed_with = None
+    
+    async def accept(self, subprotocol=None):
+        pass
+    
+    async def send_text(self, data: str):
+        pass
+    
+    async def receive_text(self) -> str:
+        await self.hang_up.wait()
+        raise WebSocketDisconnect()
+    
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+class ScriptedWebSocket(IdleWebSocket):
+    """A client that sends the given frames, then hangs up when told to"""
+    
+    def __init__(self, frames):
+        super().__init__()
+        self.frames = list(frames)
+        self.sent = []
+    
+    async def send_text(self, data: str):
+        self.sent.append(json.loads(data))
+    
+    async def receive_text(self) -> str:
+        if self.frames:
+            return json.dumps(self.frames.pop(0))
+        return await super().receive_text()
+
+
+@pytest.fixture
+def sockets(monkeypatch):
+    """Local fan-out, presence and idempotency keys on a fake redis"""
+    fakeredis = pytest.importorskip("fakeredis")
+    redis = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(ws_routes, "manager", ConnectionManager(redis_client=redis, delivery_mode="local"))
+    monkeypatch.setattr(ws_routes, "presence", PresenceService(
+        redis_client=redis, session_factory=TestingAsyncSessionLocal
+    ))
+    monkeypatch.setattr(ws_routes, "client_message_ids", ClientMessageIds(redis_client=redis))
+    return ws_routes.manager
+
+
+@pytest.fixture
+def converse(sockets):
+    """
+    Run a chat socket sending frames until it received expected frames
+
+    The message writer is stopped afterwards, so no row is left buffered
+    for the next test.
+    """
+    async def run(room_id: int, token: str, frames: list, expected: int) -> list:
+        ws = ScriptedWebSocket(frames)
+        task = asyncio.create_task(ws_routes.websocket_chat_endpoint(ws, room_id, token, last_seen_id=None))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 5
+        try:
+            while len(ws.sent) < expected:
+                assert loop.time() < deadline, ws.sent
+                await asyncio.sleep(0.01)
+        finally:
+            ws.hang_up.set()
+            await task
+            await message_writer.stop()
+        return ws.sent
+
+    return run
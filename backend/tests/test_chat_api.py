@@ -1,8 +1,10 @@
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from app.models.user import User
 from app.models.chat import ChatRoom, Message, RoomType
 from app.core.security import get_password_hash
+from tests.conftest import async_engine
 
 
 def create_test_user(db_session, email, username, password="testpass123"):
@@ -146,7 +148,52 @@ class TestChatRoomAPI:
         data = response.json()
         assert len(data) == 1
         assert data[0]["id"] == room.id
-    
+
+    def test_list_user_rooms_last_message(self, client, db_session):
+        """Test each listed room carries its newest message, without loading histories"""
+        user1 = create_test_user(db_session, "user1@test.com", "user1")
+        user2 = create_test_user(db_session, "user2@test.com", "user2")
+
+        rooms = []
+        for i in range(5):
+            room = ChatRoom(name=f"Room {i}", room_type=RoomType.group, created_by=user1.id)
+            room.members.extend([user1, user2])
+            rooms.append(room)
+        db_session.add_all(rooms)
+        db_session.commit()
+
+        # every room but the last gets a few messages, the newest from user2
+        for room in rooms[:-1]:
+            for j in range(3):
+                db_session.add(Message(room_id=room.id, sender_id=user1.id, content=f"{room.name} message {j}"))
+                db_session.commit()
+            db_session.add(Message(room_id=room.id, sender_id=user2.id, content=f"{room.name} latest"))
+            db_session.commit()
+
+        token = get_auth_token(client, "user1@test.com")
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+        try:
+            response = client.get(
+                "/api/v1/chat/rooms",
+                headers={"Authorization": f"Bearer {token}"}
+            )
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+        assert response.status_code == 200
+        data = {room["name"]: room for room in response.json()}
+        for room in rooms[:-1]:
+            last_message = data[room.name]["last_message"]
+            assert last_message["content"] == f"{room.name} latest"
+            assert last_message["sender_username"] == "user2"
+            assert len(data[room.name]["members"]) == 2
+        assert data[rooms[-1].name]["last_message"] is None
+
+        # user lookup, rooms, members and last messages - not one query per room
+        assert 0 < len(statements) <= 4
+
     def test_get_room_details(self, client, db_session):
         """Test getting chat room details"""
         # Create users
@@ -367,6 +414,84 @@ class TestMessageAPI:
         
         assert response.status_code == 403
 
+    def test_get_messages_with_cursor(self, client, db_session):
+        """Test walking message history backwards and forwards with cursors"""
+        user1 = create_test_user(db_session, "user1@test.com", "user1")
+        room = ChatRoom(name="Test Room", room_type=RoomType.group, created_by=user1.id)
+        room.members.append(user1)
+        db_session.add(room)
+        db_session.commit()
+        db_session.refresh(room)
+
+        for i in range(25):
+            db_session.add(Message(room_id=room.id, sender_id=user1.id, content=f"Message {i}"))
+        db_session.commit()
+
+        headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+        url = f"/api/v1/chat/rooms/{room.id}/messages"
+
+        # newest page first, no total unless asked for
+        data = client.get(url, params={"page_size": 10}, headers=headers).json()
+        assert [m["content"] for m in data["messages"]] == [f"Message {i}" for i in range(15, 25)]
+        assert data["total"] is None
+        assert data["has_more"] is True
+        assert data["has_newer"] is False
+
+        data = client.get(url, params={"page_size": 10, "cursor": data["next_cursor"]}, headers=headers).json()
+        assert [m["content"] for m in data["messages"]] == [f"Message {i}" for i in range(5, 15)]
+
+        data = client.get(url, params={"page_size": 10, "cursor": data["next_cursor"]}, headers=headers).json()
+        assert [m["content"] for m in data["messages"]] == [f"Message {i}" for i in range(5)]
+        assert data["has_more"] is False
+        assert data["next_cursor"] is None
+
+        # and forwards again from the oldest page
+        data = client.get(url, params={"page_size": 10, "cursor": data["prev_cursor"]}, headers=headers).json()
+        assert [m["content"] for m in data["messages"]] == [f"Message {i}" for i in range(5, 15)]
+        assert data["has_more"] is True
+        assert data["has_newer"] is True
+
+    def test_get_messages_around_id(self, client, db_session):
+        """Test fetching the context of a message, with an exact total on request"""
+        user1 = create_test_user(db_session, "user1@test.com", "user1")
+        room = ChatRoom(name="Test Room", room_type=RoomType.group, created_by=user1.id)
+        room.members.append(user1)
+        db_session.add(room)
+        db_session.commit()
+        db_session.refresh(room)
+
+        messages = [Message(room_id=room.id, sender_id=user1.id, content=f"Message {i}") for i in range(20)]
+        db_session.add_all(messages)
+        db_session.commit()
+
+        headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+        response = client.get(
+            f"/api/v1/chat/rooms/{room.id}/messages",
+            params={"around_id": messages[10].id, "page_size": 6, "include_total": True},
+            headers=headers
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert [m["content"] for m in data["messages"]] == [f"Message {i}" for i in range(8, 14)]
+        assert data["total"] == 20
+        assert data["has_more"] is True
+        assert data["has_newer"] is True
+
+    def test_get_messages_invalid_cursor(self, client, db_session):
+        """Test malformed cursors and conflicting anchors are rejected"""
+        user1 = create_test_user(db_session, "user1@test.com", "user1")
+        room = ChatRoom(name="Test Room", room_type=RoomType.group, created_by=user1.id)
+        room.members.append(user1)
+        db_session.add(room)
+        db_session.commit()
+
+        headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+        url = f"/api/v1/chat/rooms/{room.id}/messages"
+
+        assert client.get(url, params={"cursor": "not-a-cursor"}, headers=headers).status_code == 400
+        assert client.get(url, params={"before_id": 5, "after_id": 1}, headers=headers).status_code == 400
+
 
 class TestAPIAuthentication:
     """Test API authentication requirements"""
@@ -0,0 +1,127 @@
+"""
+Tests for cluster mode room routing across several nodes
+"""
+import asyncio
+import json
+import pytest
+from app.chat.websocket import ConnectionManager
+from tests.test_connection_manager import FakeWebSocket, subscriber_count, wait_for
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def make_node(server, node_id: str) -> ConnectionManager:
+    """Create a cluster mode node backed by a shared fake redis server"""
+    return ConnectionManager(
+        redis_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+        node_id=node_id,
+        delivery_mode="cluster"
+    )
+
+
+async def registered_nodes(server, room_id: int) -> set:
+    """Nodes listed in the registry of a room"""
+    client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    return await client.smembers(ConnectionManager.room_nodes_key(room_id))
+
+
+def test_purely_local_room_skips_redis():
+    """Test a room nobody else serves is never published"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        node_a, node_b = make_node(server, "a"), make_node(server, "b")
+        ws = FakeWebSocket()
+        await node_a.connect(ws, 1, user_id=1)
+        await node_b.connect(FakeWebSocket(), 2, user_id=2)
+
+        await node_a.broadcast_to_room(1, {"type": "message", "content": "hi"})
+        await node_a.broadcast_to_room(1, {"type": "message", "content": "again"})
+
+        assert await wait_for(lambda: len(ws.sent) == 2)
+        assert node_a.get_metrics()["skipped_publishes"] == 2
+        # node b only subscribed to the room it serves
+        assert node_b.subscribed_rooms == {2}
+        await node_a.close()
+        await node_b.close()
+
+    asyncio.run(scenario())
+
+
+def test_cross_node_delivery_to_interested_nodes():
+    """Test a broadcast reaches every node with sockets in the room, once"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        node_a, node_b, node_c = (make_node(server, n) for n in ("a", "b", "c"))
+        local, remote_b, remote_c = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        other_room = FakeWebSocket()
+        await node_a.connect(local, 5, user_id=1)
+        await node_b.connect(remote_b, 5, user_id=2)
+        await node_c.connect(remote_c, 5, user_id=3)
+        await node_c.connect(other_room, 6, user_id=3)
+
+        assert await registered_nodes(server, 5) == {"a", "b", "c"}
+
+        await node_a.broadcast_to_room(5, {"type": "message", "content": "hello"})
+
+        assert await wait_for(lambda: len(remote_b.sent) == 1 and len(remote_c.sent) == 1)
+        # no echo on the publishing node, nothing for the other room
+        await wait_for(lambda: len(local.sent) > 1, timeout=0.1)
+        assert len(local.sent) == 1
+        assert other_room.sent == []
+        assert json.loads(remote_c.sent[0])["content"] == "hello"
+        assert node_a.get_metrics()["skipped_publishes"] == 0
+        for node in (node_a, node_b, node_c):
+            await node.close()
+
+    asyncio.run(scenario())
+
+
+def test_node_without_sockets_publishes_to_serving_node():
+    """Test a node that only publishes (e.g. HTTP sends) routes via the registry"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        api_node, ws_node = make_node(server, "api"), make_node(server, "ws")
+        remote = FakeWebSocket()
+        await ws_node.connect(remote, 9, user_id=1)
+
+        await api_node.broadcast_to_room(9, {"type": "message", "content": "from api"})
+
+        assert await wait_for(lambda: len(remote.sent) == 1)
+        assert api_node.subscribed_rooms == set()
+        await api_node.close()
+        await ws_node.close()
+
+    asyncio.run(scenario())
+
+
+def test_subscription_churn_updates_interest():
+    """Test joins and leaves on other nodes start and stop publishing"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        node_a, node_b = make_node(server, "a"), make_node(server, "b")
+        await node_a.connect(FakeWebSocket(), 3, user_id=1)
+
+        await node_a.broadcast_to_room(3, {"type": "message", "content": "alone"})
+        assert node_a.get_metrics()["skipped_publishes"] == 1
+
+        # node b joins, node a learns it from the cluster channel
+        remote = FakeWebSocket()
+        await node_b.connect(remote, 3, user_id=2)
+        assert await wait_for(lambda: node_a.remote_interest.get(3) == {"b"})
+        await node_a.broadcast_to_room(3, {"type": "message", "content": "together"})
+        assert await wait_for(lambda: len(remote.sent) == 1)
+
+        # node b leaves, the room is purely local again
+        await node_b.disconnect(remote, 3)
+        assert await wait_for(lambda: node_a.remote_interest.get(3) == set())
+        assert await registered_nodes(server, 3) == {"a"}
+        assert await subscriber_count(server, "chat_room_3") == 1
+        await node_a.broadcast_to_room(3, {"type": "message", "content": "alone again"})
+        assert node_a.get_metrics()["skipped_publishes"] == 2
+
+        # shutting down leaves the registry
+        await node_a.close()
+        assert await registered_nodes(server, 3) == set()
+        await node_b.close()
+
+    asyncio.run(scenario())
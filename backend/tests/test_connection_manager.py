@@ -0,0 +1,469 @@
+"""
+Tests for the WebSocket ConnectionManager fan-out engine
+"""
+import asyncio
+import json
+import pytest
+from app.chat.frames import Frame
+from app.chat.recent import RecentMessagesCache
+from app.chat.websocket import ConnectionManager, pack_envelope, unpack_envelope
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FakeWebSocket:
+    """Minimal stand-in for a starlette WebSocket that records sent frames"""
+    
+    def __init__(self):
+        self.accepted = False
+        self.closed_with = None
+        self.sent = []
+    
+    async def accept(self, subprotocol=None):
+        self.accepted = True
+    
+    async def send_text(self, data: str):
+        self.sent.append(data)
+    
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+    
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+class StalledWebSocket(FakeWebSocket):
+    """A client whose network never drains until released"""
+    
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+    
+    async def send_text(self, data: str):
+        await self.release.wait()
+        self.sent.append(data)
+
+
+async def subscriber_count(server, channel: str) -> int:
+    """Number of redis subscribers on a channel"""
+    client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    [(_, count)] = await client.pubsub_numsub(channel)
+    return count
+
+
+def make_manager(server, delivery_mode: str = "hybrid") -> ConnectionManager:
+    """Create a manager backed by a shared fake redis server"""
+    return ConnectionManager(
+        redis_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+        delivery_mode=delivery_mode
+    )
+
+
+async def wait_for(predicate, timeout: float = 1.0):
+    """Wait until predicate() is true or the timeout expires"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate() and loop.time() < deadline:
+        await asyncio.sleep(0.005)
+    return predicate()
+
+
+def test_subscribes_once_per_room():
+    """Test the room channel is subscribed once, however many sockets join"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        manager = make_manager(server)
+        ws1, ws2 = FakeWebSocket(), FakeWebSocket()
+        
+        await manager.connect(ws1, 1, user_id=1)
+        await manager.connect(ws2, 1, user_id=2)
+        
+        assert ws1.accepted and ws2.accepted
+        assert manager.subscribed_rooms == {1}
+        assert await subscriber_count(server, "chat_room_1") == 1
+        await manager.close()
+    
+    asyncio.run(scenario())
+
+
+def test_unsubscribes_when_room_empties():
+    """Test the room channel is dropped when the last local socket leaves"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        manager = make_manager(server)
+        ws1, ws2 = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(ws1, 1, user_id=1)
+        await manager.connect(ws2, 2, user_id=2)
+        
+        await manager.disconnect(ws1, 1)
+        
+        assert manager.subscribed_rooms == {2}
+        assert await subscriber_count(server, "chat_room_1") == 0
+        assert await subscriber_count(server, "chat_room_2") == 1
+        await manager.close()
+    
+    asyncio.run(scenario())
+
+
+def test_cross_node_delivery():
+    """Test a broadcast on one node reaches sockets held by another node"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        node_a, node_b = make_manager(server), make_manager(server)
+        remote = FakeWebSocket()
+        await node_b.connect(remote, 7, user_id=2)
+        
+        await node_a.broadcast_to_room(7, {"type": "message", "content": "hi"})
+        
+        assert await wait_for(lambda: len(remote.sent) == 1)
+        assert json.loads(remote.sent[0])["content"] == "hi"
+        await node_a.close()
+        await node_b.close()
+    
+    asyncio.run(scenario())
+
+
+def test_envelope_round_trip():
+    """Test the envelope keeps node id, room id and payload intact"""
+    payload = json.dumps({"type": "message", "content": "a|b|c é"})
+    encoded = payload.encode("utf-8")
+    
+    assert unpack_envelope(pack_envelope("node-1", 42, encoded)) == ("node-1", 42, None, payload)
+    assert unpack_envelope(pack_envelope("node-1", 42, encoded, "typing:42:1").decode()) == (
+        "node-1", 42, "typing:42:1", payload
+    )
+
+
+async def broadcast_and_count(delivery_mode: str):
+    """Broadcast once from node A and count the frames each socket received"""
+    server = fakeredis.FakeServer()
+    node_a = make_manager(server, delivery_mode)
+    node_b = make_manager(server, delivery_mode)
+    local, remote = FakeWebSocket(), FakeWebSocket()
+    await node_a.connect(local, 3, user_id=1)
+    await node_b.connect(remote, 3, user_id=2)
+    
+    await node_a.broadcast_to_room(3, {"type": "message", "content": "hello"})
+    
+    # give the pub/sub listeners time to deliver any (duplicate) echoes
+    await wait_for(lambda: len(local.sent) > 1 and len(remote.sent) > 0, timeout=0.2)
+    await node_a.close()
+    await node_b.close()
+    return len(local.sent), len(remote.sent)
+
+
+@pytest.mark.parametrize("delivery_mode, expected", [
+    ("hybrid", (1, 1)),
+    ("redis", (1, 1)),
+    ("local", (1, 0)),
+])
+def test_delivery_mode_send_counts(delivery_mode, expected):
+    """Test each delivery mode writes every message exactly once per reachable socket"""
+    assert asyncio.run(broadcast_and_count(delivery_mode)) == expected
+
+
+def test_redis_mode_falls_back_to_local_when_publish_fails():
+    """Test local sockets still get the message when redis is unavailable"""
+    async def scenario():
+        manager = make_manager(fakeredis.FakeServer(), "redis")
+        ws = FakeWebSocket()
+        await manager.connect(ws, 1, user_id=1)
+        
+        async def failing_publish(*args, **kwargs):
+            raise ConnectionError("redis down")
+        manager.redis.publish = failing_publish
+        
+        await manager.broadcast_to_room(1, {"type": "message"})
+        
+        assert await wait_for(lambda: len(ws.sent) == 1)
+        await manager.close()
+    
+    asyncio.run(scenario())
+
+
+def test_slow_consumer_does_not_block_room():
+    """Test a stalled client does not delay delivery to the rest of the room"""
+    async def scenario():
+        manager = make_manager(fakeredis.FakeServer(), "local")
+        stalled, healthy = StalledWebSocket(), FakeWebSocket()
+        await manager.connect(stalled, 1, user_id=1)
+        await manager.connect(healthy, 1, user_id=2)
+        
+        for i in range(5):
+            await manager.broadcast_to_room(1, {"type": "message", "seq": i})
+        
+        assert await wait_for(lambda: len(healthy.sent) == 5)
+        assert stalled.sent == []
+        
+        stalled.release.set()
+        assert await wait_for(lambda: len(stalled.sent) == 5)
+        await manager.close()
+    
+    asyncio.run(scenario())
+
+
+def test_drop_oldest_policy_keeps_newest_frames():
+    """Test a full queue evicts its oldest frames and counts them as dropped"""
+    async def scenario():
+        manager = ConnectionManager(
+            redis_client=fakeredis.FakeAsyncRedis(),
+            delivery_mode="local",
+            send_queue_size=3,
+            backpressure_policy="drop_oldest"
+        )
+        ws = StalledWebSocket()
+        await manager.connect(ws, 1, user_id=1)
+        # let the writer pick up the first frame and block on the network
+        await manager.broadcast_to_room(1, {"type": "message", "seq": 0})
+        await asyncio.sleep(0.01)
+        
+        for i in range(1, 6):
+            await manager.broadcast_to_room(1, {"type": "message", "seq": i})
+        
+        metrics = manager.get_metrics()
+        assert metrics["queue_depth_max"] == 3
+        assert metrics["dropped_frames"] == 2
+        
+        ws.release.set()
+        assert await wait_for(lambda: len(ws.sent) == 4)
+        assert [json.loads(frame)["seq"] for frame in ws.sent] == [0, 3, 4, 5]
+        await manager.close()
+    
+    asyncio.run(scenario())
+
+
+def test_coalesce_typing_policy_replaces_queued_typing_state():
+    """Test queued typing frames for the same user are replaced, not stacked"""
+    async def scenario():
+        manager = ConnectionManager(
+            redis_client=fakeredis.FakeAsyncRedis(),
+            delivery_mode="local",
+            backpressure_policy="coalesce_typing"
+        )
+        ws = StalledWebSocket()
+        await manager.connect(ws, 1, user_id=1)
+        await manager.broadcast_to_room(1, {"type": "message", "seq": 0})
+        await asyncio.sleep(0.01)
+        
+        for is_typing in (True, False, True):
+            await manager.broadcast_to_room(
+                1, {"type": "typing", "user_id": 2, "is_typing": is_typing}
+            )
+        
+        assert manager.get_metrics()["coalesced_frames"] == 2
+        ws.release.set()
+        assert await wait_for(lambda: len(ws.sent) == 2)
+        assert json.loads(ws.sent[1])["is_typing"] is True
+        await manager.close()
+    
+    asyncio.run(scenario())
+
+
+def test_disconnect_policy_cuts_off_slow_consumer():
+    """Test a consumer that keeps overflowing its queue gets disconnected"""
+    async def scenario():
+        manager = ConnectionManager(
+            redis_client=fakeredis.FakeAsyncRedis(),
+            delivery_mode="local",
+            send_queue_size=2,
+            backpressure_policy="disconnect",
+            slow_consumer_threshold=3
+        )
+        stalled, healthy = StalledWebSocket(), FakeWebSocket()
+        await manager.connect(stalled, 1, user_id=1)
+        await manager.connect(healthy, 1, user_id=2)
+        
+        for i in range(10):
+            await manager.broadcast_to_room(1, {"type": "message", "seq": i})
+            # let the healthy writer drain between messages
+            await asyncio.sleep(0)
+        
+        assert await wait_for(lambda: stalled not in manager.connections)
+        assert stalled.closed_with == 1013
+        assert manager.get_metrics()["slow_consumer_disconnects"] == 1
+        assert await wait_for(lambda: len(healthy.sent) == 10)
+        await manager.close()
+    
+    asyncio.run(scenario())
+
+
+def test_broadcast_serializes_once_for_all_recipients():
+    """Test every binary recipient is handed the very same encoded frame"""
+    async def scenario():
+        manager = make_manager(fakeredis.FakeServer(), "local")
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for user_id, ws in enumerate(sockets):
+            await manager.connect(ws, 1, user_id=user_id, binary=True)
+        
+        await manager.broadcast_to_room(1, {"type": "message", "content": "héllo"})
+        
+        assert await wait_for(lambda: all(len(ws.sent) == 1 for ws in sockets))
+        frames = [ws.sent[0] for ws in sockets]
+        assert all(frame is frames[0] for frame in frames)
+        assert json.loads(frames[0])["content"] == "héllo"
+        await manager.close()
+    
+    asyncio.run(scenario())
+
+
+def test_frames_are_utf8_encoded_once():
+    """Test non-ASCII content is not escaped and text and bytes forms agree"""
+    frame = Frame.from_message({"type": "message", "content": "会议改到三点 👋"})
+    
+    assert "会议" in frame.text
+    assert frame.data == frame.text.encode("utf-8")
+    assert json.loads(frame.data)["content"] == "会议改到三点 👋"
+    # not valid unicode, escaped rather than failing the broadcast
+    assert json.loads(Frame.from_message({"content": "\ud800"}).text)["content"] == "\ud800"
+
+
+def test_broadcasts_keep_recent_tail_current():
+    """Test local and remote chat messages reach a cached room tail once"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        recent = RecentMessagesCache(window=5, max_rooms=10)
+        node_a = make_manager(server)
+        node_b = ConnectionManager(
+            redis_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+            delivery_mode="hybrid",
+            recent_cache=recent
+        )
+        recent.get(7, lambda limit: [])
+        await node_b.connect(FakeWebSocket(), 7, user_id=2)
+        
+        await node_b.broadcast_to_room(7, {"type": "message", "data": {"id": 1, "content": "local"}})
+        await node_a.broadcast_to_room(7, {"type": "message", "data": {"id": 2, "content": "remote"}})
+        await node_a.broadcast_to_room(7, {"type": "typing", "user_id": 1, "is_typing": True})
+        
+        assert await wait_for(lambda: len(recent.get(7, None)) == 2)
+        await asyncio.sleep(0.05)
+        assert [m["content"] for m in recent.get(7, None)] == ["local", "remote"]
+        await node_a.close()
+        await node_b.close()
+    
+    asyncio.run(scenario())
+
+
+def test_unsubscribing_drops_recent_tail():
+    """Test a room's tail is forgotten once its messages stop arriving here"""
+    async def scenario():
+        recent = RecentMessagesCache(window=5, max_rooms=10)
+        node = ConnectionManager(
+            redis_client=fakeredis.FakeAsyncRedis(),
+            delivery_mode="hybrid",
+            recent_cache=recent
+        )
+        ws = FakeWebSocket()
+        await node.connect(ws, 7, user_id=2)
+        recent.get(7, lambda limit: [])
+        
+        await node.disconnect(ws, 7)
+        
+        assert 7 not in recent
+        await node.close()
+    
+    asyncio.run(scenario())
+
+
+def test_sharded_channels_are_reference_counted():
+    """Test rooms on the same shard share one subscription until the last leaves"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        node = ConnectionManager(
+            redis_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+            channel_shards=4
+        )
+        ws1, ws5, ws2 = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await node.connect(ws1, 1, user_id=1)
+        await node.connect(ws5, 5, user_id=1)
+        await node.connect(ws2, 2, user_id=1)
+        
+        assert node.get_metrics()["subscribed_channels"] == 2
+        assert await subscriber_count(server, "chat_shard_1") == 1
+        
+        await node.disconnect(ws1, 1)
+        assert await subscriber_count(server, "chat_shard_1") == 1
+        await node.disconnect(ws5, 5)
+        assert await subscriber_count(server, "chat_shard_1") == 0
+        assert await subscriber_count(server, "chat_shard_2") == 1
+        await node.close()
+    
+    asyncio.run(scenario())
+
+
+def test_sharded_delivery_demultiplexes_by_room():
+    """Test a node only delivers the rooms it serves from a shared shard channel"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        node_a, node_b = (
+            ConnectionManager(
+                redis_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+                channel_shards=4
+            )
+            for _ in range(2)
+        )
+        remote = FakeWebSocket()
+        await node_b.connect(remote, 1, user_id=2)
+        
+        await node_a.broadcast_to_room(5, {"type": "message", "content": "room 5"})
+        await node_a.broadcast_to_room(1, {"type": "message", "content": "room 1"})
+        
+        assert await wait_for(lambda: len(remote.sent) == 1)
+        await wait_for(lambda: len(remote.sent) > 1, timeout=0.1)
+        assert [json.loads(frame)["content"] for frame in remote.sent] == ["room 1"]
+        await node_a.close()
+        await node_b.close()
+    
+    asyncio.run(scenario())
+
+
+def test_one_socket_multiplexes_many_rooms():
+    """Test a socket in 50 rooms has one connection and receives each room's frames"""
+    async def scenario():
+        node = ConnectionManager(redis_client=fakeredis.FakeAsyncRedis(), delivery_mode="local")
+        ws = FakeWebSocket()
+        await node.connect_rooms(ws, range(1, 51), user_id=1)
+        
+        assert len(node.connections) == 1
+        assert len(node.active_connections) == 50
+        await node.broadcast_to_room(7, {"type": "message", "room_id": 7})
+        await node.broadcast_to_room(42, {"type": "message", "room_id": 42})
+        assert await wait_for(lambda: len(ws.sent) == 2)
+        assert [json.loads(frame)["room_id"] for frame in ws.sent] == [7, 42]
+        
+        # leaving a room keeps the socket open for the others
+        await node.leave_room(ws, 7)
+        assert 7 not in node.active_connections and ws.closed_with is None
+        await node.disconnect_all(ws)
+        assert node.active_connections == {} and node.connections == {}
+        await node.close()
+    
+    asyncio.run(scenario())
+
+
+def test_broadcast_during_disconnect_reaches_other_sockets():
+    """Test a socket being disconnected from several rooms does not break their broadcasts"""
+    async def scenario():
+        server = fakeredis.FakeServer()
+        manager = make_manager(server)
+        leaving, staying = FakeWebSocket(), FakeWebSocket()
+        await manager.connect_rooms(leaving, [1, 2], user_id=1)
+        await manager.connect(staying, 2, user_id=2)
+        
+        unsubscribe = manager.pubsub.unsubscribe
+        
+        async def slow_unsubscribe(*channels):
+            await asyncio.sleep(0.01)
+            await unsubscribe(*channels)
+        
+        manager.pubsub.unsubscribe = slow_unsubscribe
+        disconnecting = asyncio.create_task(manager.disconnect_all(leaving))
+        await asyncio.sleep(0)
+        await manager.broadcast_to_room(2, {"type": "message", "content": "still here"})
+        await disconnecting
+        
+        assert await wait_for(lambda: len(staying.sent) == 1)
+        assert leaving not in manager.active_connections.get(2, set())
+        await manager.close()
+    
+    asyncio.run(scenario())
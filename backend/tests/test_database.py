@@ -0,0 +1,27 @@
+"""
+Tests for database engine configuration
+"""
+import pytest
+from app.database.database import async_database_url, engine_options
+
+
+def test_async_database_url_picks_async_driver():
+    """Test sync urls from settings map to their async drivers"""
+    assert async_database_url("sqlite:///./chatserver.db") == "sqlite+aiosqlite:///./chatserver.db"
+    assert async_database_url("postgresql://u:p@db:5432/chat") == "postgresql+asyncpg://u:p@db:5432/chat"
+    assert async_database_url("postgresql+asyncpg://u:p@db/chat") == "postgresql+asyncpg://u:p@db/chat"
+    # urls naming a sync driver are switched too
+    assert async_database_url("postgresql+psycopg2://u:p@db/chat") == "postgresql+asyncpg://u:p@db/chat"
+    assert async_database_url("sqlite+pysqlite:///./chatserver.db") == "sqlite+aiosqlite:///./chatserver.db"
+
+    with pytest.raises(ValueError, match="DATABASE_URL"):
+        async_database_url("oracle://u:p@db/chat")
+
+
+def test_engine_options_size_the_pool():
+    """Test server databases get an explicit, pre-pinged pool"""
+    options = engine_options("postgresql://u:p@db/chat")
+
+    assert options["pool_pre_ping"] is True
+    assert options["pool_size"] > 0
+    assert "pool_size" not in engine_options("sqlite:///./chatserver.db")
@@ -0,0 +1,154 @@
+"""
+Tests for the outbound email queue against a local SMTP server
+"""
+import asyncio
+import socket
+import time
+import pytest
+from app.core import email as email_module
+from app.core.email import EmailService
+from app.core.email_queue import EmailQueue, RedisDeadLetters, SmtpSession
+from tests.test_chat_api import create_test_user
+
+fakeredis = pytest.importorskip("fakeredis")
+controller = pytest.importorskip("aiosmtpd.controller")
+
+
+class RecordingHandler:
+    """Accepts mail, refusing some recipients and deferring some messages once"""
+
+    def __init__(self, refuse=(), defer_once=(), delay=0.0):
+        self.refuse = set(refuse)
+        self.defer_once = set(defer_once)
+        self.delay = delay
+        self.received = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.delay)
+        for address in envelope.rcpt_tos:
+            if address in self.defer_once:
+                self.defer_once.discard(address)
+                return "451 Try again later"
+        self.received.append((envelope.rcpt_tos[0], envelope.content))
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture
+def smtp_server():
+    """Start a local SMTP server, yields (handler factory, port)"""
+    servers = []
+
+    def start(handler):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = controller.Controller(handler, hostname="127.0.0.1", port=port)
+        server.start()
+        servers.append(server)
+        return port
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def make_queue(port, **options):
+    sessions = []
+
+    def session_factory():
+        session = SmtpSession(host="127.0.0.1", port=port, user="", password="", tls=False, timeout=5)
+        sessions.append(session)
+        return session
+
+    queue = EmailQueue(
+        workers=options.pop("workers", 1),
+        retry_base=options.pop("retry_base", 0.01),
+        dead_letters=RedisDeadLetters(fakeredis.FakeRedis()),
+        session_factory=session_factory,
+        **options
+    )
+    return queue, sessions
+
+
+def message(to_email):
+    return EmailService().build_message(to_email, "Hello", "<p>hi</p>", "hi")
+
+
+def test_messages_share_one_smtp_session(smtp_server):
+    """Test a worker connects once for many messages"""
+    handler = RecordingHandler()
+    queue, sessions = make_queue(smtp_server(handler))
+    queue.start()
+    try:
+        assert all(queue.enqueue(message(f"user{i}@test.com")) for i in range(20))
+        assert queue.join(timeout=10)
+    finally:
+        queue.stop()
+
+    assert sorted(to for to, _ in handler.received) == sorted(f"user{i}@test.com" for i in range(20))
+    assert sum(session.connects for session in sessions) == 1
+    assert queue.get_stats()["sent"] == 20
+
+
+def test_transient_failure_is_retried(smtp_server):
+    """Test a 4xx answer is retried with backoff and then delivered"""
+    handler = RecordingHandler(defer_once={"later@test.com"})
+    queue, _ = make_queue(smtp_server(handler))
+    queue.start()
+    try:
+        queue.enqueue(message("later@test.com"))
+        assert queue.join(timeout=10)
+    finally:
+        queue.stop()
+
+    assert [to for to, _ in handler.received] == ["later@test.com"]
+    assert queue.get_stats()["retried"] == 1
+
+
+def test_permanent_failure_is_dead_lettered(smtp_server):
+    """Test a refused recipient goes to the dead letters without retries"""
+    handler = RecordingHandler(refuse={"nobody@test.com"})
+    queue, _ = make_queue(smtp_server(handler))
+    queue.start()
+    try:
+        queue.enqueue(message("nobody@test.com"))
+        queue.enqueue(message("somebody@test.com"))
+        assert queue.join(timeout=10)
+    finally:
+        queue.stop()
+
+    assert [to for to, _ in handler.received] == ["somebody@test.com"]
+    [dead] = queue.dead_letters.list()
+    assert dead["to"] == "nobody@test.com" and dead["attempts"] == 1
+    assert dead["subject"] == "Hello" and "550" in dead["error"]
+    # bodies can carry live reset links
+    assert set(dead) == {"to", "subject", "error", "attempts", "queued_at", "failed_at"}
+    assert queue.get_stats()["retried"] == 0
+
+
+def test_password_reset_request_does_not_wait_for_smtp(client, db_session, smtp_server, monkeypatch):
+    """Test the reset request returns before a slow SMTP server accepted the email"""
+    create_test_user(db_session, "forgot@test.com", "forgot")
+    handler = RecordingHandler(delay=1.0)
+    queue, _ = make_queue(smtp_server(handler))
+    monkeypatch.setattr(email_module, "email_queue", queue)
+    monkeypatch.setattr(email_module.email_service, "enabled", True)
+    queue.start()
+    try:
+        started = time.perf_counter()
+        response = client.post("/api/v1/auth/password-reset", json={"email": "forgot@test.com"})
+        elapsed = time.perf_counter() - started
+        assert queue.join(timeout=10)
+    finally:
+        queue.stop()
+
+    assert response.status_code == 200
+    assert elapsed < 0.5
+    [(to, content)] = handler.received
+    assert to == "forgot@test.com" and b"password-reset?token=" in content
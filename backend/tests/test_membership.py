@@ -0,0 +1,172 @@
+"""
+Tests for the cached room membership checks
+"""
+import asyncio
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.chat.membership import MembershipCache, query_room_membership
+from app.core.security import get_password_hash
+from app.models.user import User
+from app.models.chat import ChatRoom, RoomType
+from tests.conftest import TestingAsyncSessionLocal, async_engine, engine
+from tests.test_chat_api import create_test_user, get_auth_token
+
+
+@pytest.fixture
+def members(db_session: Session):
+    """Create a room with one member and one outsider"""
+    member = User(email="member@example.com", username="member", hashed_password=get_password_hash("password"))
+    outsider = User(email="outsider@example.com", username="outsider", hashed_password=get_password_hash("password"))
+    db_session.add_all([member, outsider])
+    db_session.commit()
+    room = ChatRoom(name="Members Room", room_type=RoomType.group, created_by=member.id)
+    room.members.append(member)
+    db_session.add(room)
+    db_session.commit()
+    return room.id, member.id, outsider.id
+
+
+@pytest.fixture
+def statements():
+    """Record the SQL statements executed on the test engines"""
+    executed = []
+    engines = (engine, async_engine.sync_engine)
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    for target in engines:
+        event.listen(target, "before_cursor_execute", record)
+    yield executed
+    for target in engines:
+        event.remove(target, "before_cursor_execute", record)
+
+
+async def check(cache: MembershipCache, room_id: int, user_id: int) -> bool:
+    async with TestingAsyncSessionLocal() as db:
+        return await cache.is_member_async(db, room_id, user_id)
+
+
+class TestMembershipCache:
+    """Test membership answers are cached and invalidated"""
+
+    def test_cold_path_is_single_exists_query(self, db_session, members, statements):
+        """Test a cache miss costs one EXISTS query"""
+        room_id, member_id, outsider_id = members
+
+        assert query_room_membership(db_session, room_id, member_id) is True
+        assert query_room_membership(db_session, room_id, outsider_id) is False
+        assert len(statements) == 2
+        assert all("EXISTS" in statement for statement in statements)
+
+    def test_answers_are_cached(self, members, statements):
+        """Test repeated checks, positive and negative, hit the database once each"""
+        room_id, member_id, outsider_id = members
+        cache = MembershipCache(use_redis=False)
+
+        async def scenario():
+            for _ in range(5):
+                assert await check(cache, room_id, member_id)
+                assert not await check(cache, room_id, outsider_id)
+
+        asyncio.run(scenario())
+
+        assert len(statements) == 2
+        assert cache.misses == 2
+        assert cache.hits == 8
+
+    def test_entries_expire(self, members):
+        """Test answers are looked up again once the ttl has passed"""
+        room_id, member_id, _ = members
+        cache = MembershipCache(ttl=0, use_redis=False)
+
+        async def scenario():
+            await check(cache, room_id, member_id)
+            await check(cache, room_id, member_id)
+
+        asyncio.run(scenario())
+
+        assert cache.misses == 2
+
+    def test_invalidate_room_and_user(self, members):
+        """Test invalidation only forgets answers for the given room or user"""
+        room_id, member_id, outsider_id = members
+        cache = MembershipCache(use_redis=False)
+
+        async def scenario():
+            await cache.set_async(room_id, member_id, True)
+            await cache.set_async(room_id, outsider_id, False)
+            await cache.set_async(room_id + 1, member_id, True)
+
+            await cache.invalidate_user_async(member_id)
+            assert await cache.get_async(room_id, member_id) is None
+            assert await cache.get_async(room_id + 1, member_id) is None
+            assert await cache.get_async(room_id, outsider_id) is False
+
+            await cache.invalidate_room_async(room_id)
+            assert await cache.get_async(room_id, outsider_id) is None
+
+        asyncio.run(scenario())
+
+    def test_size_is_bounded(self):
+        """Test the oldest entries are evicted past max_entries"""
+        cache = MembershipCache(max_entries=3, use_redis=False)
+
+        async def scenario():
+            for user_id in range(5):
+                await cache.set_async(1, user_id, True)
+
+            assert await cache.get_async(1, 0) is None
+            assert await cache.get_async(1, 1) is None
+            assert await cache.get_async(1, 4) is True
+
+        asyncio.run(scenario())
+
+    def test_redis_tier_is_shared(self, members):
+        """Test an answer cached by one node is served to another from redis"""
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+        room_id, member_id, outsider_id = members
+        node_a = MembershipCache(redis_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True), use_redis=True)
+        node_b = MembershipCache(redis_client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True), use_redis=True)
+
+        async def scenario():
+            assert await check(node_a, room_id, member_id)
+            assert await check(node_b, room_id, member_id)
+            assert node_b.misses == 0
+
+            await node_a.invalidate_room_async(room_id)
+            node_b.clear()
+            assert await node_b.get_async(room_id, member_id) is None
+
+            await check(node_a, room_id, outsider_id)
+            await node_a.invalidate_user_async(outsider_id)
+            assert await node_b.get_async(room_id, outsider_id) is None
+
+        asyncio.run(scenario())
+
+
+class TestMembershipInvalidation:
+    """Test the REST endpoints keep the shared cache in line"""
+
+    def test_new_room_clears_stale_denials(self, client, db_session):
+        """Test creating a room forgets a cached 'not a member' answer for its id"""
+        create_test_user(db_session, "user1@test.com", "user1")
+        user2 = create_test_user(db_session, "user2@test.com", "user2")
+        headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+
+        # nothing exists yet, so user1 gets cached as a non-member of room 1
+        response = client.get("/api/v1/chat/rooms/1/messages", headers=headers)
+        assert response.status_code == 404
+
+        response = client.post(
+            "/api/v1/chat/rooms",
+            json={"name": "Fresh Room", "room_type": "group", "member_ids": [user2.id]},
+            headers=headers
+        )
+        assert response.status_code == 201
+        room_id = response.json()["id"]
+
+        response = client.get(f"/api/v1/chat/rooms/{room_id}/messages", headers=headers)
+        assert response.status_code == 200
@@ -0,0 +1,176 @@
+"""
+Tests for client batch frames, client_id idempotency keys and acks
+"""
+import asyncio
+import pytest
+from app.chat import ws_routes
+from app.chat.idempotency import ClientMessageIds
+from app.chat.persistence import message_writer
+from app.chat.websocket import chat_message_id
+from sqlalchemy.exc import IntegrityError
+from app.core.security import create_access_token
+from app.models.chat import Message
+from tests.conftest import TestingSessionLocal
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def test_batch_is_acked_broadcast_once_and_stored(converse, test_room, test_user):
+    """Test a batch frame gets one broadcast, one ack frame and one transaction"""
+    token = create_access_token(data={"sub": str(test_user.id)})
+    written = []
+    original = message_writer._insert
+
+    def insert(rows):
+        written.append(len(rows))
+        original(rows)
+
+    async def scenario():
+        message_writer._insert = insert
+        try:
+            sent = await converse(test_room.id, token, [
+                {"type": "batch", "messages": [
+                    {"content": "one", "client_id": "a"},
+                    {"content": "two", "client_id": "b"},
+                    {"content": "three"},
+                ]},
+            ], expected=3)
+        finally:
+            message_writer._insert = original
+        return sent
+
+    connected, batch, ack = asyncio.run(scenario())
+
+    assert connected["type"] == "connected"
+    assert batch["type"] == "batch" and batch["room_id"] == test_room.id
+    assert [m["content"] for m in batch["messages"]] == ["one", "two", "three"]
+    assert chat_message_id(batch) == batch["messages"][-1]["id"]
+    ids = {m["client_id"]: m["id"] for m in batch["messages"] if "client_id" in m}
+    assert ack == {
+        "type": "ack",
+        "room_id": test_room.id,
+        "acks": [{"client_id": "a", "id": ids["a"]}, {"client_id": "b", "id": ids["b"]}],
+    }
+    assert written == [3]
+
+
+def test_resent_client_ids_are_not_duplicated(converse, test_room, test_user):
+    """Test a resend after a reconnect is acked with the original id only"""
+    token = create_access_token(data={"sub": str(test_user.id)})
+
+    async def scenario():
+        first = await converse(test_room.id, token, [
+            {"type": "message", "content": "hello", "client_id": "k1"},
+        ], expected=3)
+        second = await converse(test_room.id, token, [
+            {"type": "batch", "messages": [
+                {"content": "hello", "client_id": "k1"},
+                {"content": "again", "client_id": "k2"},
+                {"content": "again", "client_id": "k2"},
+            ]},
+        ], expected=3)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    original_id = first[1]["data"]["id"]
+    assert first[2]["acks"] == [{"client_id": "k1", "id": original_id}]
+    # only the new message is broadcast, as a plain message frame
+    assert second[1]["type"] == "message" and second[1]["data"]["content"] == "again"
+    new_id = second[1]["data"]["id"]
+    assert sorted(second[2]["acks"], key=lambda ack: (ack["client_id"], "duplicate" in ack)) == [
+        {"client_id": "k1", "id": original_id, "duplicate": True},
+        {"client_id": "k2", "id": new_id},
+        {"client_id": "k2", "id": new_id, "duplicate": True},
+    ]
+    db = TestingSessionLocal()
+    assert db.query(Message).filter(Message.room_id == test_room.id).count() == 2
+    db.close()
+
+
+def test_oversized_batch_is_rejected(converse, test_room, test_user, monkeypatch):
+    """Test batches above WS_MAX_BATCH_MESSAGES get an error and nothing is sent"""
+    monkeypatch.setattr(ws_routes.settings, "WS_MAX_BATCH_MESSAGES", 2)
+    token = create_access_token(data={"sub": str(test_user.id)})
+
+    async def scenario():
+        return await converse(test_room.id, token, [
+            {"type": "batch", "messages": [{"content": str(i)} for i in range(3)]},
+        ], expected=2)
+
+    _, error = asyncio.run(scenario())
+
+    assert error["type"] == "error" and "1-2 messages" in error["message"]
+
+
+def test_claims_are_shared_per_sender():
+    """Test a client_id maps to its first server id, separately per sender"""
+    async def scenario():
+        ids = ClientMessageIds(redis_client=fakeredis.FakeAsyncRedis())
+        assert await ids.claim(1, {"a": 10, "b": 11}) == {}
+        assert await ids.claim(1, {"a": 20, "c": 21}) == {"a": 10}
+        assert await ids.claim(2, {"a": 30}) == {}
+        return ids.get_stats()
+
+    assert asyncio.run(scenario()) == {"claimed": 4, "duplicates": 1}
+
+
+def test_failed_submit_releases_client_ids(converse, test_room, test_user, monkeypatch):
+    """Test a message the writer refused can be resent under the same client_id"""
+    token = create_access_token(data={"sub": str(test_user.id)})
+    submit = message_writer.submit_many
+    calls = []
+
+    async def refuse_once(rows, **options):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise RuntimeError("writer queue is full at /var/lib/secret")
+        await submit(rows, **options)
+
+    monkeypatch.setattr(message_writer, "submit_many", refuse_once)
+
+    connected, error, message, ack = asyncio.run(converse(test_room.id, token, [
+        {"type": "message", "content": "hello", "client_id": "k1"},
+        {"type": "message", "content": "hello", "client_id": "k1"},
+    ], expected=4))
+
+    # the client is not told internal details
+    assert error == {"type": "error", "message": "Message could not be processed"}
+    assert message["type"] == "message" and message["data"]["client_id"] == "k1"
+    assert ack["acks"] == [{"client_id": "k1", "id": message["data"]["id"]}]
+
+
+def test_dropped_rows_release_client_ids_and_tell_the_sender(converse, test_room, test_user, monkeypatch):
+    """Test a message acked but never stored is reported and can be resent"""
+    token = create_access_token(data={"sub": str(test_user.id)})
+
+    insert = message_writer._insert
+    # the batch, then the group on its own
+    refusing = [True, True]
+
+    def refuse_first(rows):
+        if refusing and refusing.pop():
+            raise IntegrityError("INSERT", {}, Exception("constraint failed"))
+        insert(rows)
+
+    monkeypatch.setattr(message_writer, "_insert", refuse_first)
+
+    async def scenario():
+        first = await converse(test_room.id, token, [
+            {"type": "message", "content": "hello", "client_id": "k1"},
+        ], expected=4)
+        second = await converse(test_room.id, token, [
+            {"type": "message", "content": "hello", "client_id": "k1"},
+        ], expected=3)
+        return first, second
+
+    (_, message, ack, lost), (_, resent, resent_ack) = asyncio.run(scenario())
+
+    message_id = message["data"]["id"]
+    assert ack["acks"] == [{"client_id": "k1", "id": message_id}]
+    assert lost["acks"] == [{"client_id": "k1", "id": message_id, "error": "Message could not be saved"}]
+    # released, so the resend is stored rather than acked as a duplicate
+    assert resent_ack["acks"] == [{"client_id": "k1", "id": resent["data"]["id"]}]
+    db = TestingSessionLocal()
+    assert db.query(Message).filter(Message.id == resent["data"]["id"]).count() == 1
+    db.close()
@@ -0,0 +1,114 @@
+"""
+Tests for the Redis stream message log and replay on reconnect
+"""
+import asyncio
+import json
+import pytest
+from app.chat.message_log import RoomMessageLog
+from app.chat.websocket import ConnectionManager
+from app.core.ids import generate_message_id
+from tests.test_connection_manager import FakeWebSocket, wait_for
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def chat_message(room_id: int, content: str) -> dict:
+    return {"type": "message", "data": {"id": generate_message_id(), "room_id": room_id, "content": content}}
+
+
+def make_log(maxlen: int = 100) -> RoomMessageLog:
+    return RoomMessageLog(
+        redis_client=fakeredis.FakeAsyncRedis(decode_responses=True),
+        enabled=True,
+        maxlen=maxlen
+    )
+
+
+def test_read_after_returns_missed_messages_in_order():
+    """Test only messages newer than last_seen_id are replayed"""
+    async def scenario():
+        log = make_log()
+        ids = [generate_message_id() for _ in range(4)]
+        for message_id in ids:
+            await log.append(1, message_id, json.dumps({"id": message_id}))
+
+        replay = await log.read_after(1, ids[1])
+
+        assert replay.message_ids == ids[2:]
+        assert [json.loads(frame)["id"] for frame in replay.frames] == ids[2:]
+        assert replay.complete
+
+    asyncio.run(scenario())
+
+
+def test_trimmed_stream_is_incomplete():
+    """Test a client behind the trimmed stream is told to fetch over REST"""
+    async def scenario():
+        log = RoomMessageLog(
+            redis_client=fakeredis.FakeAsyncRedis(decode_responses=True),
+            enabled=True,
+            maxlen=2
+        )
+        ids = [generate_message_id() for _ in range(5)]
+        for message_id in ids:
+            # exact trimming, approximate MAXLEN may keep a few more entries
+            await log.redis.xadd(
+                log.stream_key(1), {"id": message_id, "frame": "{}"}, maxlen=2, approximate=False
+            )
+
+        replay = await log.read_after(1, ids[0])
+
+        assert replay.message_ids == ids[3:]
+        assert not replay.complete
+
+    asyncio.run(scenario())
+
+
+def test_disabled_log_is_a_no_op():
+    """Test nothing is written and replays are reported incomplete"""
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        log = RoomMessageLog(redis_client=redis, enabled=False)
+
+        await log.append(1, generate_message_id(), "{}")
+        replay = await log.read_after(1, 0)
+
+        assert await redis.exists(log.stream_key(1)) == 0
+        assert replay.frames == [] and not replay.complete
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_replays_before_live_delivery():
+    """Test a held socket gets greeting, missed messages, marker, then live ones, without duplicates"""
+    async def scenario():
+        manager = ConnectionManager(
+            redis_client=fakeredis.FakeAsyncRedis(decode_responses=True),
+            delivery_mode="local",
+            stream_log=make_log()
+        )
+        seen = chat_message(4, "seen")
+        missed = chat_message(4, "missed")
+        for message in (seen, missed):
+            await manager.broadcast_to_room(4, message)
+
+        ws = FakeWebSocket()
+        await manager.connect(ws, 4, user_id=1, hold=True)
+        # arrives live while the socket is held, and is in the stream too
+        await manager.broadcast_to_room(4, chat_message(4, "during replay"))
+        assert ws.sent == []
+
+        replayed = await manager.replay(ws, 4, seen["data"]["id"], greeting=json.dumps({"type": "connected"}))
+        await manager.broadcast_to_room(4, chat_message(4, "live"))
+
+        assert replayed == 2
+        assert await wait_for(lambda: len(ws.sent) == 5)
+        frames = [json.loads(frame) for frame in ws.sent]
+        assert [f["type"] for f in frames] == ["connected", "message", "message", "replay_complete", "message"]
+        assert [f["data"]["content"] for f in frames if f["type"] == "message"] == [
+            "missed", "during replay", "live"
+        ]
+        assert frames[3]["complete"] is True
+        await manager.close()
+
+    asyncio.run(scenario())
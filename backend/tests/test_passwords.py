@@ -0,0 +1,76 @@
+"""
+Tests for the pooled password hasher, admission control and rehash on login
+"""
+import threading
+import time
+import pytest
+from app.core.passwords import HasherBusy, PasswordHasher, hash_rounds, password_hasher
+from app.models.user import User
+from tests.test_chat_api import create_test_user
+
+
+def test_pool_rejects_beyond_its_slots():
+    """Test hashes beyond workers + queue size fail fast instead of queueing"""
+    hasher = PasswordHasher(workers=1, queue_size=1, rounds=4)
+    try:
+        # hold both slots with jobs that outlast the check
+        busy = [hasher._submit(time.sleep, 0.5) for _ in range(2)]
+        with pytest.raises(HasherBusy) as busy_error:
+            hasher.hash("secret")
+        assert busy_error.value.retry_after == hasher.retry_after
+
+        for future in busy:
+            future.result()
+        hashed = hasher.hash("secret")
+        assert hasher.verify("secret", hashed)
+        assert hasher.get_stats()["rejected"] == 1
+    finally:
+        hasher.shutdown()
+
+
+def test_pool_workers_are_spawned():
+    """Test worker processes are not forked from the multithreaded server"""
+    hasher = PasswordHasher(workers=1, rounds=4)
+    try:
+        hasher.start()
+        assert hasher._executor._mp_context.get_start_method() == "spawn"
+        assert hasher.verify("secret", hasher.hash("secret"))
+    finally:
+        hasher.shutdown()
+
+
+def test_verify_and_update_upgrades_work_factor():
+    """Test a hash with other rounds verifies and comes back rehashed"""
+    old = PasswordHasher(workers=0, rounds=4).hash("secret")
+    hasher = PasswordHasher(workers=0, rounds=5)
+
+    assert hasher.verify_and_update("wrong", old) == (False, None)
+    valid, new_hash = hasher.verify_and_update("secret", old)
+    assert valid and hash_rounds(new_hash) == 5
+    assert hasher.verify_and_update("secret", new_hash) == (True, None)
+    assert hasher.verify("secret", "not-a-hash") is False
+
+
+def test_login_rehashes_outdated_password(client, db_session, monkeypatch):
+    """Test a successful login stores a hash with the configured work factor"""
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+    user = create_test_user(db_session, "old@test.com", "old_hash")
+    monkeypatch.setattr(password_hasher, "rounds", 5)
+
+    response = client.post("/api/v1/auth/login", json={"email": "old@test.com", "password": "testpass123"})
+
+    assert response.status_code == 200
+    db_session.expire_all()
+    assert hash_rounds(db_session.get(User, user.id).hashed_password) == 5
+
+
+def test_saturated_hasher_answers_503(client, db_session, monkeypatch):
+    """Test logins are shed with 503 and Retry-After while the pool is full"""
+    create_test_user(db_session, "busy@test.com", "busy")
+    monkeypatch.setattr(password_hasher, "_slots", threading.BoundedSemaphore(1))
+    password_hasher._slots.acquire()
+
+    response = client.post("/api/v1/auth/login", json={"email": "busy@test.com", "password": "testpass123"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(password_hasher.retry_after)
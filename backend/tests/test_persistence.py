@@ -0,0 +1,229 @@
+"""
+Tests for message ids and the write-behind message persistence pipeline
+"""
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from app import main
+from app.chat.persistence import MessageWriter, build_message_row
+from app.core.ids import IdGenerator, WorkerIdLease, id_timestamp, MAX_WORKER_ID
+from app.core.security import get_password_hash
+from app.models.user import User
+from app.models.chat import ChatRoom, Message, RoomType
+from tests.conftest import TestingSessionLocal
+
+
+@pytest.fixture
+def room(db_session: Session):
+    """Create a room with one member to attach messages to"""
+    user = User(
+        email="writer@example.com",
+        username="writer",
+        hashed_password=get_password_hash("password")
+    )
+    db_session.add(user)
+    db_session.commit()
+    room = ChatRoom(name="Writer Room", room_type=RoomType.group, created_by=user.id)
+    room.members.append(user)
+    db_session.add(room)
+    db_session.commit()
+    db_session.refresh(room)
+    return room
+
+
+class CountingWriter(MessageWriter):
+    """MessageWriter that records the size of every flushed batch"""
+    
+    def __init__(self, **kwargs):
+        super().__init__(session_factory=TestingSessionLocal, **kwargs)
+        self.batch_sizes = []
+    
+    def _insert(self, rows):
+        self.batch_sizes.append(len(rows))
+        super()._insert(rows)
+
+
+class FlakyWriter(CountingWriter):
+    """CountingWriter whose first inserts fail as if the database were down"""
+    
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+    
+    def _insert(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError("INSERT", {}, Exception("connection refused"))
+        super()._insert(rows)
+
+
+class TestIdGenerator:
+    """Test application-assigned message ids"""
+    
+    def test_ids_are_unique_and_increasing(self):
+        """Test ids keep increasing, including past the per-ms sequence limit"""
+        generator = IdGenerator(worker_id=3)
+        ids = [generator.next_id() for _ in range(2000)]
+        
+        assert ids == sorted(ids)
+        assert len(set(ids)) == len(ids)
+    
+    def test_ids_fit_javascript_numbers(self):
+        """Test ids stay within the exactly representable JS integer range"""
+        generator = IdGenerator(worker_id=MAX_WORKER_ID)
+        
+        assert generator.next_id() < 2 ** 53
+    
+    def test_id_timestamp(self):
+        """Test the generation time can be recovered from an id"""
+        from datetime import datetime
+        generated = IdGenerator(worker_id=0).next_id()
+        
+        assert abs((id_timestamp(generated) - datetime.utcnow()).total_seconds()) < 5
+    
+    def test_invalid_worker_id(self):
+        """Test worker ids outside the reserved bits are rejected"""
+        with pytest.raises(ValueError):
+            IdGenerator(worker_id=MAX_WORKER_ID + 1)
+    
+    def test_leased_worker_ids_are_unique(self):
+        """Test processes sharing a Redis never lease the same worker id"""
+        fakeredis = pytest.importorskip("fakeredis")
+        redis_client = fakeredis.FakeRedis(decode_responses=True)
+        leases = [WorkerIdLease(redis_client=redis_client) for _ in range(MAX_WORKER_ID + 1)]
+        
+        assert len({lease.acquire() for lease in leases}) == MAX_WORKER_ID + 1
+        with pytest.raises(RuntimeError):
+            WorkerIdLease(redis_client=redis_client).acquire()
+    
+    def test_lost_lease_is_noticed_on_renewal(self):
+        """Test a lease taken over by another process is not renewed"""
+        fakeredis = pytest.importorskip("fakeredis")
+        redis_client = fakeredis.FakeRedis(decode_responses=True)
+        lease = WorkerIdLease(redis_client=redis_client)
+        worker_id = lease.acquire()
+        
+        assert lease.renew()
+        redis_client.set(WorkerIdLease.key(worker_id), "another process")
+        assert not lease.renew()
+
+
+class TestMessageWriter:
+    """Test batching, flushing and draining of buffered messages"""
+    
+    def test_flush_on_batch_size(self, room):
+        """Test a full batch is written as a single multi-row insert"""
+        async def scenario():
+            writer = CountingWriter(batch_size=10, flush_interval=5.0)
+            for i in range(10):
+                await writer.submit(build_message_row(room.id, room.created_by, f"m{i}"))
+            await asyncio.wait_for(writer.queue.join(), timeout=2.0)
+            await writer.stop()
+            return writer
+        
+        writer = asyncio.run(scenario())
+        
+        assert writer.batch_sizes == [10]
+        db = TestingSessionLocal()
+        assert db.query(Message).filter(Message.room_id == room.id).count() == 10
+        db.close()
+    
+    def test_flush_on_interval(self, room):
+        """Test a partial batch is flushed once the interval expires"""
+        async def scenario():
+            writer = CountingWriter(batch_size=100, flush_interval=0.05)
+            for i in range(3):
+                await writer.submit(build_message_row(room.id, room.created_by, f"m{i}"))
+            await asyncio.wait_for(writer.queue.join(), timeout=2.0)
+            batch_sizes = list(writer.batch_sizes)
+            await writer.stop()
+            return batch_sizes
+        
+        assert asyncio.run(scenario()) == [3]
+    
+    def test_stop_drains_buffer(self, room):
+        """Test shutdown persists everything that was still buffered"""
+        async def scenario():
+            writer = CountingWriter(batch_size=25, flush_interval=10.0)
+            rows = [build_message_row(room.id, room.created_by, f"m{i}") for i in range(60)]
+            for row in rows:
+                await writer.submit(row)
+            await writer.stop()
+            return rows
+        
+        rows = asyncio.run(scenario())
+        
+        db = TestingSessionLocal()
+        stored = db.query(Message).filter(Message.room_id == room.id).order_by(Message.id).all()
+        assert [msg.id for msg in stored] == [row["id"] for row in rows]
+        db.close()
+    
+    def test_bad_row_does_not_drop_batch(self, room):
+        """Test a failing row is isolated and the rest of the batch is kept"""
+        async def scenario():
+            writer = CountingWriter(batch_size=3, flush_interval=0.01, max_retries=1)
+            good = build_message_row(room.id, room.created_by, "good")
+            duplicate = dict(good)
+            other = build_message_row(room.id, room.created_by, "other")
+            for row in (good, duplicate, other):
+                await writer.submit(row)
+            await writer.stop()
+            return writer
+        
+        writer = asyncio.run(scenario())
+        
+        assert writer.written == 2
+        assert writer.failed == 1
+    
+    def test_database_outage_is_retried_until_written(self, room):
+        """Test messages survive a database outage longer than a few retries"""
+        async def scenario():
+            writer = FlakyWriter(failures=8, batch_size=5, flush_interval=0.01, retry_base=0.001, max_backoff=0.01)
+            for i in range(5):
+                await writer.submit(build_message_row(room.id, room.created_by, f"m{i}"))
+            await asyncio.wait_for(writer.queue.join(), timeout=5.0)
+            await writer.stop()
+            return writer
+        
+        writer = asyncio.run(scenario())
+        
+        assert writer.written == 5
+        assert writer.failed == 0
+    
+    def test_groups_are_written_whole(self, room):
+        """Test a submitted group is never split and fails as a unit"""
+        async def scenario():
+            writer = CountingWriter(batch_size=2, flush_interval=0.01, max_retries=1)
+            group = [build_message_row(room.id, room.created_by, f"g{i}") for i in range(3)]
+            bad = build_message_row(room.id, room.created_by, "bad")
+            bad_group = [bad, dict(bad), build_message_row(room.id, room.created_by, "lost")]
+            await writer.submit_many(group)
+            await writer.submit_many(bad_group)
+            await writer.stop()
+            return writer
+        
+        writer = asyncio.run(scenario())
+        
+        assert writer.batch_sizes[0] == 3
+        assert writer.written == 3
+        assert writer.failed == 3
+
+
+def test_shutdown_closes_sockets_before_draining_the_writer(monkeypatch):
+    """Test no message is accepted after the writer was flushed at shutdown"""
+    calls = []
+
+    async def close():
+        calls.append("manager.close")
+
+    async def stop():
+        calls.append("message_writer.stop")
+
+    monkeypatch.setattr(main.manager, "close", close)
+    monkeypatch.setattr(main.message_writer, "stop", stop)
+    with TestClient(main.app):
+        pass
+
+    assert calls == ["manager.close", "message_writer.stop"]
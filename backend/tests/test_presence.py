@@ -0,0 +1,174 @@
+"""
+Tests for Redis heartbeat presence
+"""
+import asyncio
+import json
+import time
+import pytest
+from app.chat.presence import PRESENCE_KEY, PresenceService, presence
+from app.chat.websocket import ConnectionManager
+from app.models.chat import ChatRoom, RoomType
+from app.models.user import User
+from tests.conftest import TestingAsyncSessionLocal
+from tests.test_chat_api import create_test_user, get_auth_token
+from tests.test_connection_manager import FakeWebSocket, wait_for
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def make_presence(redis, node_id: str, manager=None) -> PresenceService:
+    service = PresenceService(
+        redis_client=redis,
+        node_id=node_id,
+        batch_delay=0,
+        session_factory=TestingAsyncSessionLocal
+    )
+    service.manager = manager
+    return service
+
+
+def create_room(db_session, *users) -> ChatRoom:
+    room = ChatRoom(name="Presence Room", room_type=RoomType.group, created_by=users[0].id)
+    room.members.extend(users)
+    db_session.add(room)
+    db_session.commit()
+    db_session.refresh(room)
+    return room
+
+
+def test_presence_is_shared_between_nodes():
+    """Test a user connected on one node is online on every node, from the published diffs"""
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        node_a, node_b = make_presence(redis, "a"), make_presence(redis, "b")
+        node_a.start()
+        node_b.start()
+        assert await wait_for(lambda: node_a._synced and node_b._synced)
+        ticks = node_b.ticks
+
+        node_a.connect(1)
+        assert await wait_for(lambda: node_b.is_online(1))
+        # node b applied the diff without a tick reading the set
+        assert node_b.ticks == ticks
+
+        # a second node holding a socket keeps the user online
+        node_b.connect(1)
+        assert await wait_for(lambda: node_a.members.get(1) == {"1:a", "1:b"})
+        node_a.disconnect(1)
+        assert await wait_for(lambda: node_b.members.get(1) == {"1:b"})
+        assert node_a.is_online(1)
+
+        node_b.disconnect(1)
+        assert await wait_for(lambda: not node_a.is_online(1))
+        await node_a.stop()
+        await node_b.stop()
+
+    asyncio.run(scenario())
+
+
+def test_dead_node_entries_expire():
+    """Test users of a node that stopped heartbeating go offline"""
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        node = make_presence(redis, "a")
+        await redis.zadd(PRESENCE_KEY, {"7:dead": time.time() - 1, "8:alive": time.time() + 30})
+
+        await node.tick()
+
+        assert node.online == {8}
+        assert await redis.zscore(PRESENCE_KEY, "7:dead") is None
+
+        # the expiry is published once, by the node that removed the entry
+        other = make_presence(redis, "b")
+        await other.tick()
+        assert node.diffs_published == 1 and other.diffs_published == 0
+
+    asyncio.run(scenario())
+
+
+def test_changes_are_batched_per_room(db_session):
+    """Test one tick sends a single presence frame per local room"""
+    user1 = create_test_user(db_session, "user1@test.com", "user1")
+    user2 = create_test_user(db_session, "user2@test.com", "user2")
+    user3 = create_test_user(db_session, "user3@test.com", "user3")
+    outsider = create_test_user(db_session, "user4@test.com", "user4")
+    room = create_room(db_session, user1, user2, user3)
+
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        manager = ConnectionManager(redis_client=redis, delivery_mode="local")
+        node = make_presence(redis, "a", manager)
+        ws = FakeWebSocket()
+        await manager.connect(ws, room.id, user_id=user1.id)
+        node.local_sockets[user1.id] = 1
+        await node.tick()
+        await wait_for(lambda: len(ws.sent) == 1)
+        ws.sent.clear()
+
+        # three users come online before the next tick, one is not a member
+        for user in (user2, user3, outsider):
+            node.local_sockets[user.id] = 1
+        await node.tick()
+
+        assert await wait_for(lambda: len(ws.sent) == 1)
+        frame = json.loads(ws.sent[0])
+        assert frame["type"] == "presence" and frame["room_id"] == room.id
+        assert sorted(c["user_id"] for c in frame["changes"]) == [user2.id, user3.id]
+        assert all(c["is_online"] for c in frame["changes"])
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_last_seen_is_flushed_in_bulk(db_session):
+    """Test users leaving the node get last_seen written, without per-socket commits"""
+    user1 = create_test_user(db_session, "user1@test.com", "user1")
+    user2 = create_test_user(db_session, "user2@test.com", "user2")
+    before = {u.id: u.last_seen for u in (user1, user2)}
+
+    async def scenario():
+        node = make_presence(fakeredis.FakeAsyncRedis(decode_responses=True), "a")
+        for user in (user1, user2):
+            node.local_sockets[user.id] = 1
+        await node.tick()
+        for user in (user1, user2):
+            node.disconnect(user.id)
+        await node.tick()
+        return node
+
+    node = asyncio.run(scenario())
+
+    assert node.last_seen_written == 2
+    db_session.expire_all()
+    for user in db_session.query(User).all():
+        assert user.last_seen > before[user.id]
+
+
+def test_room_members_online_from_presence(client, db_session):
+    """Test room listings read online status from the presence cache"""
+    user1 = create_test_user(db_session, "user1@test.com", "user1")
+    user2 = create_test_user(db_session, "user2@test.com", "user2")
+    create_room(db_session, user1, user2)
+    headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+    presence.online = {user2.id}
+
+    response = client.get("/api/v1/chat/rooms", headers=headers)
+
+    members = {m["username"]: m["is_online"] for m in response.json()[0]["members"]}
+    assert members == {"user1": False, "user2": True}
+
+
+def test_user_profiles_online_from_presence(client, db_session):
+    """Test user listings read online status from the presence cache, not the users table"""
+    user1 = create_test_user(db_session, "user1@test.com", "user1")
+    user2 = create_test_user(db_session, "user2@test.com", "user2")
+    user1.is_online = True
+    db_session.commit()
+    headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+    presence.online = {user2.id}
+
+    response = client.get("/api/v1/auth/users", headers=headers)
+
+    online = {u["username"]: u["is_online"] for u in response.json()}
+    assert online == {"user1": False, "user2": True}
+    assert client.get("/api/v1/auth/me", headers=headers).json()["is_online"] is False
@@ -0,0 +1,95 @@
+"""
+Tests for the authenticated user (principal) cache
+"""
+import pytest
+from app.auth.principal import Principal, PrincipalCache, principal_cache
+from tests.test_chat_api import create_test_user, get_auth_token
+
+
+class TestPrincipalCache:
+    """Test LRU and TTL behaviour of the principal cache"""
+
+    def test_principal_is_immutable(self):
+        """Test cached snapshots cannot be modified by a request"""
+        principal = Principal(id=1, username="alice", is_admin=False)
+
+        with pytest.raises(AttributeError):
+            principal.is_admin = True
+
+    def test_least_recently_used_is_evicted(self):
+        """Test the entry not used for the longest time is evicted first"""
+        cache = PrincipalCache(max_entries=2, ttl=60)
+        cache.put(Principal(id=1, username="a", is_admin=False))
+        cache.put(Principal(id=2, username="b", is_admin=False))
+        cache.get(1)
+        cache.put(Principal(id=3, username="c", is_admin=False))
+
+        assert cache.get(1) is not None
+        assert cache.get(2) is None
+        assert cache.get(3) is not None
+
+    def test_entries_expire(self):
+        """Test expired entries are not served"""
+        cache = PrincipalCache(max_entries=10, ttl=0)
+        cache.put(Principal(id=1, username="a", is_admin=False))
+
+        assert cache.get(1) is None
+
+    def test_load_counts_hits_and_misses(self, db_session):
+        """Test only the first load of a user queries the database"""
+        user = create_test_user(db_session, "user1@test.com", "user1")
+        cache = PrincipalCache(max_entries=10, ttl=60)
+
+        for _ in range(3):
+            assert cache.load(db_session, user.id) == Principal(user.id, "user1", False)
+        assert cache.load(db_session, user.id + 100) is None
+
+        assert cache.get_stats()["hits"] == 2
+        assert cache.get_stats()["misses"] == 2
+
+
+class TestPrincipalAuthorization:
+    """Test endpoints authorize from the principal cache"""
+
+    def test_repeated_requests_hit_cache(self, client, db_session):
+        """Test the users table is only read on the first request"""
+        create_test_user(db_session, "user1@test.com", "user1")
+        headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+        hits, misses = principal_cache.hits, principal_cache.misses
+
+        for _ in range(3):
+            assert client.get("/api/v1/chat/rooms", headers=headers).status_code == 200
+
+        assert principal_cache.misses - misses == 1
+        assert principal_cache.hits - hits == 2
+
+    def test_admin_delete_invalidates_principal(self, client, db_session):
+        """Test a deleted user's token stops working right away"""
+        admin = create_test_user(db_session, "admin@test.com", "admin")
+        admin.is_admin = True
+        db_session.commit()
+        user = create_test_user(db_session, "user1@test.com", "user1")
+        admin_headers = {"Authorization": f"Bearer {get_auth_token(client, 'admin@test.com')}"}
+        user_headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+
+        assert client.get("/api/v1/chat/rooms", headers=user_headers).status_code == 200
+        assert principal_cache.get(user.id) is not None
+
+        response = client.delete(f"/api/v1/admin/users/{user.id}", headers=admin_headers)
+        assert response.status_code == 200
+
+        assert principal_cache.get(user.id) is None
+        assert client.get("/api/v1/chat/rooms", headers=user_headers).status_code == 401
+
+    def test_cache_stats_endpoint(self, client, db_session):
+        """Test admins can read the cache counters"""
+        admin = create_test_user(db_session, "admin@test.com", "admin")
+        admin.is_admin = True
+        db_session.commit()
+        headers = {"Authorization": f"Bearer {get_auth_token(client, 'admin@test.com')}"}
+
+        response = client.get("/api/v1/admin/cache-stats", headers=headers)
+
+        assert response.status_code == 200
+        assert set(response.json()) == {"principals", "token_claims", "room_memberships", "recent_messages"}
+        assert response.json()["principals"]["misses"] >= 1
@@ -0,0 +1,157 @@
+"""
+Tests for the rate limiters, the auth endpoint limits and websocket message rates
+"""
+import asyncio
+from types import SimpleNamespace
+import pytest
+from app.chat import ws_routes
+from app.core import rate_limit
+from app.core.passwords import password_hasher
+from app.core.rate_limit import (
+    LOGIN_PER_IP, PASSWORD_RESET_CONFIRM_PER_IP, Gcra, MemoryRateLimiter, RateLimit,
+    RedisRateLimiter, parse_rate, rate_limiter
+)
+from app.core.security import create_access_token
+from app.auth import views
+from tests.test_chat_api import create_test_user
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def test_parse_rate():
+    """Test rate specs with and without a period count"""
+    assert parse_rate("a", "5/minute") == RateLimit("a", 5, 60)
+    assert parse_rate("b", "20/15minutes") == RateLimit("b", 20, 900)
+    with pytest.raises(ValueError):
+        parse_rate("c", "5 per minute")
+
+
+STORES = [MemoryRateLimiter, lambda: RedisRateLimiter(fakeredis.FakeRedis())]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable clock for both stores, halfway through a one minute window"""
+    now = SimpleNamespace(value=100 * 60 + 30.0)
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(time=lambda: now.value, monotonic=lambda: now.value))
+    return now
+
+
+@pytest.mark.parametrize("store", STORES)
+def test_limit_is_per_key(store, clock):
+    """Test a key is refused past its limit while other keys are not"""
+    store = store()
+    rule = RateLimit("login_email", 3, 60)
+
+    assert [store.hit(rule, "a@test.com") for _ in range(3)] == [0, 0, 0]
+    wait = store.hit(rule, "a@test.com")
+    assert 0 < wait <= 60
+    assert store.hit(rule, "b@test.com") == 0
+
+
+@pytest.mark.parametrize("store", STORES)
+def test_rejected_hits_count_in_both_stores(store, clock):
+    """Test a key that keeps hammering past its limit stays limited a period later"""
+    store = store()
+    rule = RateLimit("login_email", 3, 60)
+    for _ in range(3):
+        store.hit(rule, "a@test.com")
+    for _ in range(10):
+        assert store.hit(rule, "a@test.com") > 0
+
+    clock.value += 60
+    assert store.hit(rule, "a@test.com") > 0
+    clock.value += 120
+    assert store.hit(rule, "a@test.com") == 0
+
+
+def test_gcra_counts_the_cost_of_a_batch():
+    """Test a batch spends as many cells as it has messages"""
+    rate = Gcra(RateLimit("ws_messages", 3, 1))
+
+    assert rate.hit(2) == 0
+    assert rate.hit(2) > 0
+    assert rate.hit(1) == 0
+    assert rate.hit(1) > 0
+
+
+def test_login_is_limited_per_email_before_bcrypt(client, db_session, monkeypatch):
+    """Test guessing one account's password is cut off without hashing"""
+    create_test_user(db_session, "target@test.com", "target")
+    monkeypatch.setattr(views, "LOGIN_PER_EMAIL", RateLimit("login_email", 3, 60))
+    checks = []
+    verify = password_hasher.verify_and_update
+
+    def counting_verify(password, hashed):
+        checks.append(password)
+        return verify(password, hashed)
+
+    monkeypatch.setattr(password_hasher, "verify_and_update", counting_verify)
+
+    statuses = [
+        client.post("/api/v1/auth/login", json={"email": "target@test.com", "password": f"guess{i}"}).status_code
+        for i in range(10)
+    ]
+
+    assert statuses == [401] * 3 + [429] * 7
+    assert len(checks) == 3
+    response = client.post("/api/v1/auth/login", json={"email": "Target@test.com", "password": "testpass123"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_login_is_limited_per_ip(client):
+    """Test one client spraying many accounts is cut off"""
+    limit = LOGIN_PER_IP.limit
+    statuses = [
+        client.post("/api/v1/auth/login", json={"email": f"user{i}@test.com", "password": "x" * 8}).status_code
+        for i in range(limit + 1)
+    ]
+
+    assert statuses == [401] * limit + [429]
+    assert rate_limiter.get_stats()["limited"] >= 1
+
+
+def test_refresh_is_limited_per_user(client, db_session, monkeypatch):
+    """Test one user's refreshes are limited whatever client they come from"""
+    create_test_user(db_session, "refresh@test.com", "refresh")
+    monkeypatch.setattr(views, "REFRESH_PER_USER", RateLimit("refresh_user", 2, 60))
+    refresh = client.post(
+        "/api/v1/auth/login", json={"email": "refresh@test.com", "password": "testpass123"}
+    ).json()["refresh_token"]
+
+    statuses = []
+    for _ in range(3):
+        response = client.post("/api/v1/auth/refresh", json={"refresh_token": refresh})
+        statuses.append(response.status_code)
+        if response.status_code == 200:
+            refresh = response.json()["refresh_token"]
+
+    assert statuses == [200, 200, 429]
+
+
+def test_password_reset_routes_have_their_own_ip_rules(client):
+    """Test confirming resets does not spend the reset request allowance"""
+    for _ in range(PASSWORD_RESET_CONFIRM_PER_IP.limit):
+        client.post("/api/v1/auth/password-reset-confirm", json={"token": "bad", "new_password": "x" * 8})
+    response = client.post(
+        "/api/v1/auth/password-reset-confirm", json={"token": "bad", "new_password": "x" * 8}
+    )
+
+    assert response.status_code == 429
+    rules = {rule for rule, _ in rate_limiter.memory._tats}
+    assert "reset_confirm_ip" in rules and "reset_ip" not in rules
+
+
+def test_socket_messages_over_the_rate_are_dropped(converse, test_room, test_user, monkeypatch):
+    """Test a socket over its message rate gets an error instead of a broadcast"""
+    monkeypatch.setattr(ws_routes, "WS_MESSAGE_RATE", RateLimit("ws_messages", 2, 60))
+    token = create_access_token(data={"sub": str(test_user.id)})
+
+    connected, batch, error = asyncio.run(converse(test_room.id, token, [
+        {"type": "batch", "messages": [{"content": "one"}, {"content": "two"}]},
+        {"type": "message", "content": "three"},
+    ], expected=3))
+
+    assert [m["content"] for m in batch["messages"]] == ["one", "two"]
+    assert error["type"] == "error" and error["retry_after"] > 0
@@ -0,0 +1,165 @@
+"""
+Tests for the recent messages tail of the room detail endpoint
+"""
+import time
+from datetime import datetime
+from app.chat.persistence import build_message_row, message_writer
+from app.chat.recent import RecentMessagesCache, recent_messages
+from app.models.chat import ChatRoom, Message, RoomType
+from tests.test_chat_api import create_test_user, get_auth_token
+
+
+def message(message_id: int) -> dict:
+    return {"id": message_id, "content": f"Message {message_id}"}
+
+
+class TestRecentMessagesCache:
+    """Test the per-room ring buffers"""
+
+    def test_loader_only_called_on_miss(self):
+        """Test a room is loaded from the database once, then served from memory"""
+        cache = RecentMessagesCache(window=3, max_rooms=10)
+        calls = []
+
+        def loader(limit):
+            calls.append(limit)
+            return [message(1), message(2)]
+
+        assert [m["id"] for m in cache.get(1, loader)] == [1, 2]
+        assert [m["id"] for m in cache.get(1, loader)] == [1, 2]
+        assert calls == [3]
+        assert cache.get_stats()["hits"] == 1
+
+    def test_record_keeps_window_of_newest(self):
+        """Test new messages push the oldest out of a full window"""
+        cache = RecentMessagesCache(window=3, max_rooms=10)
+        cache.get(1, lambda limit: [message(1), message(2), message(3)])
+
+        cache.record(1, message(4))
+        cache.record(1, message(5))
+
+        assert [m["id"] for m in cache.get(1, None)] == [3, 4, 5]
+
+    def test_record_out_of_order(self):
+        """Test a late message is inserted in id order, duplicates ignored"""
+        cache = RecentMessagesCache(window=3, max_rooms=10)
+        cache.get(1, lambda limit: [message(1), message(3), message(5)])
+
+        cache.record(1, message(4))
+        cache.record(1, message(4))
+        cache.record(1, message(2))
+
+        assert [m["id"] for m in cache.get(1, None)] == [3, 4, 5]
+
+    def test_uncached_rooms_are_not_recorded(self):
+        """Test a room is never served from a partial tail"""
+        cache = RecentMessagesCache(window=3, max_rooms=10)
+        cache.record(1, message(9))
+
+        assert 1 not in cache
+        assert [m["id"] for m in cache.get(1, lambda limit: [message(1), message(9)])] == [1, 9]
+
+    def test_records_during_a_cold_fill_are_merged(self):
+        """Test messages recorded while the tail loads, and unwritten ones, are kept"""
+        cache = RecentMessagesCache(window=4, max_rooms=10)
+
+        cache.begin_fill(1)
+        # broadcast while the query runs, the query result does not have it
+        cache.record(1, message(6))
+        tail = cache.fill(1, [message(2), message(3), message(5)], unwritten=[message(4), message(5)])
+
+        assert [m["id"] for m in tail] == [3, 4, 5, 6]
+        cache.record(1, message(7))
+        assert [m["id"] for m in cache.get(1, None)] == [4, 5, 6, 7]
+
+    def test_failed_fill_stops_holding_records(self):
+        """Test records are dropped again once a load gave up"""
+        cache = RecentMessagesCache(window=3, max_rooms=10)
+        cache.begin_fill(1)
+        cache.cancel_fill(1)
+        cache.record(1, message(9))
+
+        assert 1 not in cache
+        assert [m["id"] for m in cache.get(1, lambda limit: [message(1)])] == [1]
+
+    def test_tail_is_loaded_again_after_ttl(self):
+        """Test a tail that may have missed other nodes' messages is not served forever"""
+        cache = RecentMessagesCache(window=3, max_rooms=10, ttl=0.01)
+        calls = []
+
+        def loader(limit):
+            calls.append(limit)
+            return [message(len(calls))]
+
+        cache.get(1, loader)
+        time.sleep(0.02)
+
+        assert [m["id"] for m in cache.get(1, loader)] == [2]
+        assert len(calls) == 2
+
+    def test_least_recently_used_room_is_dropped(self):
+        """Test at most max_rooms buffers are kept"""
+        cache = RecentMessagesCache(window=3, max_rooms=2)
+        for room_id in (1, 2, 3):
+            cache.get(room_id, lambda limit: [])
+
+        assert 1 not in cache
+        assert 2 in cache and 3 in cache
+
+
+class TestRoomDetailTail:
+    """Test the room detail endpoint embeds a bounded tail"""
+
+    def test_details_embed_recent_window(self, client, db_session):
+        """Test only the newest messages are embedded, then kept current in memory"""
+        user1 = create_test_user(db_session, "user1@test.com", "user1")
+        room = ChatRoom(name="Busy Room", room_type=RoomType.group, created_by=user1.id)
+        room.members.append(user1)
+        db_session.add(room)
+        db_session.commit()
+        db_session.refresh(room)
+
+        total = recent_messages.window + 10
+        db_session.add_all([
+            Message(room_id=room.id, sender_id=user1.id, content=f"Message {i}", timestamp=datetime.utcnow())
+            for i in range(total)
+        ])
+        db_session.commit()
+
+        headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+        url = f"/api/v1/chat/rooms/{room.id}"
+
+        data = client.get(url, headers=headers).json()
+        contents = [m["content"] for m in data["messages"]]
+        assert contents == [f"Message {i}" for i in range(10, total)]
+        assert data["messages"][-1]["sender_username"] == "user1"
+
+        # a new message reaches the cached tail without another load
+        response = client.post(f"{url}/messages", json={"content": "Fresh"}, headers=headers)
+        assert response.status_code == 201
+        misses = recent_messages.misses
+
+        data = client.get(url, headers=headers).json()
+        assert data["messages"][-1]["content"] == "Fresh"
+        assert len(data["messages"]) == recent_messages.window
+        assert recent_messages.misses == misses
+
+    def test_details_include_unwritten_messages(self, client, db_session, monkeypatch):
+        """Test a message still in the write-behind buffer is part of a cold tail"""
+        user1 = create_test_user(db_session, "user1@test.com", "user1")
+        room = ChatRoom(name="Fresh Room", room_type=RoomType.group, created_by=user1.id)
+        room.members.append(user1)
+        db_session.add(room)
+        db_session.commit()
+        db_session.refresh(room)
+        db_session.add(Message(room_id=room.id, sender_id=user1.id, content="Stored", timestamp=datetime.utcnow()))
+        db_session.commit()
+
+        row = build_message_row(room.id, user1.id, "Not flushed yet")
+        monkeypatch.setattr(message_writer, "_unwritten", {row["id"]: row})
+
+        headers = {"Authorization": f"Bearer {get_auth_token(client, 'user1@test.com')}"}
+        data = client.get(f"/api/v1/chat/rooms/{room.id}", headers=headers).json()
+
+        assert [m["content"] for m in data["messages"]] == ["Stored", "Not flushed yet"]
+        assert data["messages"][-1]["sender_username"] == "user1"
@@ -0,0 +1,176 @@
+"""
+Tests for token revocation, refresh token rotation and reuse detection
+"""
+import asyncio
+import time
+import pytest
+from app.auth.revocation import BloomFilter, MemoryDenylist, RedisDenylist, TokenRevocation, family_key, jti_key
+from tests.test_chat_api import create_test_user
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def login(client, email):
+    response = client.post("/api/v1/auth/login", json={"email": email, "password": "testpass123"})
+    return response.json()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """Test every added id is found and few others are"""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"jti:{i}")
+
+    assert all(f"jti:{i}" in bloom for i in range(1000))
+    false_positives = sum(f"other:{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_redis_denylist_is_shared_between_nodes():
+    """Test a revocation on one node is enforced on another after its sync"""
+    redis_client = fakeredis.FakeRedis()
+    node_a = TokenRevocation(store=RedisDenylist(redis_client), capacity=100)
+    node_b = TokenRevocation(store=RedisDenylist(redis_client), capacity=100)
+    claims = {"jti": "abc", "exp": time.time() + 60}
+
+    node_a.revoke(claims)
+
+    assert node_a.is_revoked(claims)
+    # node b's filter does not know yet, so the token passes without a redis call
+    assert not node_b.is_revoked(claims)
+    node_b.sync()
+    assert node_b.is_revoked(claims)
+    assert 0 < redis_client.ttl("revoked:" + jti_key("abc")) <= 60
+    assert not node_b.is_revoked({"jti": "other", "exp": time.time() + 60})
+
+
+class OutageDenylist(RedisDenylist):
+    """A Redis denylist whose writes fail while down is set"""
+
+    def __init__(self, redis_client):
+        super().__init__(redis_client)
+        self.down = True
+
+    def add(self, key, expires_at):
+        if self.down:
+            raise ConnectionError("redis is down")
+        return super().add(key, expires_at)
+
+
+def test_revocation_during_an_outage_is_kept_and_pushed_later():
+    """Test a family revoked while Redis is down stays revoked and reaches Redis"""
+    redis_client = fakeredis.FakeRedis()
+    store = OutageDenylist(redis_client)
+    revocation = TokenRevocation(store=store, capacity=100)
+    claims = {"jti": "a1", "fam": "f1", "exp": time.time() + 60}
+
+    revocation.revoke_family("f1")
+    store.down = False
+
+    # redis does not know about it, this node still enforces it
+    assert revocation.is_revoked(claims)
+    revocation.sync()
+    assert revocation.is_revoked(claims)
+    assert redis_client.exists("revoked:" + family_key("f1"))
+    assert revocation.get_stats()["unsynced"] == 0
+
+
+def test_refresh_token_is_single_use():
+    """Test reusing a refresh token revokes its whole family"""
+    revocation = TokenRevocation(store=MemoryDenylist(), capacity=100)
+    refresh = {"sub": "1", "jti": "r1", "fam": "f1", "exp": time.time() + 60}
+    access = {"sub": "1", "jti": "a2", "fam": "f1", "exp": time.time() + 60}
+
+    assert revocation.use_refresh_token(refresh)
+    assert not revocation.is_revoked(access)
+    assert not revocation.use_refresh_token(refresh)
+    assert revocation.is_revoked(access)
+    assert revocation.get_stats()["reuse_detected"] == 1
+
+
+def test_used_refresh_tokens_stay_out_of_the_denylist():
+    """Test a refresh marks its token used without growing the filter or the sync set"""
+    redis_client = fakeredis.FakeRedis()
+    revocation = TokenRevocation(store=RedisDenylist(redis_client), capacity=100)
+    refresh = {"sub": "1", "jti": "r1", "fam": "f1", "exp": time.time() + 60}
+
+    assert revocation.use_refresh_token(refresh)
+
+    assert redis_client.zcard("revoked_tokens") == 0
+    assert not revocation.is_revoked(refresh)
+    assert revocation.get_stats()["bloom_hits"] == 0
+    assert not revocation.use_refresh_token(refresh)
+    assert revocation.is_revoked(refresh)
+
+
+def test_async_check_matches_sync_check():
+    """Test the event loop variant confirms bloom hits the same way"""
+    revocation = TokenRevocation(store=RedisDenylist(fakeredis.FakeRedis()), capacity=100)
+    revoked = {"jti": "gone", "exp": time.time() + 60}
+    valid = {"jti": "fine", "exp": time.time() + 60}
+    revocation.revoke(revoked)
+
+    assert asyncio.run(revocation.is_revoked_async(revoked))
+    assert not asyncio.run(revocation.is_revoked_async(valid))
+
+
+def test_logout_revokes_access_and_refresh_tokens(client, db_session):
+    """Test tokens of a login stop working after logout"""
+    create_test_user(db_session, "bye@test.com", "bye")
+    tokens = login(client, "bye@test.com")
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 200
+    assert client.post("/api/v1/auth/logout", headers=headers).status_code == 200
+
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 401
+    response = client.post("/api/v1/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+
+
+def test_refresh_rotation_detects_reuse(client, db_session):
+    """Test a replayed refresh token is refused and logs the family out"""
+    create_test_user(db_session, "rot@test.com", "rot")
+    tokens = login(client, "rot@test.com")
+
+    rotated = client.post("/api/v1/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert rotated.status_code == 200
+    headers = {"Authorization": f"Bearer {rotated.json()['access_token']}"}
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 200
+
+    replayed = client.post("/api/v1/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert replayed.status_code == 401
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 401
+    response = client.post("/api/v1/auth/refresh", json={"refresh_token": rotated.json()["refresh_token"]})
+    assert response.status_code == 401
+
+
+def test_tokens_only_work_for_their_purpose(client, db_session):
+    """Test refresh tokens are not access tokens and vice versa"""
+    create_test_user(db_session, "typ@test.com", "typ")
+    tokens = login(client, "typ@test.com")
+
+    headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 401
+    response = client.post("/api/v1/auth/refresh", json={"refresh_token": tokens["access_token"]})
+    assert response.status_code == 401
+
+
+def test_service_stats_endpoint(client, db_session):
+    """Test admins can read the counters of the services on this node"""
+    admin = create_test_user(db_session, "admin@test.com", "admin")
+    admin.is_admin = True
+    db_session.commit()
+    headers = {"Authorization": f"Bearer {login(client, 'admin@test.com')['access_token']}"}
+
+    response = client.get("/api/v1/admin/service-stats", headers=headers)
+
+    assert response.status_code == 200
+    assert set(response.json()) == {
+        "token_revocation", "rate_limits", "password_hasher", "email_queue",
+        "message_writer", "message_log", "client_message_ids"
+    }
+    assert response.json()["token_revocation"]["checks"] >= 1
+    assert response.json()["rate_limits"]["allowed"] >= 1
+    assert response.json()["password_hasher"]["completed"] >= 1
+    assert {"written", "batches", "failed"} <= set(response.json()["message_writer"])
@@ -0,0 +1,80 @@
+"""
+Tests for the verified token claims cache and the JWT backends
+"""
+import time
+from datetime import datetime, timedelta
+import pytest
+from app.core.config import settings
+from app.core.security import create_access_token
+from app.core.tokens import JoseBackend, PyJWTBackend, TokenVerifier
+
+
+class CountingBackend(JoseBackend):
+    """jose backend counting the signature checks"""
+
+    def __init__(self):
+        super().__init__(settings.SECRET_KEY, settings.ALGORITHM)
+        self.decodes = 0
+
+    def decode(self, token):
+        self.decodes += 1
+        return super().decode(token)
+
+
+def token_expiring_in(seconds: float, sub: str = "1") -> str:
+    return CountingBackend().encode({"sub": sub, "exp": int(time.time() + seconds)})
+
+
+def test_repeat_verification_is_served_from_cache():
+    """Test a token's signature is checked once for many verifications"""
+    backend = CountingBackend()
+    verifier = TokenVerifier(backend=backend, max_entries=10)
+    token = create_access_token(data={"sub": "5"})
+
+    claims = [verifier.verify(token) for _ in range(100)]
+
+    assert backend.decodes == 1
+    assert all(c["sub"] == "5" for c in claims)
+    assert verifier.get_stats()["hits"] == 99
+
+
+def test_entries_expire_with_the_token():
+    """Test a cached token stops verifying once its exp has passed"""
+    backend = CountingBackend()
+    verifier = TokenVerifier(backend=backend, max_entries=10)
+    token = token_expiring_in(1)
+
+    assert verifier.verify(token) is not None
+    # jose checks exp with one second granularity
+    time.sleep(2.1)
+
+    assert verifier.verify(token) is None
+    assert backend.decodes == 2
+    assert verifier.get_stats()["entries"] == 0
+
+
+def test_cache_is_bounded_and_skips_invalid_tokens():
+    """Test the least recently used token is evicted and bad tokens are not kept"""
+    verifier = TokenVerifier(backend=CountingBackend(), max_entries=2)
+    first, second, third = (token_expiring_in(60, sub=str(i)) for i in range(3))
+
+    for token in (first, second, first, third):
+        verifier.verify(token)
+    assert verifier.verify(first + "x") is None
+    assert verifier.verify("not a token") is None
+
+    assert verifier.get_stats()["entries"] == 2
+    verifier.verify(second)
+    assert verifier.get_stats()["misses"] == 6
+
+
+def test_pyjwt_backend_reads_jose_tokens():
+    """Test the PyJWT backend accepts tokens issued by jose, and vice versa"""
+    pytest.importorskip("jwt")
+    pyjwt = PyJWTBackend(settings.SECRET_KEY, settings.ALGORITHM)
+    jose = JoseBackend(settings.SECRET_KEY, settings.ALGORITHM)
+    claims = {"sub": "7", "exp": datetime.utcnow() + timedelta(minutes=5)}
+
+    assert pyjwt.decode(jose.encode(claims))["sub"] == "7"
+    assert jose.decode(pyjwt.encode(claims))["sub"] == "7"
+    assert pyjwt.decode(JoseBackend("other-key", settings.ALGORITHM).encode(claims)) is None
@@ -0,0 +1,117 @@
+"""
+Tests for typing indicator aggregation
+"""
+import asyncio
+import json
+import pytest
+from app.chat.typing_indicators import TypingAggregator
+from app.chat.websocket import ConnectionManager, coalesce_key_for
+from tests.test_connection_manager import FakeWebSocket, wait_for
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+async def room_with_socket(room_id: int = 1):
+    manager = ConnectionManager(redis_client=fakeredis.FakeAsyncRedis(), delivery_mode="local")
+    ws = FakeWebSocket()
+    await manager.connect(ws, room_id, user_id=99)
+    return manager, ws
+
+
+def snapshots(ws: FakeWebSocket) -> list:
+    return [json.loads(frame) for frame in ws.sent]
+
+
+def test_keystrokes_coalesce_into_one_snapshot():
+    """Test a burst of typing reports produces a single frame per tick"""
+    async def scenario():
+        manager, ws = await room_with_socket()
+        typing = TypingAggregator(manager, tick_interval=60, ttl=5)
+
+        for _ in range(100):
+            typing.update(1, 5, "john", True)
+        typing.update(1, 6, "jane", True)
+        await typing.tick()
+        # still typing, nothing changed
+        typing.update(1, 5, "john", True)
+        await typing.tick()
+
+        assert await wait_for(lambda: len(ws.sent) == 1)
+        await asyncio.sleep(0.01)
+        [snapshot] = snapshots(ws)
+        assert snapshot["type"] == "typing" and snapshot["room_id"] == 1
+        assert snapshot["users"] == [
+            {"user_id": 5, "username": "john"},
+            {"user_id": 6, "username": "jane"},
+        ]
+        await typing.stop()
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_stopping_and_expiry_update_the_snapshot():
+    """Test users leave the snapshot when they stop or their state expires"""
+    async def scenario():
+        manager, ws = await room_with_socket()
+        typing = TypingAggregator(manager, tick_interval=60, ttl=0.05)
+
+        typing.update(1, 5, "john", True)
+        typing.update(1, 6, "jane", True)
+        await typing.tick()
+        # unsent snapshots of a node supersede each other, let each one out
+        assert await wait_for(lambda: len(ws.sent) == 1)
+        typing.update(1, 5, "john", False)
+        await typing.tick()
+        assert await wait_for(lambda: len(ws.sent) == 2)
+        await asyncio.sleep(0.06)
+        await typing.tick()
+
+        assert await wait_for(lambda: len(ws.sent) == 3)
+        assert [[u["user_id"] for u in s["users"]] for s in snapshots(ws)] == [[5, 6], [6], []]
+        assert typing.rooms == {}
+        await typing.stop()
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_clear_user_stops_typing_everywhere():
+    """Test a closed socket's user stops typing in all rooms"""
+    async def scenario():
+        typing = TypingAggregator(ConnectionManager(redis_client=fakeredis.FakeAsyncRedis(), delivery_mode="local"))
+        typing.update(1, 5, "john", True)
+        typing.update(2, 5, "john", True)
+        typing.update(2, 6, "jane", True)
+        typing.dirty.clear()
+
+        typing.clear_user(5)
+
+        assert typing.dirty == {1, 2}
+        assert typing.snapshot(2)["users"] == [{"user_id": 6, "username": "jane"}]
+        await typing.stop()
+
+    asyncio.run(scenario())
+
+
+def test_tick_task_sends_snapshots():
+    """Test the background task flushes changed rooms on its own"""
+    async def scenario():
+        manager, ws = await room_with_socket()
+        typing = TypingAggregator(manager, tick_interval=0.01, ttl=5)
+
+        typing.update(1, 5, "john", True)
+
+        assert await wait_for(lambda: len(ws.sent) == 1)
+        await typing.stop()
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_snapshots_coalesce_per_node():
+    """Test queued snapshots of a node supersede each other, not other nodes'"""
+    snapshot = {"type": "typing", "room_id": 1, "node": "a", "users": []}
+
+    assert coalesce_key_for(1, snapshot) == "typing:1:a"
+    assert coalesce_key_for(1, {**snapshot, "node": "b"}) != coalesce_key_for(1, snapshot)
@@ -1,62 +1,23 @@
 """
 Tests for WebSocket functionality
 """
+import asyncio
 import pytest
+from unittest.mock import Mock
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from app.main import app
 from app.models.user import User
 from app.models.chat import ChatRoom, RoomType
 from app.core.security import create_access_token
 from app.database.database import get_db
+from app.chat import ws_routes
+from app.chat.websocket import ConnectionManager
+from app.chat.presence import PresenceService
+from tests.conftest import IdleWebSocket, ScriptedWebSocket
 import json
 
 
-@pytest.fixture
-def test_user(db_session):
-    """Create a test user"""
-    from app.core.security import get_password_hash
-    user = User(
-        email="testuser@example.com",
-        username="testuser",
-        hashed_password=get_password_hash("testpassword123")
-    )
-    db_session.add(user)
-    db_session.commit()
-    db_session.refresh(user)
-    return user
-
-
-@pytest.fixture
-def test_user2(db_session):
-    """Create a second test user"""
-    from app.core.security import get_password_hash
-    user = User(
-        email="testuser2@example.com",
-        username="testuser2",
-        hashed_password=get_password_hash("testpassword123")
-    )
-    db_session.add(user)
-    db_session.commit()
-    db_session.refresh(user)
-    return user
-
-
-@pytest.fixture
-def test_room(db_session, test_user, test_user2):
-    """Create a test chat room with two members"""
-    room = ChatRoom(
-        name="Test Room",
-        room_type=RoomType.group,
-        created_by=test_user.id
-    )
-    room.members.append(test_user)
-    room.members.append(test_user2)
-    db_session.add(room)
-    db_session.commit()
-    db_session.refresh(room)
-    return room
-
-
 @pytest.fixture
 def auth_token(test_user):
     """Generate JWT token for test user"""
@@ -183,11 +144,123 @@ def test_websocket_typing_indicator(client, test_room, auth_token, test_user):
         }
         websocket.send_text(json.dumps(typing_data))
         
-        # receive the broadcasted typing indicator
+        # receive the room's typing snapshot
         response = websocket.receive_text()
         response_data = json.loads(response)
         
         assert response_data["type"] == "typing"
         assert response_data["room_id"] == test_room.id
-        assert response_data["user_id"] == test_user.id
-        assert response_data["is_typing"] is True
+        assert response_data["users"] == [{"user_id": test_user.id, "username": test_user.username}]
+
+
+def test_idle_sockets_hold_no_db_connections(test_room, test_user, monkeypatch):
+    """Test pool checkouts return to zero while 500 sockets sit idle"""
+    token = create_access_token(data={"sub": str(test_user.id)})
+    # a pooled engine, the test engine does not pool connections
+    fakeredis = pytest.importorskip("fakeredis")
+    pooled = create_async_engine("sqlite+aiosqlite:///./test.db")
+    sessions = async_sessionmaker(pooled, expire_on_commit=False)
+    monkeypatch.setattr(ws_routes, "session_factory", sessions)
+    monkeypatch.setattr(ws_routes, "manager", ConnectionManager(redis_client=Mock(), delivery_mode="local"))
+    monkeypatch.setattr(ws_routes, "presence", PresenceService(
+        redis_client=fakeredis.FakeAsyncRedis(), session_factory=sessions
+    ))
+    
+    async def scenario():
+        sockets = [IdleWebSocket() for _ in range(500)]
+        tasks = [
+            asyncio.create_task(ws_routes.websocket_chat_endpoint(ws, test_room.id, token))
+            for ws in sockets
+        ]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 10
+        while len(ws_routes.manager.active_connections.get(test_room.id, ())) < 500:
+            assert loop.time() < deadline
+            await asyncio.sleep(0.01)
+        
+        assert all(ws.closed_with is None for ws in sockets)
+        assert pooled.pool.checkedout() == 0
+        
+        for ws in sockets:
+            ws.hang_up.set()
+        await asyncio.gather(*tasks)
+        assert test_room.id not in ws_routes.manager.active_connections
+        await ws_routes.presence.stop()
+        await pooled.dispose()
+    
+    asyncio.run(scenario())
+
+
+def test_notifications_socket_routes_all_rooms(test_room, test_user, db_session, monkeypatch):
+    """Test the notifications socket joins every room of the user on one connection"""
+    fakeredis = pytest.importorskip("fakeredis")
+    other_room = ChatRoom(name="Other Room", room_type=RoomType.group, created_by=test_user.id)
+    other_room.members.append(test_user)
+    foreign_room = ChatRoom(name="Foreign Room", room_type=RoomType.group, created_by=test_user.id)
+    db_session.add_all([other_room, foreign_room])
+    db_session.commit()
+    token = create_access_token(data={"sub": str(test_user.id)})
+    manager = ConnectionManager(redis_client=fakeredis.FakeAsyncRedis(), delivery_mode="local")
+    monkeypatch.setattr(ws_routes, "manager", manager)
+    
+    async def scenario():
+        ws = ScriptedWebSocket([
+            {"type": "subscribe", "room_id": foreign_room.id},
+            {"type": "unsubscribe", "room_id": other_room.id},
+        ])
+        task = asyncio.create_task(ws_routes.websocket_notifications_endpoint(ws, token))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 5
+        while len(ws.sent) < 3:
+            assert loop.time() < deadline
+            await asyncio.sleep(0.01)
+        
+        connected, error, unsubscribed = ws.sent
+        assert connected["rooms"] == sorted([test_room.id, other_room.id])
+        assert error["type"] == "error" and error["room_id"] == foreign_room.id
+        assert unsubscribed == {"type": "unsubscribed", "room_id": other_room.id}
+        assert len(manager.connections) == 1
+        assert set(manager.active_connections) == {test_room.id}
+        
+        await manager.broadcast_to_room(test_room.id, {"type": "message", "room_id": test_room.id})
+        while len(ws.sent) < 4:
+            assert loop.time() < deadline
+            await asyncio.sleep(0.01)
+        assert ws.sent[3]["room_id"] == test_room.id
+        
+        ws.hang_up.set()
+        await task
+        assert manager.connections == {} and manager.active_connections == {}
+    
+    asyncio.run(scenario())
+
+
+def test_notifications_socket_rejects_bad_room_ids(test_room, test_user, monkeypatch):
+    """Test room_id values that are not integers get an error instead of a lookup"""
+    fakeredis = pytest.importorskip("fakeredis")
+    token = create_access_token(data={"sub": str(test_user.id)})
+    manager = ConnectionManager(redis_client=fakeredis.FakeAsyncRedis(), delivery_mode="local")
+    monkeypatch.setattr(ws_routes, "manager", manager)
+    
+    async def scenario():
+        ws = ScriptedWebSocket([
+            {"type": "subscribe", "room_id": [1]},
+            {"type": "subscribe", "room_id": "1; drop"},
+            {"type": "subscribe", "room_id": True},
+            {"type": "unsubscribe", "room_id": str(test_room.id)},
+        ])
+        task = asyncio.create_task(ws_routes.websocket_notifications_endpoint(ws, token))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 5
+        while len(ws.sent) < 5:
+            assert loop.time() < deadline
+            await asyncio.sleep(0.01)
+        ws.hang_up.set()
+        await task
+        return ws.sent
+    
+    connected, *errors, unsubscribed = asyncio.run(scenario())
+    
+    assert connected["rooms"] == [test_room.id]
+    assert all(e["type"] == "error" and "room_id must be an integer" in e["message"] for e in errors)
+    assert unsubscribed == {"type": "unsubscribed", "room_id": test_room.id}
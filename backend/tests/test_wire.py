@@ -0,0 +1,99 @@
+"""
+Tests for the negotiable WebSocket wire formats
+"""
+import asyncio
+import json
+import pytest
+from app.chat import wire
+from app.chat.websocket import ConnectionManager
+from app.chat.wire import (
+    JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL, decode_message, from_compact,
+    negotiate_subprotocol, to_compact
+)
+from tests.test_connection_manager import FakeWebSocket, wait_for
+
+msgpack = pytest.importorskip("msgpack")
+fakeredis = pytest.importorskip("fakeredis")
+
+CHAT_MESSAGE = {
+    "type": "message",
+    "data": {
+        "id": 42,
+        "room_id": 1,
+        "sender_id": 5,
+        "sender_username": "john_doe",
+        "content": "hello",
+        "timestamp": "2024-01-01T12:00:00",
+        "is_edited": False,
+        "message_type": "text"
+    }
+}
+
+
+class OfferingWebSocket(FakeWebSocket):
+    """A client offering subprotocols in its handshake"""
+
+    def __init__(self, *subprotocols):
+        super().__init__()
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.subprotocol = None
+
+    async def accept(self, subprotocol=None):
+        await super().accept()
+        self.subprotocol = subprotocol
+
+
+def test_compact_form_tags_keys_and_timestamps():
+    """Test keys get short tags and ISO timestamps become epoch milliseconds"""
+    compact = to_compact(CHAT_MESSAGE)
+
+    assert compact["t"] == "message"
+    assert compact["d"]["u"] == "john_doe"
+    assert compact["d"]["ts"] == 1704110400000
+    expanded = from_compact(compact)
+    assert expanded["data"]["timestamp"] == 1704110400000
+    assert {**expanded["data"], "timestamp": CHAT_MESSAGE["data"]["timestamp"]} == CHAT_MESSAGE["data"]
+    assert len(msgpack.packb(compact)) < len(json.dumps(CHAT_MESSAGE, separators=(",", ":")))
+
+
+def test_negotiation_follows_client_preference(monkeypatch):
+    """Test the first offered subprotocol the server speaks is chosen"""
+    assert negotiate_subprotocol(OfferingWebSocket(MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL)) == MSGPACK_SUBPROTOCOL
+    assert negotiate_subprotocol(OfferingWebSocket("graphql-ws", JSON_SUBPROTOCOL)) == JSON_SUBPROTOCOL
+    assert negotiate_subprotocol(OfferingWebSocket()) is None
+
+    monkeypatch.setattr(wire.settings, "WS_COMPACT_PROTOCOL", False)
+    assert negotiate_subprotocol(OfferingWebSocket(MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL)) == JSON_SUBPROTOCOL
+
+
+def test_compact_and_json_clients_share_a_broadcast():
+    """Test one broadcast reaches JSON clients as text and compact clients as msgpack"""
+    async def scenario():
+        manager = ConnectionManager(redis_client=fakeredis.FakeAsyncRedis(), delivery_mode="local")
+        json_ws = OfferingWebSocket()
+        compact_ws = [OfferingWebSocket(MSGPACK_SUBPROTOCOL) for _ in range(2)]
+        for ws in [json_ws, *compact_ws]:
+            await manager.connect(ws, 1, user_id=1, subprotocol=negotiate_subprotocol(ws))
+
+        await manager.broadcast_to_room(1, CHAT_MESSAGE)
+
+        assert await wait_for(lambda: all(ws.sent for ws in [json_ws, *compact_ws]))
+        assert compact_ws[0].subprotocol == MSGPACK_SUBPROTOCOL and json_ws.subprotocol is None
+        assert json.loads(json_ws.sent[0]) == CHAT_MESSAGE
+        # the compact form is encoded once and shared
+        assert compact_ws[0].sent[0] is compact_ws[1].sent[0]
+        assert decode_message(compact_ws[0].sent[0])["data"]["content"] == "hello"
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_client_frames_decode_in_both_formats():
+    """Test compact client frames expand to the JSON message, garbage is rejected"""
+    frame = msgpack.packb({"t": "typing", "r": 3, "it": True})
+
+    assert decode_message(frame) == {"type": "typing", "room_id": 3, "is_typing": True}
+    assert decode_message('{"type": "message"}') == {"type": "message"}
+    for garbage in (b"\xc1", "not a json", "[1, 2]"):
+        with pytest.raises(ValueError):
+            decode_message(garbage)
@@ -1,4 +1,4 @@
-import React, { createContext, useState, useEffect, ReactNode, useCallback } from 'react';
+import React, { createContext, useState, useEffect, ReactNode, useCallback, useRef } from 'react';
 import { ChatRoom, Message, CreateRoomData } from '../types';
 import { chatApi } from '../services/api';
 import { useAuth } from '../hooks/useAuth';
@@ -13,7 +13,7 @@ interface ChatContextType {
   loadRooms: () => Promise<void>;
   selectRoom: (roomId: number) => Promise<void>;
   createRoom: (roomData: CreateRoomData) => Promise<ChatRoom>;
-  loadMessages: (roomId: number, page?: number) => Promise<void>;
+  loadMessages: (roomId: number, loadOlder?: boolean) => Promise<void>;
   sendMessage: (content: string) => Promise<void>;
   addMessage: (message: Message) => void;
   clearError: () => void;
@@ -33,6 +33,8 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [hasMoreMessages, setHasMoreMessages] = useState(false);
+  // cursor of the next page of older messages in the current room
+  const nextCursorRef = useRef<string | null>(null);
 
   // load rooms when user is authenticated
   useEffect(() => {
@@ -112,12 +114,14 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
     []
   );
 
-  const loadMessages = useCallback(async (roomId: number, page: number = 1) => {
+  const loadMessages = useCallback(async (roomId: number, loadOlder: boolean = false) => {
     setError(null);
     try {
-      const response = await chatApi.getMessages(roomId, page);
+      const cursor = loadOlder ? nextCursorRef.current ?? undefined : undefined;
+      const response = await chatApi.getMessages(roomId, cursor);
+      nextCursorRef.current = response.next_cursor;
       
-      if (page === 1) {
+      if (!loadOlder) {
         // first page, replace messages
         setMessages(response.messages);
       } else {
@@ -23,7 +23,6 @@ const ChatRoomView: React.FC = () => {
   
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const messagesContainerRef = useRef<HTMLDivElement>(null);
-  const [currentPage, setCurrentPage] = useState(1);
   const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [wsError, setWsError] = useState<string | null>(null);
   const [useRestFallback, setUseRestFallback] = useState(false);
@@ -61,7 +60,6 @@ const ChatRoomView: React.FC = () => {
       const id = parseInt(roomId, 10);
       if (!isNaN(id)) {
         selectRoom(id);
-        setCurrentPage(1);
       }
     }
   }, [roomId, selectRoom]);
@@ -102,9 +100,7 @@ const ChatRoomView: React.FC = () => {
     const previousScrollHeight = messagesContainerRef.current?.scrollHeight || 0;
 
     try {
-      const nextPage = currentPage + 1;
-      await loadMessages(currentRoom.id, nextPage);
-      setCurrentPage(nextPage);
+      await loadMessages(currentRoom.id, true);
 
       // maintain scroll position after loading more messages
       setTimeout(() => {
@@ -205,13 +205,13 @@ export const chatApi = {
 
   getMessages: async (
     roomId: number,
-    page: number = 1,
+    cursor?: string,
     pageSize: number = 50
   ): Promise<MessageListResponse> => {
     const response = await apiClient.get<MessageListResponse>(
       `/api/v1/chat/rooms/${roomId}/messages`,
       {
-        params: { page, page_size: pageSize },
+        params: { cursor, page_size: pageSize },
       }
     );
     return response.data;
@@ -24,6 +24,8 @@ export class WebSocketService {
   private reconnectTimer: NodeJS.Timeout | null = null;
   private messageQueue: string[] = [];
   private isIntentionalClose = false;
+  // newest message received, replayed from on reconnect
+  private lastSeenId: number | null = null;
 
   // event listeners
   private messageListeners: MessageCallback[] = [];
@@ -57,6 +59,7 @@ export class WebSocketService {
     this.token = token;
     this.isIntentionalClose = false;
     this.reconnectAttempts = 0;
+    this.lastSeenId = null;
 
     this.createWebSocket();
   }
@@ -71,7 +74,11 @@ export class WebSocketService {
     }
 
     const wsBaseUrl = process.env.REACT_APP_WS_BASE_URL || 'ws://localhost:8000';
-    const wsUrl = `${wsBaseUrl}/ws/chat/${this.roomId}?token=${this.token}`;
+    let wsUrl = `${wsBaseUrl}/ws/chat/${this.roomId}?token=${this.token}`;
+    if (this.lastSeenId !== null) {
+      // ask the server for the messages missed while disconnected
+      wsUrl += `&last_seen_id=${this.lastSeenId}`;
+    }
 
     try {
       this.notifyStatusChange('connecting');
@@ -112,9 +119,14 @@ export class WebSocketService {
 
       // handle different message types
       if (data.type === 'message' && data.data) {
-        const message: Message = data.data;
-        console.log('[WebSocket] Notifying message listeners with:', message);
-        this.notifyMessage(message);
+        this.receiveMessage(data.data);
+      } else if (data.type === 'batch' && Array.isArray(data.messages)) {
+        // several messages sent together, in order
+        data.messages.forEach((message: Message) => this.receiveMessage(message));
+      } else if (data.type === 'replay_complete') {
+        if (!data.complete) {
+          console.warn(`Replay of room ${data.room_id} incomplete, reload the history to fill the gap`);
+        }
       } else if (data.type === 'error') {
         console.error('WebSocket error message:', data.data);
         this.notifyError(new Error(data.data.message || 'WebSocket error'));
@@ -127,6 +139,17 @@ export class WebSocketService {
     }
   }
 
+  /**
+   * Track and dispatch one chat message from a message or batch frame
+   */
+  private receiveMessage(message: Message): void {
+    if (this.lastSeenId === null || message.id > this.lastSeenId) {
+      this.lastSeenId = message.id;
+    }
+    console.log('[WebSocket] Notifying message listeners with:', message);
+    this.notifyMessage(message);
+  }
+
   /**
    * Handle WebSocket error event
    */
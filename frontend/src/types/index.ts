@@ -93,11 +93,14 @@ export interface CreateRoomData {
   member_ids: number[];
 }
 
-// message list response with pagination
+// message list response with cursor pagination
 export interface MessageListResponse {
   messages: Message[];
-  total: number;
-  page: number;
+  total: number | null;
+  page: number | null;
   page_size: number;
   has_more: boolean;
+  has_newer: boolean;
+  next_cursor: string | null;
+  prev_cursor: string | null;
 }